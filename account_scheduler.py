@@ -0,0 +1,207 @@
+# account_scheduler.py
+
+import heapq
+import itertools
+import time
+from datetime import datetime, timedelta
+
+from async_tiktok_data_manager import AsyncTikTokDataManager
+from config.config import Config
+from custom_globals import Globals
+
+class AccountScheduler(object):
+    """按下次到期时间维护账户的小顶堆。
+
+    启动时全量加载一次有效账户，之后只按关系表的增量（新增关系、状态变更）增删账户，
+    抓取完成后按结果重新计算到期时间入堆。堆中的过期条目采用惰性删除：
+    只有与 accounts 中记录的序号一致的条目才有效。
+
+    mode 为 'sql' 时不在内存中保存全部账户，每次刷新只通过 next_due_at 索引
+    取出已到期的一批账户，堆中只保留这批账户和等待重试的失败账户。
+    处理中和堆中已有的账户在数据库中仍是到期状态，查询时排除它们，避免占满每批的名额。
+    新账户没有 tiktok_account 行、也就没有 next_due_at：启动时为全部有效关系补一次占位行，
+    之后只为关系表增量中的账户补，不再每次刷新都对整个关系表做反连接。
+
+    到期时间始终取自数据库的 next_due_at 生成列，不在 Python 中重复其计算规则。
+    """
+    def __init__(self, data_manager: AsyncTikTokDataManager, mode=None):
+        self.data_manager = data_manager
+        self.mode = mode or Config.ACCOUNT_SCHEDULER
+        self.user = 'AccountScheduler'
+        self.heap = []  # (priority_time, seq, account_name)
+        self.accounts = {}  # account_name -> account dict，含当前有效的 'seq'
+        self.inflight = set()  # 已出堆、正在处理的账户名
+        self.removed = set()  # 处理中被停用的账户，完成后不再入堆
+        self.seq = itertools.count()
+        self.last_record_id = 0
+        self.last_sync = None
+        self.last_full_reload = 0
+        self.last_refresh = 0
+
+    def __len__(self):
+        return len(self.accounts)
+
+    def schedule(self, account, priority_time):
+        account['priority_time'] = priority_time
+        account['seq'] = next(self.seq)
+        self.accounts[account['account_name']] = account
+        heapq.heappush(self.heap, (priority_time, account['seq'], account['account_name']))
+
+    def remove(self, account_name):
+        self.accounts.pop(account_name, None)
+        if account_name in self.inflight:
+            self.removed.add(account_name)
+
+    def upsert(self, account):
+        """加入新出现的账户；已在堆中或处理中的账户保留内存中的到期时间。"""
+        account_name = account['account_name']
+        self.removed.discard(account_name)
+        if account_name in self.inflight or account_name in self.accounts:
+            return
+        self.schedule(account, account['priority_time'])
+
+    async def refresh(self, force=False):
+        """按需从数据库同步：定期全量重载，其余时间只拉取关系表增量。"""
+        now = time.time()
+        if not force and now - self.last_refresh < Config.ACCOUNT_REFRESH_INTERVAL:
+            return
+        self.last_refresh = now
+        if self.mode == 'sql':
+            await self.load_due()
+        elif force or now - self.last_full_reload >= Config.ACCOUNT_FULL_RELOAD_INTERVAL:
+            await self.full_reload()
+        else:
+            await self.load_changes()
+
+    async def full_reload(self):
+        sync_started = datetime.now()
+        max_record_id = await self.data_manager.get_max_relationship_id()
+        accounts = await self.data_manager.get_account_schedule()
+        if accounts is None:
+            return
+        active = {account['account_name'] for account in accounts}
+        for account_name in list(self.accounts):
+            if account_name not in active:
+                self.remove(account_name)
+        for account_name in self.inflight - active:
+            self.removed.add(account_name)
+        for account in accounts:
+            self.upsert(account)
+        self.compact()
+        self.last_record_id = max_record_id
+        self.last_sync = sync_started
+        self.last_full_reload = time.time()
+        Globals.logger.debug(f"Full reload: {len(self.accounts)} scheduled, {len(self.inflight)} in flight.", self.user)
+
+    async def fetch_changes(self):
+        """拉取上次同步以来变化过的关系涉及的账户名，返回 (账户名集合, 新的 record_id, 同步时间)；出错时集合为 None。"""
+        # 留出一秒重叠，避免与数据库时钟的细微偏差漏掉更新
+        sync_started = datetime.now() - timedelta(seconds=1)
+        # 关系过了 end_date 不会更新 updated_at，跨天后额外取出上次同步以来过期的关系
+        expired_since = None
+        if sync_started.date() != self.last_sync.date():
+            expired_since = self.last_sync.date() - timedelta(days=1)
+        max_record_id, changed = await self.data_manager.get_relationship_changes(
+            self.last_record_id, self.last_sync, expired_since
+        )
+        return changed, max_record_id, sync_started
+
+    async def load_changes(self):
+        changed, max_record_id, sync_started = await self.fetch_changes()
+        if changed is None:
+            return
+        if changed:
+            accounts = await self.data_manager.get_account_schedule(list(changed))
+            if accounts is None:
+                return
+            active = {account['account_name'] for account in accounts}
+            for account_name in changed - active:
+                self.remove(account_name)
+            for account in accounts:
+                self.upsert(account)
+            Globals.logger.debug(f"Applied {len(changed)} relationship changes.", self.user)
+        self.last_record_id = max_record_id
+        self.last_sync = sync_started
+
+    async def seed_new_accounts(self):
+        """为新出现的账户补 tiktok_account 占位行：首次检查全部有效关系，之后只检查关系表的增量。"""
+        if self.last_sync is None:
+            sync_started = datetime.now()
+            max_record_id = await self.data_manager.get_max_relationship_id()
+            if await self.data_manager.seed_new_accounts():
+                self.last_record_id = max_record_id
+                self.last_sync = sync_started
+            return
+        changed, max_record_id, sync_started = await self.fetch_changes()
+        if changed is None or not await self.data_manager.seed_new_accounts(list(changed)):
+            return
+        self.last_record_id = max_record_id
+        self.last_sync = sync_started
+
+    async def load_due(self):
+        """为新账户补占位行，然后从数据库取出一批已到期、且不在调度器中的账户入堆。"""
+        await self.seed_new_accounts()
+        accounts = await self.data_manager.get_active_tiktok_accounts(
+            limit=Config.ACCOUNT_QUEUE_SIZE,
+            exclude=list(self.inflight | set(self.accounts))
+        )
+        for account in accounts:
+            self.upsert(account)
+        self.compact()
+
+    def compact(self):
+        """过期条目过多时重建堆。"""
+        if len(self.heap) > 2 * len(self.accounts) + 64:
+            self.heap = [
+                (account['priority_time'], account['seq'], account_name)
+                for account_name, account in self.accounts.items()
+            ]
+            heapq.heapify(self.heap)
+
+    def pop_due(self, now=None):
+        """弹出一个已到期的账户并标记为处理中；没有到期账户时返回 None。"""
+        now = time.time() if now is None else now
+        while self.heap and self.heap[0][0] <= now:
+            priority_time, seq, account_name = heapq.heappop(self.heap)
+            account = self.accounts.get(account_name)
+            if account is None or account['seq'] != seq:
+                continue
+            del self.accounts[account_name]
+            self.inflight.add(account_name)
+            return account
+        return None
+
+    def next_due_in(self, now=None):
+        """距离下一个账户到期的秒数；堆为空时返回 None。"""
+        now = time.time() if now is None else now
+        while self.heap:
+            priority_time, seq, account_name = self.heap[0]
+            account = self.accounts.get(account_name)
+            if account is None or account['seq'] != seq:
+                heapq.heappop(self.heap)
+                continue
+            return max(0, priority_time - now)
+        return None
+
+    async def complete(self, account, comments):
+        """账户处理结束后按结果重新入堆；comments 为空表示本次失败，稍后重试。
+
+        成功时到期时间读取数据库的 next_due_at；读取失败或结果没有写入（仍为过去的时间）时按重试间隔推迟，避免立即重抓。
+        """
+        account_name = account['account_name']
+        self.inflight.discard(account_name)
+        if account_name in self.removed:
+            self.removed.discard(account_name)
+            return
+        now = time.time()
+        if comments and self.mode == 'sql':
+            # 到期时间已由数据库的 next_due_at 维护
+            return
+        priority_time = now + Config.ACCOUNT_RETRY_DELAY
+        if comments:
+            account['comments'] = comments
+            account['updated_at'] = datetime.now()
+            next_due_at = await self.data_manager.get_next_due_at(account_name)
+            if next_due_at:
+                priority_time = max(priority_time, next_due_at.timestamp())
+        self.schedule(account, priority_time)
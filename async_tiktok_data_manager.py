@@ -1,6 +1,5 @@
 # async_tiktok_data_manager.py
 
-import time
 from models import AsyncSessionLocal
 from models.proxy_url import ProxyUrl
 from models.tiktok_relationship import TikTokRelationship
@@ -8,69 +7,169 @@ from models.tiktok_account import TikTokAccount
 from models.tiktok_video_details import TikTokVideoDetails
 from models.tiktok_user_details import TikTokUserDetails
 from sqlalchemy.future import select
-from sqlalchemy.sql import func
+from sqlalchemy import bindparam, update
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.sql import and_, exists, func, literal, or_
 from typing import List
+from datetime import datetime
 
+from config.config import Config
 from custom_globals import Globals
 
 class AsyncTikTokDataManager(object):
+    # 新账户占位行的 updated_at：next_due_at 随之落在很久以前，新账户经 next_due_at 索引立即到期并排在最前
+    NEW_ACCOUNT_UPDATED_AT = datetime(2000, 1, 1)
+
     def __init__(self):
         self.user = 'AsyncTikTokDataManager'
 
-    async def get_active_tiktok_accounts(self) -> List[dict]:
+    def build_account(self, row):
+        tiktok_account = row.tiktok_account
+        return {
+            'account_name': tiktok_account,
+            'tiktok_id': row.tiktok_id,
+            'sec_uid': row.sec_uid,
+            'unique_id': tiktok_account.rsplit('@', 1)[-1].replace(' ', '') if '@' in tiktok_account else tiktok_account.replace(' ', ''),
+            'updated_at': row.updated_at,
+            'comments': row.comments,
+            'video_watermark': row.video_watermark,
+            'last_full_sync_at': row.last_full_sync_at,
+            'profile_fetched_at': row.profile_fetched_at,
+            # next_due_at 为空表示账户尚未抓取过，立即到期
+            'priority_time': row.next_due_at.timestamp() if row.next_due_at else 0
+        }
+
+    def valid_relationship_clause(self):
+        """关系有效：已启用且未过结束日期。"""
+        return and_(
+            TikTokRelationship.status == True,
+            or_(TikTokRelationship.end_date.is_(None), TikTokRelationship.end_date >= func.curdate())
+        )
+
+    def account_columns(self, account_column):
+        return (
+            account_column,
+            TikTokAccount.tiktok_id,
+            TikTokAccount.sec_uid,
+            TikTokAccount.updated_at,
+            TikTokAccount.comments,
+            TikTokAccount.next_due_at,
+            TikTokAccount.video_watermark,
+            TikTokAccount.last_full_sync_at,
+            TikTokAccount.profile_fetched_at
+        )
+
+    def active_accounts_query(self, account_names=None):
+        subquery = select(TikTokRelationship.tiktok_account).where(self.valid_relationship_clause())
+        if account_names is not None:
+            subquery = subquery.where(TikTokRelationship.tiktok_account.in_(account_names))
+        subquery = subquery.distinct().subquery()
+        return select(*self.account_columns(subquery.c.tiktok_account)).outerjoin(
+            TikTokAccount,
+            TikTokAccount.tiktok_account == subquery.c.tiktok_account
+        )
+
+    async def seed_new_accounts(self, account_names=None) -> bool:
+        """为关系有效、但还没有 tiktok_account 行的账户插入占位行，使新账户也能经 next_due_at 索引到期。
+
+        account_names 为空时检查全部有效关系（只在启动时执行一次），否则只检查这些账户（关系表的增量）。
+        """
+        if account_names is not None and not account_names:
+            return True
         async with AsyncSessionLocal() as session:
             try:
-                subquery = select(TikTokRelationship.tiktok_account).where(TikTokRelationship.status == True).subquery()
-                query = select(
-                    subquery.c.tiktok_account,
-                    TikTokAccount.tiktok_id,
-                    TikTokAccount.updated_at,
-                    TikTokAccount.comments
-                ).outerjoin(
+                source = select(TikTokRelationship.tiktok_account, literal(self.NEW_ACCOUNT_UPDATED_AT)).outerjoin(
                     TikTokAccount,
-                    TikTokAccount.tiktok_account == subquery.c.tiktok_account
+                    TikTokAccount.tiktok_account == TikTokRelationship.tiktok_account
+                ).where(
+                    self.valid_relationship_clause(),
+                    TikTokAccount.tiktok_account.is_(None)
                 )
+                if account_names is not None:
+                    source = source.where(TikTokRelationship.tiktok_account.in_(account_names))
+                stmt = mysql_insert(TikTokAccount).from_select(
+                    ['tiktok_account', 'updated_at'], source.distinct()
+                ).prefix_with('IGNORE')
+                await session.execute(stmt)
+                await session.commit()
+                return True
+            except Exception as e:
+                await session.rollback()
+                Globals.logger.error(f"Error occurred while seeding new accounts: {e}", self.user)
+                return False
+
+    async def get_active_tiktok_accounts(self, limit=None, exclude=None) -> List[dict]:
+        """返回已到期且关系有效的账户，按到期时间排序。
 
-                result = await session.execute(query)
-                accounts = result.fetchall()
-
-                now = time.time()
-                accounts_list = []
-                for account in accounts:
-                    tiktok_account = account.tiktok_account
-                    tiktok_id = account.tiktok_id
-                    updated_at = account.updated_at
-                    comments = account.comments
-
-                    if updated_at is None:
-                        priority_time = 0  # 不存在于 tiktok_account 表中
-                    else:
-                        timestamp = updated_at.timestamp()
-                        if comments == '获取失败':
-                            priority_time = timestamp + 1800
-                        elif comments == '账号不存在':
-                            priority_time = timestamp + 21600
-                        else:
-                            priority_time = timestamp + 600
-
-                    if priority_time > now:
-                        continue
-
-                    accounts_list.append({
-                        'account_name': tiktok_account,
-                        'tiktok_id': tiktok_id,
-                        'unique_id': tiktok_account.rsplit('@', 1)[-1].replace(' ', '') if '@' in tiktok_account else tiktok_account.replace(' ', ''),
-                        'updated_at': updated_at,
-                        'comments': comments,
-                        'priority_time': priority_time
-                    })
-                accounts_list.sort(key=lambda x: x['priority_time'])
-                return accounts_list
+        新账户已由 seed_new_accounts 插入占位行，这里只按 tiktok_account.next_due_at 索引范围扫描，
+        再用 tiktok_relationship(status, tiktok_account, end_date) 索引校验关系有效。
+        exclude 中的账户（调度器已持有的处理中或等待重试的账户）不计入 limit。
+        """
+        async with AsyncSessionLocal() as session:
+            try:
+                due_query = select(*self.account_columns(TikTokAccount.tiktok_account)).where(
+                    TikTokAccount.next_due_at <= func.now(),
+                    exists().where(
+                        TikTokRelationship.tiktok_account == TikTokAccount.tiktok_account,
+                        self.valid_relationship_clause()
+                    )
+                ).order_by(TikTokAccount.next_due_at.asc())
+                if exclude:
+                    due_query = due_query.where(TikTokAccount.tiktok_account.not_in(exclude))
+                if limit is not None:
+                    due_query = due_query.limit(limit)
+                accounts = (await session.execute(due_query)).fetchall()
+                return [self.build_account(account) for account in accounts]
             except Exception as e:
                 Globals.logger.error(f"Error occurred while fetching accounts: {e}", self.user)
                 return []
 
+    async def get_account_schedule(self, account_names=None) -> List[dict]:
+        """返回有效关系对应的全部账户及其到期时间（不过滤是否到期）；account_names 为空时返回全部。"""
+        async with AsyncSessionLocal() as session:
+            try:
+                result = await session.execute(self.active_accounts_query(account_names))
+                return [self.build_account(account) for account in result.fetchall()]
+            except Exception as e:
+                Globals.logger.error(f"Error occurred while fetching account schedule: {e}", self.user)
+                return None
+
+    async def get_relationship_changes(self, since_record_id, since_updated_at, expired_since=None):
+        """返回新增或更新过的关系涉及的账户名，以及目前最大的 record_id。
+
+        指定 expired_since（日期）时，还返回 end_date 在 expired_since 到昨天之间、因过期而失效的关系涉及的账户。
+        """
+        async with AsyncSessionLocal() as session:
+            try:
+                query = select(TikTokRelationship.record_id, TikTokRelationship.tiktok_account).where(
+                    or_(
+                        TikTokRelationship.record_id > since_record_id,
+                        TikTokRelationship.updated_at >= since_updated_at
+                    )
+                )
+                rows = (await session.execute(query)).fetchall()
+                if expired_since is not None:
+                    expired_query = select(TikTokRelationship.record_id, TikTokRelationship.tiktok_account).where(
+                        TikTokRelationship.end_date >= expired_since,
+                        TikTokRelationship.end_date < func.curdate()
+                    )
+                    rows += (await session.execute(expired_query)).fetchall()
+                max_record_id = max([since_record_id] + [row.record_id for row in rows])
+                return max_record_id, {row.tiktok_account for row in rows}
+            except Exception as e:
+                Globals.logger.error(f"Error occurred while fetching relationship changes: {e}", self.user)
+                return since_record_id, None
+
+    async def get_max_relationship_id(self):
+        async with AsyncSessionLocal() as session:
+            try:
+                return (await session.execute(select(func.max(TikTokRelationship.record_id)))).scalar() or 0
+            except Exception as e:
+                Globals.logger.error(f"Error occurred while fetching max relationship id: {e}", self.user)
+                return 0
+
     async def insert_or_update_tiktok_account(self, tiktok_account, account_data: dict):
+        # 读取的字段须包含在 projection.USER_INFO_FIELDS 中
         async with AsyncSessionLocal() as session:
             try:
                 user_info = account_data.get('userInfo')
@@ -119,7 +218,8 @@ class AsyncTikTokDataManager(object):
                     'comments': '获取成功'
                 }
 
-                await self.upsert(TikTokAccount, tiktok_account, data, session)
+                # profile_fetched_at 只属于 tiktok_account，视频轮次刷新 updated_at 时保持不变
+                await self.upsert(TikTokAccount, tiktok_account, {**data, 'profile_fetched_at': func.now()}, session)
                 await self.upsert(TikTokUserDetails, tiktok_id, data, session)
 
                 await session.commit()
@@ -137,118 +237,172 @@ class AsyncTikTokDataManager(object):
             new_record = model(**data)
             session.add(new_record)
 
-    async def insert_or_update_tiktok_video_details(self, video_datas: list):
+    @staticmethod
+    def build_video_row(video_data):
+        """把一条视频数据转换为 tiktok_video_details 的一行；读取的字段须包含在 projection.VIDEO_FIELDS 中。"""
+        video_status = video_data.get('statsV2') or {}
+        return {
+            'tiktok_video_id': video_data.get('id'),
+            'author_id': video_data.get('author', {}).get('id'),
+            'AIGCDescription': video_data.get('AIGCDescription'),
+            'CategoryType': video_data.get('CategoryType'),
+            'backendSourceEventTracking': video_data.get('backendSourceEventTracking'),
+            'collected': video_data.get('collected'),
+            'createTime': video_data.get('createTime'),
+            'video_desc': video_data.get('desc'),
+            'digged': video_data.get('digged'),
+            'diversificationId': video_data.get('diversificationId'),
+            'duetDisplay': video_data.get('duetDisplay'),
+            'duetEnabled': video_data.get('duetEnabled'),
+            'forFriend': video_data.get('forFriend'),
+            'itemCommentStatus': video_data.get('itemCommentStatus'),
+            'officalItem': video_data.get('officalItem'),
+            'originalItem': video_data.get('originalItem'),
+            'privateItem': video_data.get('privateItem'),
+            'secret': video_data.get('secret'),
+            'shareEnabled': video_data.get('shareEnabled'),
+            'stitchDisplay': video_data.get('stitchDisplay'),
+            'stitchEnabled': video_data.get('stitchEnabled'),
+            'can_repost': video_data.get('itemControl', {}).get('can_repost'),
+            'collectCount': video_status.get('collectCount'),
+            'commentCount': video_status.get('commentCount'),
+            'diggCount': video_status.get('diggCount'),
+            'playCount': video_status.get('playCount'),
+            'repostCount': video_status.get('repostCount'),
+            'shareCount': video_status.get('shareCount'),
+        }
+
+    async def insert_or_update_tiktok_video_details(self, video_datas: list) -> bool:
+        """以多行 INSERT ... ON DUPLICATE KEY UPDATE 批量写入视频，每 VIDEO_UPSERT_CHUNK 行一条语句，一次事务提交。
+
+        不经过 ORM：不逐条查询已有记录，也不构造 ORM 对象。返回是否写入成功，失败时整批回滚。
+        """
+        # 同一批中重复的视频只保留最后一条，避免同一语句内对同一主键重复更新
+        rows = list({row['tiktok_video_id']: row for row in map(self.build_video_row, video_datas)}.values())
+        if not rows:
+            return True
+        table = TikTokVideoDetails.__table__
+        stmt = mysql_insert(table)
+        updates = {key: stmt.inserted[key] for key in rows[0] if key != 'tiktok_video_id'}
+        updates['updated_at'] = func.now()
+        stmt = stmt.on_duplicate_key_update(updates)
         async with AsyncSessionLocal() as session:
             try:
-                for video_data in video_datas:
-                    tiktok_video_id = video_data.get('id')
-                    video_status = video_data.get('statsV2')
-                    data = {
-                        'tiktok_video_id': tiktok_video_id,
-                        'author_id': video_data.get('author', {}).get('id'),
-                        'AIGCDescription': video_data.get('AIGCDescription'),
-                        'CategoryType': video_data.get('CategoryType'),
-                        'backendSourceEventTracking': video_data.get('backendSourceEventTracking'),
-                        'collected': video_data.get('collected'),
-                        'createTime': video_data.get('createTime'),
-                        'video_desc': video_data.get('desc'),
-                        'digged': video_data.get('digged'),
-                        'diversificationId': video_data.get('diversificationId'),
-                        'duetDisplay': video_data.get('duetDisplay'),
-                        'duetEnabled': video_data.get('duetEnabled'),
-                        'forFriend': video_data.get('forFriend'),
-                        'itemCommentStatus': video_data.get('itemCommentStatus'),
-                        'officalItem': video_data.get('officalItem'),
-                        'originalItem': video_data.get('originalItem'),
-                        'privateItem': video_data.get('privateItem'),
-                        'secret': video_data.get('secret'),
-                        'shareEnabled': video_data.get('shareEnabled'),
-                        'stitchDisplay': video_data.get('stitchDisplay'),
-                        'stitchEnabled': video_data.get('stitchEnabled'),
-                        'can_repost': video_data.get('itemControl', {}).get('can_repost'),
-                        'collectCount': video_status.get('collectCount'),
-                        'commentCount': video_status.get('commentCount'),
-                        'diggCount': video_status.get('diggCount'),
-                        'playCount': video_status.get('playCount'),
-                        'repostCount': video_status.get('repostCount'),
-                        'shareCount': video_status.get('shareCount'),
-                        'updated_at': func.now()
-                    }
+                for start in range(0, len(rows), Config.VIDEO_UPSERT_CHUNK):
+                    await session.execute(stmt.values(rows[start:start + Config.VIDEO_UPSERT_CHUNK]))
+                await session.commit()
+                return True
 
-                    existing_video = await session.get(TikTokVideoDetails, tiktok_video_id)
+            except Exception as e:
+                await session.rollback()
+                Globals.logger.error(f"Error occurred while inserting/updating TikTok video details: {e}", self.user)
+                return False
 
-                    if existing_video:
-                        for key, value in data.items():
-                            setattr(existing_video, key, value)
-                    else:
-                        new_video = TikTokVideoDetails(**data)
-                        session.add(new_video)
+    async def get_proxy_pool(self) -> List[dict]:
+        """返回所有已分配端口的代理及其统计，供 ProxyPool 加载；出错时返回 None。"""
+        async with AsyncSessionLocal() as session:
+            try:
+                query = select(
+                    ProxyUrl.id,
+                    ProxyUrl.current_port,
+                    ProxyUrl.success_count,
+                    ProxyUrl.fail_count,
+                    ProxyUrl.avg_delay,
+                    ProxyUrl.delay_count
+                ).where(ProxyUrl.current_port != 0)
+                rows = (await session.execute(query)).fetchall()
+                return [
+                    {
+                        'id': row.id,
+                        'current_port': row.current_port,
+                        'success_count': row.success_count or 0,
+                        'fail_count': row.fail_count or 0,
+                        'avg_delay': row.avg_delay or 0,
+                        'delay_count': row.delay_count or 0
+                    }
+                    for row in rows
+                ]
+            except Exception as e:
+                Globals.logger.error(f"Error occurred while loading proxy pool: {e}", self.user)
+                return None
 
+    async def set_proxies_in_use(self, proxy_ids, is_using: bool) -> bool:
+        """批量设置代理的 is_using，返回是否写入成功。"""
+        async with AsyncSessionLocal() as session:
+            try:
+                await session.execute(
+                    update(ProxyUrl).where(ProxyUrl.id.in_(proxy_ids)).values(is_using=is_using)
+                )
                 await session.commit()
+                return True
+            except Exception as e:
+                await session.rollback()
+                Globals.logger.error(f"Error occurred while updating proxies is_using: {e}", self.user)
+                return False
 
+    async def set_proxy_delays(self, delays: List[dict]) -> bool:
+        """按主键批量写回代理的延迟统计，每项包含 id、current_delay、avg_delay、delay_count；返回是否写入成功。"""
+        async with AsyncSessionLocal() as session:
+            try:
+                await session.execute(update(ProxyUrl), delays)
+                await session.commit()
+                return True
             except Exception as e:
                 await session.rollback()
-                Globals.logger.error(f"Error occurred while inserting/updating TikTok video details: {e}", self.user)
+                Globals.logger.error(f"Error occurred while updating proxy delays: {e}", self.user)
+                return False
 
-    async def get_available_proxy(self):
-        async with Globals.get_available_proxy_lock:
-            async with AsyncSessionLocal() as session:
-                try:
-                    # query = select(ProxyUrl).where(
-                    #     ProxyUrl.is_using == False,
-                    #     ProxyUrl.avg_delay > 0
-                    # ).order_by(ProxyUrl.fail_count.asc(), ProxyUrl.avg_delay.asc())
-                    query = select(ProxyUrl).where(
-                        ProxyUrl.is_using == False
-                    ).order_by(ProxyUrl.fail_count.asc())
-                    
-                    proxies = (await session.execute(query)).scalars().all()
-                    if not proxies:
-                        return None
-
-                    selected_proxy = proxies[0]
-
-                    selected_proxy.is_using = True
-                    await session.commit()
-
-                    Globals.logger.debug(f"Selected proxy: {selected_proxy.current_port}", self.user)
-                    return {
-                        'id': selected_proxy.id,
-                        'current_port': selected_proxy.current_port
-                    }
-                except Exception as e:
-                    Globals.logger.error(f"Error occurred while fetching available proxy: {e}", self.user)
-                    return None
+    async def add_proxy_counts(self, deltas: List[dict]) -> bool:
+        """把代理成功/失败次数的增量原子地累加到数据库，每项包含 id、success、fail；返回是否写入成功。
 
-    async def set_proxy_in_use(self, proxy_id, is_using: bool):
+        同一条 UPDATE 语句以 executemany 执行，一次事务完成，不读取代理行。
+        """
+        table = ProxyUrl.__table__
+        stmt = (
+            update(table)
+            .where(table.c.id == bindparam('proxy_id'))
+            .values(
+                success_count=table.c.success_count + bindparam('success'),
+                fail_count=table.c.fail_count + bindparam('fail')
+            )
+        )
         async with AsyncSessionLocal() as session:
             try:
-                proxy = await session.get(ProxyUrl, proxy_id)
-                if proxy:
-                    proxy.is_using = is_using
-                    await session.commit()
+                await session.execute(
+                    stmt,
+                    [{'proxy_id': delta['id'], 'success': delta['success'], 'fail': delta['fail']} for delta in deltas]
+                )
+                await session.commit()
+                return True
             except Exception as e:
-                Globals.logger.error(f"Error occurred while updating proxy is_using: {e}", self.user)
+                await session.rollback()
+                Globals.logger.error(f"Error occurred while adding proxy counts: {e}", self.user)
+                return False
 
-    async def increase_proxy_success(self, proxy_id):
+    async def set_video_watermark(self, tiktok_account, video_watermark, full_sync=False):
+        """记录账户已抓取到的最新视频时间；不改变 updated_at，以免影响账户的到期时间。"""
         async with AsyncSessionLocal() as session:
             try:
-                proxy = await session.get(ProxyUrl, proxy_id)
-                if proxy:
-                    proxy.success_count += 1
-                    await session.commit()
+                values = {'video_watermark': video_watermark, 'updated_at': TikTokAccount.updated_at}
+                if full_sync:
+                    values['last_full_sync_at'] = func.now()
+                await session.execute(
+                    update(TikTokAccount).where(TikTokAccount.tiktok_account == tiktok_account).values(**values)
+                )
+                await session.commit()
             except Exception as e:
-                Globals.logger.error(f"Error occurred while increasing proxy success count: {e}", self.user)
+                await session.rollback()
+                Globals.logger.error(f"Error occurred while updating video watermark: {e}", self.user)
 
-    async def increase_proxy_fail(self, proxy_id):
+    async def get_next_due_at(self, tiktok_account):
+        """读取账户的 next_due_at 生成列；账户不存在或出错时返回 None。"""
         async with AsyncSessionLocal() as session:
             try:
-                proxy = await session.get(ProxyUrl, proxy_id)
-                if proxy:
-                    proxy.fail_count += 1
-                    await session.commit()
+                query = select(TikTokAccount.next_due_at).where(TikTokAccount.tiktok_account == tiktok_account)
+                return (await session.execute(query)).scalar()
             except Exception as e:
-                Globals.logger.error(f"Error occurred while increasing proxy fail count: {e}", self.user)
+                Globals.logger.error(f"Error occurred while fetching next_due_at: {e}", self.user)
+                return None
 
     async def set_comments(self, tiktok_account, comments):
         async with AsyncSessionLocal() as session:
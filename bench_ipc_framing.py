@@ -0,0 +1,120 @@
+# bench_ipc_framing.py
+#
+# 对比子进程响应使用 JSON 行与 msgpack 长度前缀帧时的体积、编解码耗时，
+# 以及经 ChildProcess 端到端接收大响应时父进程事件循环的最长停顿。
+# 载荷模拟 get_user_videos 返回的 video.as_dict 列表，不涉及 TikTok/Playwright。
+#
+#   python3 bench_ipc_framing.py --videos 300 --responses 20
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+import msgpack
+
+from child_process import ChildProcess
+
+# 按 playwright_session.py 的握手与帧格式回复固定的视频列表
+FAKE_CHILD = (
+    "import sys, json, struct, msgpack\n"
+    "from bench_ipc_framing import make_videos\n"
+    "framing, data = sys.argv[1], make_videos(int(sys.argv[2]))\n"
+    "sys.stdout.write(json.dumps({'hello': {'framing': framing}}) + '\\n')\n"
+    "sys.stdout.flush()\n"
+    "out = sys.stdout.buffer\n"
+    "for line in sys.stdin:\n"
+    "    response = {'status': 'success', 'data': data, 'id': json.loads(line)['id']}\n"
+    "    if framing == 'msgpack':\n"
+    "        payload = msgpack.packb(response, use_bin_type=True)\n"
+    "        out.write(struct.pack('>I', len(payload)) + payload)\n"
+    "    else:\n"
+    "        out.write((json.dumps(response) + '\\n').encode())\n"
+    "    out.flush()\n"
+)
+
+def make_videos(count):
+    """构造与 video.as_dict 结构相近的视频列表。"""
+    videos = []
+    for i in range(count):
+        videos.append({
+            "id": str(7300000000000000000 + i),
+            "desc": "video description #tag #fyp " * 4,
+            "createTime": 1700000000 + i,
+            "author": {
+                "id": "6800000000000000000",
+                "uniqueId": "someone",
+                "nickname": "Some One",
+                "secUid": "MS4wLjABAAAA" + "x" * 64,
+                "avatarThumb": "https://p16-sign.tiktokcdn.com/avatar/" + "a" * 120,
+            },
+            "stats": {"diggCount": i * 13, "shareCount": i, "commentCount": i * 2, "playCount": i * 101},
+            "video": {
+                "duration": 15 + i % 45,
+                "cover": "https://p16-sign.tiktokcdn.com/cover/" + "c" * 200,
+                "playAddr": "https://v16-webapp.tiktok.com/video/" + "p" * 300,
+                "bitrateInfo": [{"Bitrate": 500000 + j, "QualityType": j, "PlayAddr": {"UrlList": ["https://v/" + "u" * 150] * 3}} for j in range(3)],
+            },
+            "music": {"id": str(i), "title": "original sound", "playUrl": "https://sf16/" + "m" * 100},
+            "challenges": [{"id": str(j), "title": f"tag{j}"} for j in range(5)],
+            "isPinnedItem": i < 3,
+        })
+    return videos
+
+def timed(func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    return result, (time.perf_counter() - start) / repeat
+
+def codec_report(videos, repeat):
+    response = {"status": "success", "data": videos, "id": 1}
+    json_bytes, json_encode = timed(lambda: (json.dumps(response) + "\n").encode(), repeat)
+    _, json_decode = timed(lambda: json.loads(json_bytes), repeat)
+    packed, pack_encode = timed(lambda: msgpack.packb(response, use_bin_type=True), repeat)
+    _, pack_decode = timed(lambda: msgpack.unpackb(packed, raw=False), repeat)
+    for name, size, encode, decode in (
+        ("jsonl", len(json_bytes), json_encode, json_decode),
+        ("msgpack", len(packed) + 4, pack_encode, pack_decode),
+    ):
+        print(f"{name:<8} bytes={size:,} encode={encode * 1e3:.2f}ms decode={decode * 1e3:.2f}ms")
+
+async def watch_loop(stalls, stop):
+    """以 1ms 间隔让出事件循环，记录实际被唤醒的最大延迟。"""
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(0.001)
+        stalls.append(time.perf_counter() - start - 0.001)
+
+async def end_to_end(framing, videos, responses):
+    child = ChildProcess(user='Bench', timeout=120)
+    await child.start(sys.executable, "-c", FAKE_CHILD, framing, str(videos))
+    stalls = []
+    stop = asyncio.Event()
+    watcher = asyncio.create_task(watch_loop(stalls, stop))
+    start = time.perf_counter()
+    for _ in range(responses):
+        await child.send_command({"action": "get_user_videos"})
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await watcher
+    await child.terminate()
+    print(
+        f"{child.framing:<8} responses={responses} per_response={elapsed / responses * 1e3:.1f}ms "
+        f"max_loop_stall={max(stalls) * 1e3:.1f}ms"
+    )
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--videos", type=int, default=300)
+    parser.add_argument("--responses", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    codec_report(make_videos(args.videos), args.repeat)
+    for framing in ("jsonl", "msgpack"):
+        await end_to_end(framing, args.videos, args.responses)
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,105 @@
+# bench_session_ipc.py
+#
+# 对比旧的 Popen + run_in_executor(readline) 与 ChildProcess(asyncio 管道) 的单命令开销。
+# 子进程为一个只回显 JSON 行的 Python 进程，不涉及 TikTok/Playwright。
+#
+#   python3 bench_session_ipc.py --sessions 50 --commands 200
+
+import argparse
+import asyncio
+import json
+import subprocess
+import sys
+import threading
+import time
+
+from child_process import ChildProcess
+
+ECHO_CHILD = (
+    "import sys, json\n"
+    "for line in sys.stdin:\n"
+    "    command = json.loads(line)\n"
+    "    response = {'status': 'success', 'data': command, 'id': command.get('id')}\n"
+    "    sys.stdout.write(json.dumps(response) + '\\n')\n"
+    "    sys.stdout.flush()\n"
+)
+
+class LegacyChild(object):
+    """复刻旧版 Session 的管道用法：阻塞写 stdin，线程池读 stdout。"""
+    def __init__(self):
+        self.process = subprocess.Popen(
+            [sys.executable, "-c", ECHO_CHILD],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            bufsize=1
+        )
+
+    async def send_command(self, command: dict):
+        self.process.stdin.write(json.dumps(command) + "\n")
+        self.process.stdin.flush()
+        response = await asyncio.get_event_loop().run_in_executor(None, self.process.stdout.readline)
+        return json.loads(response)
+
+    async def close(self):
+        self.process.stdin.close()
+        await asyncio.get_event_loop().run_in_executor(None, self.process.wait)
+
+class AsyncChild(object):
+    def __init__(self):
+        self.child = ChildProcess(user='Bench')
+
+    async def start(self):
+        await self.child.start(sys.executable, "-c", ECHO_CHILD)
+
+    async def send_command(self, command: dict):
+        return await self.child.send_command(command)
+
+    async def close(self):
+        await self.child.terminate()
+
+async def drive(child, commands, latencies):
+    for i in range(commands):
+        start = time.perf_counter()
+        await child.send_command({"action": "echo", "seq": i})
+        latencies.append(time.perf_counter() - start)
+
+async def run(name, children, commands):
+    latencies = []
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    await asyncio.gather(*(drive(child, commands, latencies) for child in children))
+    cpu = time.process_time() - cpu_start
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    total = len(latencies)
+    print(
+        f"{name:<8} sessions={len(children)} commands={total} "
+        f"throughput={total / elapsed:,.0f}/s "
+        f"p50={latencies[total // 2] * 1e3:.3f}ms "
+        f"p99={latencies[int(total * 0.99)] * 1e3:.3f}ms "
+        f"parent_cpu/cmd={cpu / total * 1e6:.1f}us "
+        f"executor_threads={sum(t.name.startswith('asyncio_') for t in threading.enumerate())}"
+    )
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=50)
+    parser.add_argument("--commands", type=int, default=200)
+    args = parser.parse_args()
+
+    native = [AsyncChild() for _ in range(args.sessions)]
+    for child in native:
+        await child.start()
+    await run("asyncio", native, args.commands)
+    for child in native:
+        await child.close()
+
+    legacy = [LegacyChild() for _ in range(args.sessions)]
+    await run("legacy", legacy, args.commands)
+    for child in legacy:
+        await child.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,111 @@
+# bench_video_upsert.py
+#
+# 对比旧的逐条 session.get + ORM 写入与批量 INSERT ... ON DUPLICATE KEY UPDATE 写入 tiktok_video_details 的速度。
+# 连接 config 中配置的 MySQL/MariaDB（建议使用本地库），视频 ID 以 bench- 开头，结束后删除。
+# 每种写法分别测首次写入（全部插入）和再次写入（全部更新）两种情况。
+#
+#   python3 bench_video_upsert.py --videos 500 --rounds 3
+
+import argparse
+import asyncio
+import time
+
+from sqlalchemy import delete
+
+import models
+from async_tiktok_data_manager import AsyncTikTokDataManager
+from models import AsyncSessionLocal
+from models.tiktok_video_details import TikTokVideoDetails
+
+def make_videos(count, prefix, round_no=0):
+    """构造经 projection.VIDEO_FIELDS 裁剪后的视频数据。"""
+    videos = []
+    for i in range(count):
+        videos.append({
+            "id": f"{prefix}{i:08d}",
+            "author": {"id": "6800000000000000000"},
+            "AIGCDescription": "",
+            "CategoryType": i % 20,
+            "backendSourceEventTracking": "",
+            "collected": False,
+            "createTime": 1700000000 + i,
+            "desc": "video description #tag #fyp " * 4,
+            "digged": False,
+            "diversificationId": 10000 + i % 50,
+            "duetDisplay": 0,
+            "duetEnabled": True,
+            "forFriend": False,
+            "itemCommentStatus": 0,
+            "officalItem": False,
+            "originalItem": False,
+            "privateItem": False,
+            "secret": False,
+            "shareEnabled": True,
+            "stitchDisplay": 0,
+            "stitchEnabled": True,
+            "itemControl": {"can_repost": True},
+            "statsV2": {
+                "collectCount": str(i + round_no),
+                "commentCount": str(i * 2 + round_no),
+                "diggCount": str(i * 13 + round_no),
+                "playCount": str(i * 101 + round_no),
+                "repostCount": "0",
+                "shareCount": str(i + round_no),
+            },
+        })
+    return videos
+
+async def legacy_write(video_datas):
+    """复刻旧版 insert_or_update_tiktok_video_details：每条视频一次 session.get，再逐个设置 ORM 属性。"""
+    async with AsyncSessionLocal() as session:
+        for video_data in video_datas:
+            data = AsyncTikTokDataManager.build_video_row(video_data)
+            existing_video = await session.get(TikTokVideoDetails, data['tiktok_video_id'])
+            if existing_video:
+                for key, value in data.items():
+                    setattr(existing_video, key, value)
+            else:
+                session.add(TikTokVideoDetails(**data))
+        await session.commit()
+
+async def cleanup(prefix):
+    async with AsyncSessionLocal() as session:
+        await session.execute(delete(TikTokVideoDetails).where(TikTokVideoDetails.tiktok_video_id.like(f"{prefix}%")))
+        await session.commit()
+
+async def measure(name, write, videos, rounds, prefix):
+    inserts, updates = [], []
+    for round_no in range(rounds):
+        await cleanup(prefix)
+        batch = make_videos(videos, prefix, round_no)
+        start = time.perf_counter()
+        await write(batch)
+        inserts.append(time.perf_counter() - start)
+        batch = make_videos(videos, prefix, round_no + 1)
+        start = time.perf_counter()
+        await write(batch)
+        updates.append(time.perf_counter() - start)
+    await cleanup(prefix)
+    insert_time, update_time = min(inserts), min(updates)
+    print(
+        f"{name:<8} videos={videos} insert={insert_time * 1e3:.1f}ms ({videos / insert_time:,.0f} rows/s) "
+        f"update={update_time * 1e3:.1f}ms ({videos / update_time:,.0f} rows/s)"
+    )
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--videos", type=int, default=500)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--prefix", default="bench-")
+    args = parser.parse_args()
+
+    data_manager = AsyncTikTokDataManager()
+    try:
+        await measure("orm", legacy_write, args.videos, args.rounds, args.prefix)
+        await measure("upsert", data_manager.insert_or_update_tiktok_video_details, args.videos, args.rounds, args.prefix)
+    finally:
+        await cleanup(args.prefix)
+        await models.async_engine.dispose()
+
+if __name__ == "__main__":
+    asyncio.run(main())
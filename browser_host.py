@@ -0,0 +1,129 @@
+# browser_host.py
+
+import asyncio
+import itertools
+import os
+
+from child_process import ChildProcess, preferred_framing
+from config.config import Config
+from custom_globals import Globals
+
+class BrowserHost(object):
+    """在根命名空间运行的共享 Playwright 子进程，一个 Chromium 中承载多个各自使用独立代理的浏览器上下文。"""
+    def __init__(self, host_id, timeout=60):
+        self.user = f'BrowserHost-{host_id}'
+        self.timeout = timeout
+        self.process = None
+        self.generation = 0  # 每次（重新）启动子进程时递增，旧代数的上下文随旧进程一起失效
+        self.contexts = set()
+        self.opening = 0
+        self.draining = False  # 等待回收：不再分配新上下文，已有上下文全部迁走后关闭子进程
+        self.context_ids = itertools.count(1)
+        self.start_lock = asyncio.Lock()
+
+    @property
+    def load(self):
+        return len(self.contexts) + self.opening
+
+    def is_running(self):
+        return self.process is not None and self.process.is_running()
+
+    def recycle_reason(self):
+        """共享子进程的进程树内存达到回收阈值时返回原因，否则返回 None。"""
+        if not Config.SESSION_RECYCLE_RSS_MB or self.draining or not self.is_running():
+            return None
+        rss_mb = self.process.tree_rss() / (1024 * 1024)
+        if rss_mb >= Config.SESSION_RECYCLE_RSS_MB:
+            return f"RSS {rss_mb:.0f}MB"
+        return None
+
+    async def close_if_drained(self):
+        """排空中的子进程没有上下文后关闭，下次分配时重新启动。"""
+        if self.draining and self.load == 0:
+            await self.close()
+            self.draining = False
+            Globals.logger.info("Browser host recycled.", self.user)
+
+    async def ensure_started(self):
+        """子进程未运行时（重新）启动；多个上下文同时发现子进程退出时只启动一次。"""
+        async with self.start_lock:
+            if self.is_running():
+                return
+            if self.process:
+                await self.process.kill()
+            cmd = [
+                "python3", "playwright_session.py",
+                "--max-inflight", str(Config.BROWSER_HOST_CONTEXTS * Config.SESSION_MAX_INFLIGHT),
+                "--num-sessions", "0",
+                "--framing", preferred_framing(),
+                "--block", Config.CHILD_BLOCK_RESOURCES,
+                "--launch-profile", Config.CHILD_LAUNCH_PROFILE,
+                "--stream-limit", str(Config.CHILD_STREAM_LIMIT),
+            ]
+            self.process = ChildProcess(user=self.user, timeout=self.timeout)
+            await self.process.start(*cmd)
+            self.generation += 1
+            self.contexts.clear()
+            Globals.logger.debug(f"Browser host started (generation {self.generation}).", self.user)
+
+    async def open_context(self, proxy_url):
+        """打开一个使用 proxy_url 的浏览器上下文，返回 (context id, 子进程代数)。"""
+        # 打开期间即计入负载，避免并发分配超出容量
+        self.opening += 1
+        try:
+            await self.ensure_started()
+            generation = self.generation
+            context_id = next(self.context_ids)
+            try:
+                response = await self.process.send_command({"action": "open_context", "context": context_id, "proxy": proxy_url})
+            except Exception:
+                # 超时后子进程仍会在创建锁之后打开这个上下文，尽力通知其关闭，避免泄漏上下文并继续占用已归还的代理
+                await self.discard_context(context_id, generation)
+                raise
+            if not response or response.get('status') != 'success':
+                await self.discard_context(context_id, generation)
+                raise Exception(f"Failed to open context: {(response or {}).get('message', 'Unknown error')}")
+            if generation == self.generation:
+                self.contexts.add(context_id)
+            return context_id, generation
+        finally:
+            self.opening -= 1
+
+    async def discard_context(self, context_id, generation):
+        """尽力关闭一个打开失败或超时的上下文；子进程已重启时旧上下文随之消失，无需处理。"""
+        if generation != self.generation or not self.is_running():
+            return
+        try:
+            await self.process.send_command({"action": "close_context", "context": context_id})
+        except Exception as e:
+            Globals.logger.warning(f"Failed to discard context {context_id}: {e}", self.user)
+
+    async def close_context(self, context_id, generation):
+        if generation != self.generation or context_id not in self.contexts:
+            return
+        self.contexts.discard(context_id)
+        if self.is_running():
+            await self.process.send_command({"action": "close_context", "context": context_id})
+
+    async def close(self):
+        if self.process:
+            await self.process.terminate()
+            self.process = None
+        self.contexts.clear()
+
+class BrowserHostPool(object):
+    """按 CPU 数启动共享浏览器子进程，新上下文分配到负载最低的子进程上。"""
+    def __init__(self, num_hosts=None):
+        num_hosts = num_hosts or os.cpu_count() or 1
+        self.hosts = [BrowserHost(host_id) for host_id in range(1, num_hosts + 1)]
+
+    def pick(self):
+        # 排空中的子进程只在其余子进程都在排空时才继续分配
+        hosts = [host for host in self.hosts if not host.draining] or self.hosts
+        host = min(hosts, key=lambda item: item.load)
+        if host.load >= Config.BROWSER_HOST_CONTEXTS:
+            raise Exception("No browser host capacity.")
+        return host
+
+    async def close(self):
+        await asyncio.gather(*(host.close() for host in self.hosts), return_exceptions=True)
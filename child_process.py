@@ -0,0 +1,362 @@
+# child_process.py
+
+import asyncio
+import itertools
+import json
+import os
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+from config.config import Config
+from custom_globals import Globals
+
+# 子进程 stderr 的行前缀与日志级别，见 playwright_session.log；没有前缀的行按 error 记录
+STDERR_LEVELS = {
+    '[debug] ': 'debug',
+    '[info] ': 'info',
+    '[warning] ': 'warning',
+    '[error] ': 'error',
+}
+
+# 大响应在独立线程中解码，避免在事件循环上一次性解析数 MB 的数据
+decode_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='ipc-decode')
+
+FRAME_HEADER = struct.Struct('>I')
+
+def decode_frame(payload):
+    return msgpack.unpackb(payload, raw=False)
+
+def preferred_framing():
+    """向子进程请求的响应编码；本进程没有安装 msgpack 时只能使用 JSON 行。"""
+    return Config.CHILD_FRAMING if msgpack is not None else 'jsonl'
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+def process_tree_rss(pid):
+    """从 /proc 统计进程及其全部后代的常驻内存之和（字节）；进程不存在时返回 0。"""
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                # 进程名可能包含空格和括号，从最后一个 ')' 之后解析
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+
+    total = 0
+    stack = [pid]
+    while stack:
+        current = stack.pop()
+        try:
+            with open(f'/proc/{current}/statm') as f:
+                total += int(f.read().split()[1]) * PAGE_SIZE
+        except (OSError, IndexError, ValueError):
+            continue
+        stack.extend(children.get(current, []))
+    return total
+
+class ResponseStream(object):
+    """流式命令的响应队列：子进程按页发送的部分响应依次入队。
+
+    入队从不等待，读取协程不会因为某条流的消费者慢而阻塞其他命令；
+    队列长度由发送窗口限制：子进程最多先发 window 条部分响应，消费者每取走一条，父进程归还一个额度。
+    """
+    def __init__(self):
+        self.queue = asyncio.Queue()
+        self.error = None
+        self.closed = False
+
+    def put(self, message):
+        if not self.closed:
+            self.queue.put_nowait(message)
+
+    def fail(self, exc):
+        self.error = exc
+        self.queue.put_nowait(None)
+
+    async def get(self, timeout):
+        if self.error and self.queue.empty():
+            raise self.error
+        try:
+            message = await asyncio.wait_for(self.queue.get(), timeout=timeout)
+        except asyncio.TimeoutError:
+            raise Exception("Timed out waiting for response from child process")
+        if message is None:
+            raise self.error
+        return message
+
+    def close(self):
+        self.closed = True
+        while not self.queue.empty():
+            self.queue.get_nowait()
+
+class ChildProcess(object):
+    """基于 asyncio 管道管理子进程，命令为 JSON 行，不占用线程池。
+
+    每条命令携带自增的 id，子进程可并发处理多条命令并乱序返回，
+    由 read_responses 按 id 将响应分发给对应的 Future。
+    流式命令的响应由若干带 "partial": true 的部分响应和一条最终响应组成，经 ResponseStream 逐条交付。
+    流式命令按窗口做背压：命令带上 "window"，子进程每发一条部分响应消耗一个额度，
+    父进程每交付一条部分响应发回 {"action": "stream_credit"}；放弃的流发送 {"action": "cancel_stream"}。
+
+    响应的编码在子进程启动时协商：子进程先输出一行 JSON 握手 {"hello": {"framing": ...}}，
+    framing 为 msgpack 时之后的响应均为 4 字节大端长度前缀 + msgpack 数据，否则仍为 JSON 行。
+    """
+    def __init__(self, user='ChildProcess', timeout=60):
+        self.user = user
+        self.timeout = timeout
+        self.process = None
+        self.stderr_task = None
+        self.reader_task = None
+        self.pending = {}  # request_id -> Future 或 ResponseStream
+        self.abandoned = set()  # 已放弃的流，其后续响应静默丢弃，收到最终响应后移除
+        self.request_ids = itertools.count(1)
+        self.framing = 'jsonl'
+
+    async def start(self, *argv):
+        """启动子进程并开始异步转发其 stderr。"""
+        self.process = await asyncio.create_subprocess_exec(
+            *argv,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            limit=Config.CHILD_STREAM_LIMIT
+        )
+        self.stderr_task = asyncio.create_task(self.log_stderr())
+        self.reader_task = asyncio.create_task(self.read_responses())
+
+    def is_running(self):
+        return self.process is not None and self.process.returncode is None
+
+    @property
+    def inflight(self):
+        """已发送但尚未收到响应的命令数。"""
+        return len(self.pending)
+
+    @property
+    def pid(self):
+        return self.process.pid if self.process else None
+
+    def tree_rss(self):
+        """子进程树（包括 Chromium）当前占用的常驻内存（字节）。"""
+        return process_tree_rss(self.process.pid) if self.is_running() else 0
+
+    async def log_stderr(self):
+        """异步读取子进程的stderr并按行前缀的级别记录日志"""
+        try:
+            while True:
+                line = await self.process.stderr.readline()
+                if not line:
+                    break
+                text = line.decode(errors='replace').strip()
+                level = 'error'
+                for prefix, prefix_level in STDERR_LEVELS.items():
+                    if text.startswith(prefix):
+                        text, level = text[len(prefix):], prefix_level
+                        break
+                getattr(Globals.logger, level)(f"Child process stderr: {text}", self.user)
+        except Exception as e:
+            Globals.logger.error(f"Error reading child stderr: {e}", self.user)
+
+    async def read_responses(self):
+        """持续读取子进程 stdout，按 id 唤醒等待中的命令。"""
+        try:
+            await self.negotiate()
+            while True:
+                if self.framing == 'msgpack':
+                    response = await self.read_frame()
+                else:
+                    response = await self.read_line()
+                if response is None:
+                    break
+                self.dispatch(response)
+        except Exception as e:
+            Globals.logger.error(f"Error reading child stdout: {e}", self.user)
+        finally:
+            self.fail_pending(Exception("No response from child process"))
+
+    async def negotiate(self):
+        """读取子进程的握手行确定响应编码；不支持握手的子进程保持 JSON 行。"""
+        while True:
+            line = await self.process.stdout.readline()
+            if not line:
+                return
+            try:
+                message = json.loads(line)
+            except json.JSONDecodeError:
+                Globals.logger.info(f"Non-JSON message from child process: {line.decode(errors='replace').strip()}", self.user)
+                continue
+            if isinstance(message, dict) and 'hello' in message:
+                framing = message['hello'].get('framing', 'jsonl')
+                if framing == 'msgpack' and msgpack is None:
+                    raise Exception("Child selected msgpack framing but msgpack is not installed")
+                self.framing = framing
+                Globals.logger.debug(f"Child process framing: {self.framing}", self.user)
+            else:
+                self.dispatch(message)
+            return
+
+    async def decode(self, decoder, payload):
+        if len(payload) >= Config.CHILD_DECODE_OFFLOAD_BYTES:
+            return await asyncio.get_event_loop().run_in_executor(decode_executor, decoder, payload)
+        return decoder(payload)
+
+    async def read_frame(self):
+        try:
+            header = await self.process.stdout.readexactly(FRAME_HEADER.size)
+            (length,) = FRAME_HEADER.unpack(header)
+            payload = await self.process.stdout.readexactly(length)
+        except asyncio.IncompleteReadError:
+            return None
+        return await self.decode(decode_frame, payload)
+
+    async def read_line(self):
+        while True:
+            line = await self.process.stdout.readline()
+            if not line:
+                return None
+            try:
+                return await self.decode(json.loads, line)
+            except json.JSONDecodeError:
+                # 非 JSON 报文，直接打印
+                Globals.logger.info(f"Non-JSON message from child process: {line.decode(errors='replace').strip()}", self.user)
+
+    def dispatch(self, response):
+        """唤醒响应对应的命令，属于流式命令时放入其 ResponseStream；不会等待。"""
+        request_id = response.pop('id', None) if isinstance(response, dict) else None
+        future = self.pending.get(request_id)
+        if future is None:
+            if request_id in self.abandoned:
+                if not response.get('partial'):
+                    self.abandoned.discard(request_id)
+                return
+            Globals.logger.info(f"Unmatched message from child process: {response}", self.user)
+            return
+        if isinstance(future, ResponseStream):
+            if not response.get('partial'):
+                self.pending.pop(request_id, None)
+            future.put(response)
+            return
+        self.pending.pop(request_id, None)
+        if not future.done():
+            future.set_result(response)
+
+    def fail_pending(self, exc):
+        """子进程退出时，让所有未完成的命令立即失败。"""
+        pending, self.pending = self.pending, {}
+        self.abandoned.clear()
+        for future in pending.values():
+            if isinstance(future, ResponseStream):
+                future.fail(exc)
+            elif not future.done():
+                future.set_exception(exc)
+
+    async def send_command(self, command: dict):
+        """向子进程发送命令并等待对应 id 的响应。"""
+        if not self.is_running():
+            raise Exception("Playwright子进程未运行")
+
+        request_id = next(self.request_ids)
+        future = asyncio.get_event_loop().create_future()
+        self.pending[request_id] = future
+        try:
+            # 发送命令
+            self.process.stdin.write((json.dumps({**command, "id": request_id}) + "\n").encode())
+            await self.process.stdin.drain()
+
+            # 监听响应
+            try:
+                return await asyncio.wait_for(future, timeout=self.timeout)
+            except asyncio.TimeoutError:
+                raise Exception("Timed out waiting for response from child process")
+        finally:
+            self.pending.pop(request_id, None)
+
+    def send_control(self, message: dict):
+        """发送流控消息；消息很短，不等待 drain，可以在生成器的 finally 中调用。"""
+        if self.is_running() and not self.process.stdin.is_closing():
+            self.process.stdin.write((json.dumps(message) + "\n").encode())
+
+    async def stream_command(self, command: dict):
+        """发送流式命令，逐条产出子进程的部分响应，最后产出最终响应。
+
+        每条响应的等待时间单独计算超时。每交付一条部分响应向子进程归还一个发送额度，
+        子进程最多领先 CHILD_STREAM_QUEUE_SIZE 条；调用方提前退出时通知子进程取消该命令。
+        """
+        if not self.is_running():
+            raise Exception("Playwright子进程未运行")
+
+        request_id = next(self.request_ids)
+        stream = ResponseStream()
+        self.pending[request_id] = stream
+        finished = False
+        try:
+            self.process.stdin.write((json.dumps({**command, "id": request_id, "window": Config.CHILD_STREAM_QUEUE_SIZE}) + "\n").encode())
+            await self.process.stdin.drain()
+            while True:
+                response = await stream.get(self.timeout)
+                if not response.get('partial'):
+                    finished = True
+                    yield response
+                    break
+                self.send_control({"action": "stream_credit", "stream": request_id})
+                yield response
+        finally:
+            stream.close()
+            if not finished and self.pending.pop(request_id, None) is not None:
+                # 提前退出：不再计入 inflight，子进程取消命令后发来的最终响应被静默丢弃
+                self.abandoned.add(request_id)
+                self.send_control({"action": "cancel_stream", "stream": request_id})
+
+    async def terminate(self, timeout=10):
+        """优雅终止子进程，超时则强制杀死。"""
+        if not self.process:
+            return
+        if self.process.returncode is None:
+            try:
+                self.process.terminate()
+                await asyncio.wait_for(self.process.wait(), timeout=timeout)
+                Globals.logger.debug("Playwright process terminated gracefully.", self.user)
+            except asyncio.TimeoutError:
+                Globals.logger.warning("Playwright进程终止超时，强制杀死进程", self.user)
+                await self.kill()
+            except ProcessLookupError:
+                pass
+        await self._finish()
+
+    async def kill(self):
+        """强制杀死子进程。"""
+        if not self.process:
+            return
+        if self.process.returncode is None:
+            try:
+                self.process.kill()
+            except ProcessLookupError:
+                pass
+            await self.process.wait()
+        await self._finish()
+
+    async def _finish(self):
+        if self.process and self.process.stdin and not self.process.stdin.is_closing():
+            self.process.stdin.close()
+        if self.reader_task:
+            try:
+                await asyncio.wait_for(self.reader_task, timeout=1)
+            except (asyncio.TimeoutError, asyncio.CancelledError):
+                self.reader_task.cancel()
+            self.reader_task = None
+        self.fail_pending(Exception("Playwright子进程已关闭"))
+        if self.stderr_task:
+            try:
+                await asyncio.wait_for(self.stderr_task, timeout=1)
+            except (asyncio.TimeoutError, asyncio.CancelledError):
+                self.stderr_task.cancel()
+            self.stderr_task = None
@@ -0,0 +1,76 @@
+# circuit_breaker.py
+
+import aiohttp
+
+from config.config import Config
+
+class CircuitBreaker(object):
+    """单个代理的熔断器。
+
+    closed：正常借出，连续失败达到 PROXY_BREAKER_FAILURES 次后熔断为 open；
+    open：隔离一段时间，不再借出，隔离时间从 PROXY_BREAKER_BASE_QUARANTINE 起每次熔断翻倍，直到上限；
+    half_open：隔离到期后经 Xray 端口做一次探测，成功则恢复 closed，失败则再次 open。
+    恢复后第一次真实请求成功才清零熔断次数，反复失效的代理隔离时间越来越长。
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self):
+        self.state = self.CLOSED
+        self.failures = 0  # 连续失败次数
+        self.trips = 0  # 连续熔断次数
+        self.open_until = 0
+
+    @property
+    def is_closed(self):
+        return self.state == self.CLOSED
+
+    def record_success(self):
+        self.failures = 0
+        self.trips = 0
+
+    def record_failure(self, now):
+        """记录一次失败，达到阈值时熔断并返回隔离秒数，否则返回 0；已在隔离中的代理不再累计。"""
+        if self.state != self.CLOSED:
+            return 0
+        self.failures += 1
+        if self.failures < Config.PROXY_BREAKER_FAILURES:
+            return 0
+        return self.trip(now)
+
+    def trip(self, now):
+        """立即熔断，返回隔离秒数。"""
+        quarantine = min(
+            Config.PROXY_BREAKER_MAX_QUARANTINE,
+            Config.PROXY_BREAKER_BASE_QUARANTINE * 2 ** self.trips
+        )
+        self.trips += 1
+        self.failures = 0
+        self.state = self.OPEN
+        self.open_until = now + quarantine
+        return quarantine
+
+    def due_for_probe(self, now):
+        return self.state == self.OPEN and now >= self.open_until
+
+    def start_probe(self):
+        self.state = self.HALF_OPEN
+
+    def finish_probe(self, success, now):
+        """探测成功恢复 closed 并返回 0，失败则再次熔断并返回隔离秒数。"""
+        if success:
+            self.state = self.CLOSED
+            self.failures = 0
+            return 0
+        return self.trip(now)
+
+async def probe_proxy(port):
+    """经 Xray 的本地端口请求一个轻量地址，能在超时内拿到非错误状态码即视为代理可用。"""
+    timeout = aiohttp.ClientTimeout(total=Config.PROXY_PROBE_TIMEOUT)
+    try:
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            async with session.get(Config.PROXY_PROBE_URL, proxy=f"http://127.0.0.1:{port}") as response:
+                return response.status < 400
+    except Exception:
+        return False
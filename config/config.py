@@ -12,3 +12,98 @@ class Config:
     DB_USER = os.getenv('DB_USER', 'root')
     DB_PASSWORD = os.getenv('DB_PASSWORD', '')
     DB_NAME = os.getenv('DB_NAME', 'spider')
+
+    # 子进程管道单行/单帧的最大字节数（视频列表可达数 MB），父子进程两端都使用该值
+    CHILD_STREAM_LIMIT = int(os.getenv('CHILD_STREAM_LIMIT', 64 * 1024 * 1024))
+
+    # 每个 TikTokApi 会话同时处理的命令数
+    SESSION_MAX_INFLIGHT = int(os.getenv('SESSION_MAX_INFLIGHT', 2))
+    # 每个 Playwright 子进程内创建的 TikTokApi 会话数，以及会话分发策略（round_robin / least_busy）
+    CHILD_TIKTOK_SESSIONS = int(os.getenv('CHILD_TIKTOK_SESSIONS', 2))
+    CHILD_SESSION_BALANCE = os.getenv('CHILD_SESSION_BALANCE', 'least_busy')
+
+    # 待处理账户队列容量，以及没有新到期账户时的轮询间隔（秒）
+    ACCOUNT_QUEUE_SIZE = int(os.getenv('ACCOUNT_QUEUE_SIZE', 100))
+    ACCOUNT_POLL_INTERVAL = float(os.getenv('ACCOUNT_POLL_INTERVAL', 5))
+
+    # 账户调度：heap 在内存中维护全部账户，sql 每次只从 next_due_at 索引取到期账户
+    ACCOUNT_SCHEDULER = os.getenv('ACCOUNT_SCHEDULER', 'heap')
+    # 账户调度：增量同步间隔、全量重载间隔、抓取失败后的重试延迟（秒）
+    ACCOUNT_REFRESH_INTERVAL = float(os.getenv('ACCOUNT_REFRESH_INTERVAL', 5))
+    ACCOUNT_FULL_RELOAD_INTERVAL = float(os.getenv('ACCOUNT_FULL_RELOAD_INTERVAL', 600))
+    ACCOUNT_RETRY_DELAY = float(os.getenv('ACCOUNT_RETRY_DELAY', 60))
+
+    # 预热的热备会话数，会话失败时直接顶替，替补在后台补建
+    SESSION_HOT_SPARES = int(os.getenv('SESSION_HOT_SPARES', 1))
+
+    # 会话启动：同时启动的会话数上限，以及相邻两次启动的最小间隔（秒）
+    SESSION_BOOTSTRAP_CONCURRENCY = int(os.getenv('SESSION_BOOTSTRAP_CONCURRENCY', 5))
+    SESSION_RAMP_UP_INTERVAL = float(os.getenv('SESSION_RAMP_UP_INTERVAL', 1))
+
+    # 每个代理的自适应令牌桶：初始/最低/最高速率（次/秒）、突发容量、每次成功的加速步长
+    PROXY_RATE_INITIAL = float(os.getenv('PROXY_RATE_INITIAL', 1 / 3))
+    PROXY_RATE_MIN = float(os.getenv('PROXY_RATE_MIN', 1 / 60))
+    PROXY_RATE_MAX = float(os.getenv('PROXY_RATE_MAX', 2))
+    PROXY_RATE_BURST = float(os.getenv('PROXY_RATE_BURST', 1))
+    PROXY_RATE_INCREASE = float(os.getenv('PROXY_RATE_INCREASE', 0.02))
+
+    # 子进程响应编码（msgpack / jsonl），以及超过该字节数的响应改在独立线程中解码
+    CHILD_FRAMING = os.getenv('CHILD_FRAMING', 'msgpack')
+    CHILD_DECODE_OFFLOAD_BYTES = int(os.getenv('CHILD_DECODE_OFFLOAD_BYTES', 256 * 1024))
+
+    # 流式抓取视频时每页的视频数（即每批写库的条数），以及每条流的发送窗口（子进程最多领先父进程消费的页数）
+    VIDEO_PAGE_SIZE = int(os.getenv('VIDEO_PAGE_SIZE', 30))
+    CHILD_STREAM_QUEUE_SIZE = int(os.getenv('CHILD_STREAM_QUEUE_SIZE', 4))
+
+    # 增量抓取视频：重新抓取水位线之前多长时间内的视频以刷新统计（秒），以及完整遍历视频列表的间隔（秒）
+    VIDEO_RECENT_WINDOW = int(os.getenv('VIDEO_RECENT_WINDOW', 7 * 24 * 3600))
+    VIDEO_FULL_RESYNC_INTERVAL = int(os.getenv('VIDEO_FULL_RESYNC_INTERVAL', 7 * 24 * 3600))
+
+    # 账户资料的刷新间隔（秒）；间隔内的抓取只用缓存的 sec_uid 翻页视频，0 表示每次都刷新资料
+    ACCOUNT_PROFILE_INTERVAL = float(os.getenv('ACCOUNT_PROFILE_INTERVAL', 6 * 3600))
+
+    # 子进程返回数据的字段投影（db 只保留入库字段，raw 返回完整数据，用于调试）
+    CHILD_PROJECTION = os.getenv('CHILD_PROJECTION', 'db')
+
+    # 子进程浏览器的资源拦截：none 不拦截，media 拦截图片/媒体/字体，all 另拦截第三方统计
+    CHILD_BLOCK_RESOURCES = os.getenv('CHILD_BLOCK_RESOURCES', 'none')
+
+    # 子进程浏览器启动参数（default / low_memory），以及每个 TikTokApi 会话执行多少条命令后重建浏览器上下文（0 不重建）
+    CHILD_LAUNCH_PROFILE = os.getenv('CHILD_LAUNCH_PROFILE', 'default')
+    CHILD_CONTEXT_RECYCLE_AFTER = int(os.getenv('CHILD_CONTEXT_RECYCLE_AFTER', 0))
+    # 子进程回收：执行命令数或进程树常驻内存（MB）达到阈值后排空并重启子进程，0 表示不按该项回收
+    # 共享子进程（BROWSER_HOSTS）中命令数按上下文计算，内存按整个共享子进程计算：超过阈值后其上的上下文迁走，再重启该子进程
+    SESSION_RECYCLE_COMMANDS = int(os.getenv('SESSION_RECYCLE_COMMANDS', 0))
+    SESSION_RECYCLE_RSS_MB = int(os.getenv('SESSION_RECYCLE_RSS_MB', 0))
+    SESSION_MEMORY_CHECK_INTERVAL = float(os.getenv('SESSION_MEMORY_CHECK_INTERVAL', 30))
+    SESSION_DRAIN_TIMEOUT = float(os.getenv('SESSION_DRAIN_TIMEOUT', 120))
+
+    # 会话后端：netns 每个会话一个网络命名空间和 Chromium；shared 每个 CPU 一个 Chromium，会话为其中使用独立代理的浏览器上下文
+    SESSION_BACKEND = os.getenv('SESSION_BACKEND', 'netns')
+    # 共享浏览器后端：子进程数（0 表示按 CPU 数），以及每个子进程承载的浏览器上下文数上限
+    BROWSER_HOSTS = int(os.getenv('BROWSER_HOSTS', 0))
+    BROWSER_HOST_CONTEXTS = int(os.getenv('BROWSER_HOST_CONTEXTS', 16))
+
+    # 内存代理池：重新加载 proxy_url 的间隔，以及 is_using 写回数据库的间隔（秒）
+    PROXY_POOL_RELOAD_INTERVAL = float(os.getenv('PROXY_POOL_RELOAD_INTERVAL', 600))
+    PROXY_POOL_SYNC_INTERVAL = float(os.getenv('PROXY_POOL_SYNC_INTERVAL', 2))
+
+    # 代理评分：延迟与成功率的指数加权系数，选择代理的代价函数（expected_latency / latency / fail_count），
+    # 没有延迟样本的代理按 PROXY_DEFAULT_DELAY_MS 计，失败一次按 PROXY_FAILURE_PENALTY_MS 计入预期耗时
+    PROXY_EWMA_ALPHA = float(os.getenv('PROXY_EWMA_ALPHA', 0.2))
+    PROXY_COST_FUNCTION = os.getenv('PROXY_COST_FUNCTION', 'expected_latency')
+    PROXY_DEFAULT_DELAY_MS = float(os.getenv('PROXY_DEFAULT_DELAY_MS', 1500))
+    PROXY_FAILURE_PENALTY_MS = float(os.getenv('PROXY_FAILURE_PENALTY_MS', 10000))
+
+    # 代理熔断：连续失败多少次熔断，隔离时间的初始值和上限（秒，每次熔断翻倍），
+    # 以及隔离到期后经 Xray 端口探测的地址、超时、检查间隔和并发数
+    PROXY_BREAKER_FAILURES = int(os.getenv('PROXY_BREAKER_FAILURES', 3))
+    PROXY_BREAKER_BASE_QUARANTINE = float(os.getenv('PROXY_BREAKER_BASE_QUARANTINE', 60))
+    PROXY_BREAKER_MAX_QUARANTINE = float(os.getenv('PROXY_BREAKER_MAX_QUARANTINE', 3600))
+    PROXY_PROBE_URL = os.getenv('PROXY_PROBE_URL', 'https://www.tiktok.com/robots.txt')
+    PROXY_PROBE_TIMEOUT = float(os.getenv('PROXY_PROBE_TIMEOUT', 5))
+    PROXY_PROBE_INTERVAL = float(os.getenv('PROXY_PROBE_INTERVAL', 1))
+    PROXY_PROBE_CONCURRENCY = int(os.getenv('PROXY_PROBE_CONCURRENCY', 5))
+
+    # 视频详情批量写入时每条 INSERT ... ON DUPLICATE KEY UPDATE 语句的行数
+    VIDEO_UPSERT_CHUNK = int(os.getenv('VIDEO_UPSERT_CHUNK', 500))
@@ -11,10 +11,11 @@ async def main():
     xray_instance = Xray()
     await xray_instance.run()
 
-    # speed_tester = SpeedTester()
-    # asyncio.create_task(speed_tester.run())
-    
     spider = Spider()
+
+    # speed_tester = SpeedTester(spider.proxy_pool)
+    # asyncio.create_task(speed_tester.run())
+
     await spider.main()
 
     await models.async_engine.dispose()
@@ -1,6 +1,6 @@
 # models/tiktok_account.py
 
-from sqlalchemy import Column, String, Integer, Boolean, Text, DateTime, BigInteger
+from sqlalchemy import Column, String, Integer, Boolean, Text, DateTime, BigInteger, Computed
 from sqlalchemy.sql import func
 from . import Base
 
@@ -49,3 +49,14 @@ class TikTokAccount(Base):
     created_at = Column(DateTime, server_default=func.now())  # 记录创建时间
     updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())  # 记录更新时间
     comments = Column(String(64))  # 备注
+    video_watermark = Column(BigInteger)  # 已抓取到的最新视频发布时间（Unix 时间戳），增量抓取的起点
+    last_full_sync_at = Column(DateTime)  # 上次完整遍历视频列表的时间
+    profile_fetched_at = Column(DateTime)  # 上次抓取账户资料的时间；只抓视频的轮次不更新
+    next_due_at = Column(
+        DateTime,
+        Computed(
+            "updated_at + INTERVAL CASE comments WHEN '获取失败' THEN 1800 WHEN '账号不存在' THEN 21600 ELSE 600 END SECOND",
+            persisted=True
+        ),
+        index=True
+    )  # 生成列：下次到期时间
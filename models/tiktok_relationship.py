@@ -1,11 +1,15 @@
 # models/tiktok_relationship.py
 
-from sqlalchemy import Column, BigInteger, String, Date, Boolean
+from sqlalchemy import Column, BigInteger, String, Date, DateTime, Boolean, Index
 from sqlalchemy.sql import func
 from . import Base
 
 class TikTokRelationship(Base):
     __tablename__ = 'tiktok_relationship'
+    __table_args__ = (
+        Index('idx_relationship_status_account_end', 'status', 'tiktok_account', 'end_date'),
+        Index('idx_relationship_updated_at', 'updated_at'),
+    )
 
     record_id = Column(BigInteger, primary_key=True, autoincrement=True)
     user_id = Column(BigInteger, nullable=False)
@@ -14,3 +18,4 @@ class TikTokRelationship(Base):
     end_date = Column(Date)
     status = Column(Boolean, nullable=False, default=False)
     creater_id = Column(BigInteger, nullable=False)
+    updated_at = Column(DateTime)  # 记录更新时间，用于增量同步
@@ -11,6 +11,7 @@ class NamespaceManager(object):
         self.max_namespaces = max_namespaces
         self.user = 'NamespaceManager'
         self.subnet_base = subnet_base  # 使用 /16 子网覆盖多个命名空间
+        self.redirects = {}  # 命名空间 -> redirect_proxy 添加的 DNAT 规则，只删除这里记录的规则
         # 清理所有现有的网络命名空间及相关资源
         self.cleanup_all_namespaces()
         # 创建新的网络命名空间
@@ -68,6 +69,14 @@ class NamespaceManager(object):
             raise Exception(f"Command failed: {cmd}\nError: {result.stderr.decode().strip()}")
         return result.stdout.decode()
 
+    async def run_cmd_async(self, cmd):
+        """异步运行系统命令并返回输出，不阻塞事件循环"""
+        process = await asyncio.create_subprocess_shell(cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+        stdout, stderr = await process.communicate()
+        if process.returncode != 0:
+            raise Exception(f"Command failed: {cmd}\nError: {stderr.decode().strip()}")
+        return stdout.decode()
+
     def create_namespaces(self):
         """创建新的网络命名空间"""
         try:
@@ -170,12 +179,41 @@ class NamespaceManager(object):
 
     async def release_namespace(self, ns_name):
         """释放命名空间，放回队列末尾以供复用"""
+        try:
+            await self.clear_proxy_redirect(ns_name)
+        except Exception as e:
+            Globals.logger.error(f"Failed to clear proxy redirect for {ns_name}: {e}", self.user)
         try:
             await self.namespace_queue.put(ns_name)
             Globals.logger.debug(f"Released namespace: {ns_name}", self.user)
         except Exception as e:
             Globals.logger.error(f"Error releasing namespace {ns_name}: {e}", self.user)
 
+    async def redirect_proxy(self, ns_name, proxy_ip, original_port, target_port):
+        """在命名空间内把发往 proxy_ip:original_port 的连接 DNAT 到 target_port，子进程无需重启即可换用代理"""
+        await self.clear_proxy_redirect(ns_name)
+        if target_port != original_port:
+            rule = f"OUTPUT -p tcp -d {proxy_ip} --dport {original_port} -j DNAT --to-destination {proxy_ip}:{target_port}"
+            await self.run_cmd_async(f"ip netns exec {ns_name} iptables -t nat -A {rule}")
+            self.redirects[ns_name] = rule
+        # 删除已有连接的 conntrack 记录，使浏览器保持的长连接也转到新代理；
+        # 残留的记录会让这些连接继续走旧代理，删除失败时记录警告
+        try:
+            await self.run_cmd_async(f"ip netns exec {ns_name} conntrack -D -p tcp -d {proxy_ip} --dport {original_port}")
+        except Exception as e:
+            if '0 flow entries' in str(e):
+                Globals.logger.debug(f"No conntrack entries to delete in {ns_name}.", self.user)
+            else:
+                Globals.logger.warning(f"Failed to delete conntrack entries in {ns_name}, existing connections may keep using the old proxy: {e}", self.user)
+        Globals.logger.debug(f"Redirected {ns_name} proxy port {original_port} -> {target_port}", self.user)
+
+    async def clear_proxy_redirect(self, ns_name):
+        """删除 redirect_proxy 在命名空间内添加的 DNAT 规则；没有添加过时不执行任何命令"""
+        rule = self.redirects.pop(ns_name, None)
+        if rule is None:
+            return
+        await self.run_cmd_async(f"ip netns exec {ns_name} iptables -t nat -D {rule}")
+
     def set_namespace_proxy(self, ns_name, proxy):
         """
         设置指定命名空间的 http_proxy 和 https_proxy 环境变量
@@ -1,38 +1,582 @@
+import argparse
 import sys
 import asyncio
 import json
+import struct
+import time
+from importlib import metadata
+from urllib.parse import urlparse
 from TikTokApi import TikTokApi
 
+from projection import PROJECTIONS, project
+
 import traceback
 
-async def get_user_info(api, username):
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# stdin 单行/单帧的最大字节数，由父进程以 --stream-limit 传入 Config.CHILD_STREAM_LIMIT
+STREAM_LIMIT = 64 * 1024 * 1024
+
+FRAME_HEADER = struct.Struct('>I')
+
+# user.videos 默认只取 30 个视频；传入足以覆盖整个作品列表的上限，翻页直到 TikTok 返回 hasMore 为 false，
+# 增量抓取由 stream_videos 中的 since 提前停止
+VIDEO_FEED_LIMIT = 1000000
+
+# 响应编码在 setup_framing 中确定，响应经 open_stdout_writer 创建的非阻塞写入器发送
+framing = "jsonl"
+response_writer = None
+
+def log(level, message):
+    """向 stderr 写一行带级别前缀的日志，父进程按前缀的级别记录；没有前缀的输出（第三方库、traceback）按 error 记录。"""
+    print(f"[{level}] {message}", file=sys.stderr, flush=True)
+
+class SessionBalancer(object):
+    """在子进程内的多个 TikTokApi 会话之间分发命令，并记录每个会话的健康状况。"""
+    def __init__(self, num_sessions, strategy="least_busy", max_consecutive_failures=3):
+        self.strategy = strategy
+        self.max_consecutive_failures = max_consecutive_failures
+        self.next_index = 0
+        self.stats = [self.new_stat(index) for index in range(num_sessions)]
+
+    @staticmethod
+    def new_stat(index):
+        return {
+            "index": index,
+            "busy": 0,
+            "success": 0,
+            "fail": 0,
+            "consecutive_failures": 0,
+            "last_error": None,
+            "last_used": None,
+            "commands": 0,  # 自上次重建浏览器上下文以来执行的命令数
+            "recycling": False,
+        }
+
+    def reset(self, index):
+        """会话下标被新的浏览器上下文占用时重置其统计。"""
+        if index == len(self.stats):
+            self.stats.append(self.new_stat(index))
+        else:
+            self.stats[index] = self.new_stat(index)
+
+    def is_healthy(self, stat):
+        return stat["consecutive_failures"] < self.max_consecutive_failures
+
+    def acquire(self, index=None):
+        """选出一个会话下标；优先健康且未在重建上下文的会话，都不满足时仍照常分发。指定 index 时直接使用该会话。"""
+        if index is not None:
+            stat = self.stats[index]
+        else:
+            available = [stat for stat in self.stats if not stat["recycling"]] or self.stats
+            candidates = [stat for stat in available if self.is_healthy(stat)] or available
+            if self.strategy == "round_robin":
+                stat = candidates[self.next_index % len(candidates)]
+                self.next_index += 1
+            else:
+                stat = min(candidates, key=lambda item: (item["busy"], item["last_used"] or 0))
+        stat["busy"] += 1
+        stat["commands"] += 1
+        stat["last_used"] = time.time()
+        return stat["index"]
+
+    def release(self, index, success, error=None):
+        stat = self.stats[index]
+        stat["busy"] -= 1
+        if success:
+            stat["success"] += 1
+            stat["consecutive_failures"] = 0
+        else:
+            stat["fail"] += 1
+            stat["consecutive_failures"] += 1
+            stat["last_error"] = error
+
+    def health(self):
+        return [{**stat, "healthy": self.is_healthy(stat)} for stat in self.stats]
+
+class ResourceBlocker(object):
+    """在每个 TikTokApi 会话的浏览器上下文中拦截图片、媒体和字体请求，节省代理流量。
+
+    签名和接口请求（script / xhr / fetch / document）始终放行。mode 为 all 时还拦截第三方统计。
+    被拦截请求的大小无从得知，按资源类型的经验值估算节省的字节数（estimated_bytes_saved）。
+
+    TikTokApi 只在创建会话时完整加载一次页面，之后都是页面内的请求；这次加载由 suppressed_types
+    传给 TikTokApi 的 suppress_resource_load_types，在导航之前即按类型拦截（不计入统计）。
+    TikTokApi 为此在页面上安装的路由会一直保留，且页面路由优先于上下文路由、continue_ 不会交给下一个处理器，
+    所以会话创建后先移除它，再安装本类的上下文路由，之后的请求才会经过 handler 并计入统计。
+    """
+    BLOCKED_RESOURCE_TYPES = ("image", "media", "font")
+    ANALYTICS_HOSTS = (
+        "google-analytics.com",
+        "googletagmanager.com",
+        "doubleclick.net",
+        "facebook.net",
+        "analytics.tiktok.com",
+    )
+    ESTIMATED_BYTES = {"image": 40 * 1024, "media": 512 * 1024, "font": 48 * 1024, "analytics": 16 * 1024}
+
+    def __init__(self, mode="media"):
+        self.block_analytics = mode == "all"
+        self.stats = {}
+
+    @property
+    def suppressed_types(self):
+        """创建会话时交给 TikTokApi 在首次导航前拦截的资源类型。"""
+        return list(self.BLOCKED_RESOURCE_TYPES)
+
+    def classify(self, request):
+        """返回应拦截的类别，放行时返回 None。"""
+        if request.resource_type in self.BLOCKED_RESOURCE_TYPES:
+            return request.resource_type
+        if self.block_analytics:
+            host = urlparse(request.url).hostname or ""
+            if any(host == domain or host.endswith("." + domain) for domain in self.ANALYTICS_HOSTS):
+                return "analytics"
+        return None
+
+    async def install(self, api):
+        """为已创建的会话安装路由，拦截并统计之后的请求；首次页面加载由 suppressed_types 覆盖。"""
+        for index, session in enumerate(api.sessions):
+            await self.install_session(index, session)
+
+    async def install_session(self, index, session):
+        """为单个会话安装路由；上下文重建后再次调用，计数累计保留。"""
+        self.stats.setdefault(index, {"seen": 0, "blocked": 0, "estimated_bytes_saved": 0, "by_type": {}})
+        await session.page.unroute("**/*")
+        await session.context.route("**/*", self.handler(index))
+
+    def handler(self, index):
+        stats = self.stats[index]
+
+        async def handle(route, request):
+            stats["seen"] += 1
+            kind = self.classify(request)
+            if kind is None:
+                await route.fallback()
+                return
+            stats["blocked"] += 1
+            stats["estimated_bytes_saved"] += self.ESTIMATED_BYTES[kind]
+            stats["by_type"][kind] = stats["by_type"].get(kind, 0) + 1
+            await route.abort()
+
+        return handle
+
+    def snapshot(self, index):
+        return self.stats.get(index)
+
+# 浏览器启动参数：low_memory 关闭 GPU、扩展、站点隔离等，并限制渲染进程数和 V8 堆大小
+LAUNCH_PROFILES = {
+    "default": None,
+    "low_memory": [
+        "--disable-dev-shm-usage",
+        "--disable-gpu",
+        "--disable-extensions",
+        "--disable-background-networking",
+        "--disable-component-update",
+        "--disable-default-apps",
+        "--disable-sync",
+        "--disable-features=site-per-process,Translate,BackForwardCache,MediaRouter",
+        "--renderer-process-limit=1",
+        "--js-flags=--max-old-space-size=256",
+        "--mute-audio",
+        "--no-first-run",
+    ],
+}
+
+# SessionFactory 依赖的 TikTokApi 私有接口（_TikTokApi__create_session 的参数，以及新会话追加到 api.sessions 末尾）
+# 只在这个版本范围内验证过，升级 TikTokApi 前须重新核对
+TIKTOKAPI_SUPPORTED_VERSIONS = ((6, 2), (7, 0))
+
+def check_tiktokapi_version():
+    version = metadata.version("TikTokApi")
+    parts = tuple(int(part) for part in version.split(".")[:2] if part.isdigit())
+    low, high = TIKTOKAPI_SUPPORTED_VERSIONS
+    if not low <= parts < high:
+        raise Exception(f"TikTokApi {version} is not supported for per-context sessions (need >= {low}, < {high})")
+
+class SessionFactory(object):
+    """在已启动的浏览器中单独创建一个 TikTokApi 会话（浏览器上下文），供 ContextRecycler 和 ContextRegistry 共用。
+
+    TikTokApi 没有公开单个会话的创建接口：私有的 __create_session 先把新会话追加到 api.sessions 末尾，
+    之后还会继续 await。所有创建都经同一把锁串行化，才能用 pop() 取回刚创建的会话。
+    """
+    def __init__(self, api, blocker=None, sleep_after=5):
+        self.api = api
+        self.blocker = blocker
+        self.sleep_after = sleep_after
+        self.lock = asyncio.Lock()
+        self.checked = False
+
+    async def create(self, proxy):
+        if not self.checked:
+            check_tiktokapi_version()
+            self.checked = True
+        async with self.lock:
+            await self.api._TikTokApi__create_session(
+                proxy=proxy,
+                sleep_after=self.sleep_after,
+                suppress_resource_load_types=self.blocker.suppressed_types if self.blocker else None
+            )
+            return self.api.sessions.pop()
+
+class ContextRecycler(object):
+    """会话执行 recycle_after 条命令后，关闭并重新打开它的浏览器上下文，释放页面积累的内存。
+
+    重建期间负载均衡器不再向该会话分发命令；新上下文创建好并且旧会话空闲后再原地替换，
+    替换本身没有 await，不会有命令用到已关闭的页面。
+    """
+    def __init__(self, api, balancer, recycle_after, factory, blocker=None, idle_timeout=120):
+        self.api = api
+        self.balancer = balancer
+        self.recycle_after = recycle_after
+        self.factory = factory
+        self.blocker = blocker
+        self.idle_timeout = idle_timeout
+        self.tasks = set()
+
+    def maybe_recycle(self, index):
+        stat = self.balancer.stats[index]
+        if stat["recycling"] or stat["commands"] < self.recycle_after:
+            return
+        stat["recycling"] = True
+        task = asyncio.create_task(self.recycle(index))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def wait_idle(self, stat):
+        deadline = time.monotonic() + self.idle_timeout
+        while stat["busy"] > 0 and time.monotonic() < deadline:
+            await asyncio.sleep(0.5)
+        return stat["busy"] == 0
+
+    async def recycle(self, index):
+        stat = self.balancer.stats[index]
+        try:
+            old = self.api.sessions[index]
+            new = await self.factory.create(old.proxy)
+            if not await self.wait_idle(stat):
+                await new.context.close()
+                return
+            self.api.sessions[index] = new
+            stat["commands"] = 0
+            if self.blocker:
+                await self.blocker.install_session(index, new)
+            try:
+                await old.page.close()
+                await old.context.close()
+            except Exception as e:
+                log("warning", f"Error closing recycled context {index}: {e}")
+        except Exception as e:
+            log("warning", f"Failed to recycle context {index}: {e}")
+        finally:
+            stat["recycling"] = False
+
+class ContextRegistry(object):
+    """共享浏览器模式：一个 Chromium 中按需打开多个浏览器上下文，每个上下文使用独立的代理。
+
+    父进程用自己分配的 context id 打开、关闭上下文，并在命令中带上 "context" 指定使用哪个上下文。
+    每个上下文对应 api.sessions 中的一个下标；关闭后下标空出，留给下一个上下文复用，
+    其余上下文的下标始终不变。
+    """
+    def __init__(self, api, balancer, factory, blocker=None):
+        self.api = api
+        self.balancer = balancer
+        self.factory = factory
+        self.blocker = blocker
+        self.contexts = {}  # context id -> api.sessions 下标
+        self.free_indexes = []
+        self.opening = set()  # 正在创建的 context id
+        self.cancelled = set()  # 创建完成前父进程已放弃（打开超时）的 context id，创建完成后立即关闭
+
+    def index(self, context_id):
+        if context_id not in self.contexts:
+            raise Exception(f"Unknown context {context_id}")
+        return self.contexts[context_id]
+
+    async def open(self, context_id, proxy):
+        self.opening.add(context_id)
+        try:
+            session = await self.factory.create({"server": proxy} if proxy else None)
+        except Exception:
+            self.cancelled.discard(context_id)
+            raise
+        finally:
+            self.opening.discard(context_id)
+        if context_id in self.cancelled:
+            self.cancelled.discard(context_id)
+            await session.page.close()
+            await session.context.close()
+            raise Exception(f"Context {context_id} was closed while opening")
+        if self.free_indexes:
+            index = self.free_indexes.pop()
+            self.api.sessions[index] = session
+        else:
+            index = len(self.api.sessions)
+            self.api.sessions.append(session)
+        self.balancer.reset(index)
+        if self.blocker:
+            await self.blocker.install_session(index, session)
+        self.contexts[context_id] = index
+        return index
+
+    async def close(self, context_id):
+        index = self.contexts.pop(context_id, None)
+        if index is None:
+            if context_id in self.opening:
+                self.cancelled.add(context_id)
+            return
+        session = self.api.sessions[index]
+        try:
+            await session.page.close()
+            await session.context.close()
+        finally:
+            self.free_indexes.append(index)
+
+async def get_user_info(api, username, session_index=None):
     """获取用户信息。"""
     user = api.user(username=username)
-    user_info = await user.info()
+    user_info = await user.info(session_index=session_index)
     return user_info
 
-async def get_user_videos(api, username):
-    """获取用户视频。"""
-    videos = []
-    async for video in api.user(username=username).videos():
+def build_user(api, command):
+    """按命令构造 TikTokApi 用户对象；带有缓存的 sec_uid 时直接使用，翻页前不必再按用户名查询。"""
+    username = command.get("username")
+    sec_uid = command.get("sec_uid")
+    if sec_uid:
+        return api.user(username=username, user_id=command.get("tiktok_id"), sec_uid=sec_uid)
+    return api.user(username=username)
+
+def projection_for(command):
+    """命令指定的投影规格；未指定时原样返回数据。"""
+    return PROJECTIONS[command.get("projection", "raw")]
+
+async def stream_videos(user, emit, page_size, since=None, session_index=None, spec=None):
+    """逐页发送用户视频，不在内存中累积整个视频列表，返回 (发送的视频数, 视频列表是否有返回)。
+
+    指定 since 时为增量抓取：遇到第一个发布时间早于 since 的非置顶视频即停止翻页，
+    置顶视频不按时间排列，不作为停止依据。每个视频在放入页面前按 spec 裁剪字段。
+    第一页请求的耗时随第一页一起发出，作为代理的延迟样本。
+    """
+    page = []
+    count = 0
+    seen = False
+    elapsed_ms = None
+    started = time.monotonic()
+    async for video in user.videos(count=VIDEO_FEED_LIMIT, session_index=session_index):
+        if not seen:
+            elapsed_ms = (time.monotonic() - started) * 1000
+        seen = True
         video_info = video.as_dict
-        videos.append(video_info)
-    return videos
+        if since is not None and not video_info.get("isPinnedItem") and int(video_info.get("createTime") or 0) < since:
+            break
+        page.append(project(video_info, spec))
+        count += 1
+        if len(page) >= page_size:
+            await emit(page, elapsed_ms=elapsed_ms)
+            page = []
+            elapsed_ms = None
+    if page:
+        await emit(page, elapsed_ms=elapsed_ms)
+    return count, seen
+
+async def stream_user_videos(api, command, emit, session_index=None):
+    """按缓存的 sec_uid 抓取视频；请求出错（且尚未发出任何视频）时视为 ID 已失效，改为按用户名查询后重试。
+
+    视频列表为空不作为失效依据，没有视频的账户不必为此多付一次按用户名的查询。
+    """
+    page_size = command.get("page_size", 30)
+    since = command.get("since")
+    spec = projection_for(command)["video"]
+    user = build_user(api, command)
+    if command.get("sec_uid"):
+        emitted = []
+        async def counted(data, kind="videos", elapsed_ms=None):
+            emitted.append(len(data))
+            await emit(data, kind, elapsed_ms)
+        try:
+            count, seen = await stream_videos(user, counted, page_size, since, session_index, spec)
+            return count
+        except Exception as e:
+            if emitted:
+                raise
+            log("info", f"Cached sec_uid rejected for {command.get('username')}: {e}")
+        user = api.user(username=command.get("username"))
+    count, seen = await stream_videos(user, emit, page_size, since, session_index, spec)
+    return count
+
+async def crawl_account(api, command, emit, session_index=None):
+    """一次命令内获取用户信息和视频。
+
+    视频沿用获取信息时的 user 对象，其中已有 secUid，TikTokApi 不会再为翻页重新查询用户。
+    用户信息先作为 kind 为 user_info 的部分响应发出，随后逐页发送视频。
+    """
+    # 资料按用户名查询，失效的缓存 ID 不会影响结果；查询后 user 对象带上最新的 secUid
+    user = api.user(username=command.get("username"))
+    started = time.monotonic()
+    user_info = await user.info(session_index=session_index)
+    elapsed_ms = (time.monotonic() - started) * 1000
+    spec = projection_for(command)
+    await emit(project(user_info, spec["user_info"]), "user_info", elapsed_ms)
+    count, seen = await stream_videos(user, emit, command.get("page_size", 30), command.get("since"), session_index, spec["video"])
+    return count
+
+async def open_stdin_reader():
+    """以 asyncio 管道读取 stdin，避免为阻塞 readline 占用线程。"""
+    loop = asyncio.get_event_loop()
+    reader = asyncio.StreamReader(limit=STREAM_LIMIT)
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+    return reader
+
+async def execute_command(api, command, session_index, emit):
+    """在指定的 TikTokApi 会话上执行单条命令并返回响应字典；流式命令通过 emit 发送部分响应。"""
+    action = command.get("action")
+    username = command.get("username")
+
+    if action == "get_user_info":
+        user_info = await get_user_info(api, username, session_index)
+        return {"status": "success", "data": project(user_info, projection_for(command)["user_info"])}
+    elif action == "get_user_videos" and command.get("stream"):
+        count = await stream_user_videos(api, command, emit, session_index)
+        return {"status": "success", "data": {"count": count}}
+    elif action == "crawl_account" and command.get("stream"):
+        count = await crawl_account(api, command, emit, session_index)
+        return {"status": "success", "data": {"count": count}}
+    elif action == "crawl_account":
+        # 非流式调用时把信息和视频收集后一并返回
+        results = {"user_info": None, "videos": []}
+        async def collect(data, kind="videos", elapsed_ms=None):
+            if kind == "user_info":
+                results["user_info"] = data
+            else:
+                results["videos"].extend(data)
+        await crawl_account(api, command, collect, session_index)
+        return {"status": "success", "data": results}
+    elif action == "get_user_videos":
+        videos = []
+        async def collect(data, kind="videos", elapsed_ms=None):
+            videos.extend(data)
+        await stream_user_videos(api, command, collect, session_index)
+        return {"status": "success", "data": videos}
+    else:
+        return {"status": "error", "message": "Unknown action"}
+
+def setup_framing(requested):
+    """确定响应编码并向父进程发送握手行；msgpack 不可用时回退为 JSON 行。"""
+    global framing
+    framing = "msgpack" if requested == "msgpack" and msgpack is not None else "jsonl"
+    sys.stdout.write(json.dumps({"hello": {"framing": framing}}) + "\n")
+    sys.stdout.flush()
+
+async def open_stdout_writer():
+    """以 asyncio 非阻塞管道写 stdout：管道满时只有等待 drain 的任务暂停，事件循环和 Playwright 照常运行。
 
-async def handle_commands():
-    """处理来自父进程的命令。"""
+    之后 sys.stdout 改指向 stderr，防止第三方库的 print 与响应交错或写入非阻塞的管道。
+    """
+    global response_writer
+    loop = asyncio.get_event_loop()
+    transport, protocol = await loop.connect_write_pipe(asyncio.streams.FlowControlMixin, sys.stdout.buffer)
+    response_writer = asyncio.StreamWriter(transport, protocol, None, loop)
+    sys.stdout = sys.stderr
+
+async def write_response(response):
+    """发送响应；每条响应一次性写入一整帧（或一整行），并发任务之间不会交错。"""
+    if framing == "msgpack":
+        payload = msgpack.packb(response, use_bin_type=True, default=str)
+        response_writer.write(FRAME_HEADER.pack(len(payload)) + payload)
+    else:
+        response_writer.write((json.dumps(response) + "\n").encode())
+    await response_writer.drain()
+
+async def run_command(api, command, semaphore, balancer, blocker=None, recycler=None, registry=None, credits=None):
+    """在独立任务中执行命令，响应带上请求的 id 以便父进程匹配。
+
+    credits 为流式命令的发送窗口：每条部分响应先领取一个额度，额度用完时只有本命令等待父进程归还。
+    elapsed_ms 为产生这条部分响应的单次 TikTok 请求的耗时，父进程用作代理的延迟样本。
+    """
+    async def emit(data, kind="videos", elapsed_ms=None):
+        if credits is not None:
+            await credits.acquire()
+        response = {"id": command.get("id"), "partial": True, "kind": kind, "status": "success", "data": data}
+        if elapsed_ms is not None:
+            response["elapsed_ms"] = elapsed_ms
+        await write_response(response)
+
+    action = command.get("action")
+    context_id = command.get("context")
+    try:
+        if action == "health":
+            health = balancer.health()
+            if context_id is not None:
+                health = [stat for stat in health if stat["index"] == registry.index(context_id)]
+            if blocker:
+                for stat in health:
+                    stat["resources_blocked"] = blocker.snapshot(stat["index"])
+            response = {"status": "success", "data": health}
+        elif action == "open_context":
+            index = await registry.open(context_id, command.get("proxy"))
+            response = {"status": "success", "data": {"session_index": index}}
+        elif action == "close_context":
+            await registry.close(context_id)
+            response = {"status": "success"}
+        else:
+            async with semaphore:
+                session_index = balancer.acquire(registry.index(context_id) if context_id is not None else None)
+                try:
+                    response = await execute_command(api, command, session_index, emit)
+                except asyncio.CancelledError:
+                    # 父进程放弃了该流，仍回复最终响应，父进程据此清理
+                    response = {"status": "error", "message": "Cancelled"}
+                except Exception as e:
+                    response = {"status": "error", "message": str(e)}
+                balancer.release(session_index, response["status"] == "success", response.get("message"))
+                response["session_index"] = session_index
+                if recycler:
+                    recycler.maybe_recycle(session_index)
+    except asyncio.CancelledError:
+        response = {"status": "error", "message": "Cancelled"}
+    except Exception as e:
+        response = {"status": "error", "message": str(e)}
+    response["id"] = command.get("id")
+    await write_response(response)
+
+async def handle_commands(max_inflight, num_sessions, balance, block="none", launch_profile="default", context_recycle_after=0):
+    """处理来自父进程的命令，最多同时执行 max_inflight 条，分摊到 num_sessions 个 TikTokApi 会话。"""
     api = None
+    tasks = set()
+    running = {}  # 流式命令的 id -> (任务, 发送额度)
+    semaphore = asyncio.Semaphore(max_inflight)
+    balancer = SessionBalancer(num_sessions, balance)
+    blocker = ResourceBlocker(block) if block != "none" else None
+    recycler = None
+    registry = None
 
     try:
         # 使用上下文管理器管理 TikTokApi 实例
         async with TikTokApi() as api:
-            await api.create_sessions(num_sessions=1, headless=True, sleep_after=5)
+            await api.create_sessions(
+                num_sessions=num_sessions,
+                headless=True,
+                sleep_after=5,
+                override_browser_args=LAUNCH_PROFILES[launch_profile],
+                suppress_resource_load_types=blocker.suppressed_types if blocker else None
+            )
+            if blocker:
+                await blocker.install(api)
+            factory = SessionFactory(api, blocker)
+            if context_recycle_after > 0:
+                recycler = ContextRecycler(api, balancer, context_recycle_after, factory, blocker)
+            registry = ContextRegistry(api, balancer, factory, blocker)
+            reader = await open_stdin_reader()
+            await open_stdout_writer()
 
             while True:
                 # 读取命令
-                line = await asyncio.get_event_loop().run_in_executor(None, sys.stdin.readline)
+                line = (await reader.readline()).decode()
                 if not line:
-                    print("EOF received. Exiting.", file=sys.stdout, flush=True)
+                    log("info", "EOF received. Exiting.")
                     break  # EOF
 
                 line = line.strip()
@@ -42,37 +586,62 @@ async def handle_commands():
 
                 try:
                     command = json.loads(line)
-                    action = command.get("action")
-                    username = command.get("username")
-
-                    if action == "get_user_info":
-                        user_info = await get_user_info(api, username)
-                        response = {"status": "success", "data": user_info}
-                    elif action == "get_user_videos":
-                        user_videos = await get_user_videos(api, username)
-                        response = {"status": "success", "data": user_videos}
-                    else:
-                        response = {"status": "error", "message": "Unknown action"}
                 except json.JSONDecodeError as e:
-                    response = {"status": "error", "message": "Invalid JSON format"}
-                except Exception as e:
-                    response = {"status": "error", "message": str(e)}
+                    await write_response({"status": "error", "message": "Invalid JSON format", "id": None})
+                    continue
 
-                # 发送响应
-                response_str = json.dumps(response)
-                sys.stdout.write(response_str + "\n")
-                sys.stdout.flush()
+                # 流控消息直接处理，不占用命令任务
+                action = command.get("action")
+                if action in ("stream_credit", "cancel_stream"):
+                    entry = running.get(command.get("stream"))
+                    if entry is not None:
+                        if action == "stream_credit":
+                            entry[1].release()
+                        else:
+                            entry[0].cancel()
+                    continue
+
+                credits = asyncio.Semaphore(command["window"]) if command.get("window") else None
+                task = asyncio.create_task(run_command(api, command, semaphore, balancer, blocker, recycler, registry, credits))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                if credits is not None:
+                    request_id = command.get("id")
+                    running[request_id] = (task, credits)
+                    task.add_done_callback(lambda _, request_id=request_id: running.pop(request_id, None))
+
+            # 等待已接收的命令执行完毕
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
     except Exception as e:
-        print(f"Unhandled exception in handle_commands: {e}", file=sys.stderr, flush=True)
+        log("error", f"Unhandled exception in handle_commands: {e}")
     finally:
         # 确保在任何情况下都关闭 TikTokApi
         if api:
             await api.close_sessions()
 
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--max-inflight", type=int, default=1, help="同时执行的命令数上限")
+    parser.add_argument("--num-sessions", type=int, default=1, help="子进程内预先创建的 TikTokApi 会话数；共享浏览器模式为 0，上下文由父进程按需打开")
+    parser.add_argument("--balance", choices=["round_robin", "least_busy"], default="least_busy", help="会话分发策略")
+    parser.add_argument("--block", choices=["none", "media", "all"], default="none", help="拦截的浏览器资源：media 拦截图片/媒体/字体，all 另拦截第三方统计")
+    parser.add_argument("--launch-profile", choices=sorted(LAUNCH_PROFILES), default="default", help="浏览器启动参数配置")
+    parser.add_argument("--context-recycle-after", type=int, default=0, help="每个会话执行多少条命令后重建浏览器上下文，0 表示不重建")
+    parser.add_argument("--framing", choices=["jsonl", "msgpack"], default="jsonl", help="响应编码")
+    parser.add_argument("--stream-limit", type=int, default=STREAM_LIMIT, help="stdin 单行/单帧的最大字节数")
+    return parser.parse_args()
+
 if __name__ == "__main__":
     try:
-        asyncio.run(handle_commands())
+        args = parse_args()
+        STREAM_LIMIT = args.stream_limit
+        setup_framing(args.framing)
+        asyncio.run(handle_commands(
+            args.max_inflight, args.num_sessions, args.balance, args.block,
+            args.launch_profile, args.context_recycle_after
+        ))
     except Exception as e:
-        print(f"Unhandled exception in main: {e}", file=sys.stdout, flush=True)
+        log("error", f"Unhandled exception in main: {e}")
         traceback.print_exc(file=sys.stderr)
         sys.exit(1)
\ No newline at end of file
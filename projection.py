@@ -0,0 +1,103 @@
+# projection.py
+#
+# 子进程与父进程共用的字段投影规格。子进程在编码响应前按规格裁剪 TikTok 返回的数据，
+# 只保留入库用到的字段；规格须与 AsyncTikTokDataManager 中读取的字段保持一致。
+
+# True 表示原样保留该字段，字典表示只保留其中的子字段
+VIDEO_FIELDS = {
+    'id': True,
+    'author': {'id': True},
+    'AIGCDescription': True,
+    'CategoryType': True,
+    'backendSourceEventTracking': True,
+    'collected': True,
+    'createTime': True,
+    'desc': True,
+    'digged': True,
+    'diversificationId': True,
+    'duetDisplay': True,
+    'duetEnabled': True,
+    'forFriend': True,
+    'itemCommentStatus': True,
+    'officalItem': True,
+    'originalItem': True,
+    'privateItem': True,
+    'secret': True,
+    'shareEnabled': True,
+    'stitchDisplay': True,
+    'stitchEnabled': True,
+    'itemControl': {'can_repost': True},
+    'statsV2': {
+        'collectCount': True,
+        'commentCount': True,
+        'diggCount': True,
+        'playCount': True,
+        'repostCount': True,
+        'shareCount': True,
+    },
+}
+
+USER_INFO_FIELDS = {
+    'userInfo': {
+        'user': {
+            'id': True,
+            'uniqueId': True,
+            'nickname': True,
+            'avatarLarger': True,
+            'avatarMedium': True,
+            'avatarThumb': True,
+            'signature': True,
+            'verified': True,
+            'secUid': True,
+            'privateAccount': True,
+            'followingVisibility': True,
+            'commentSetting': True,
+            'duetSetting': True,
+            'stitchSetting': True,
+            'downloadSetting': True,
+            'profileEmbedPermission': True,
+            'profileTab': {'showPlaylistTab': True},
+            'commerceUserInfo': {'commerceUser': True, 'ttSeller': True},
+            'relation': True,
+            'isAdVirtual': True,
+            'isEmbedBanned': True,
+            'openFavorite': True,
+            'nicknameModifyTime': True,
+            'canExpPlaylist': True,
+            'secret': True,
+            'ftc': True,
+            'bioLink': {'link': True, 'risk': True},
+        },
+        'stats': {
+            'diggCount': True,
+            'followerCount': True,
+            'followingCount': True,
+            'friendCount': True,
+            'heartCount': True,
+            'videoCount': True,
+        },
+    },
+}
+
+# 投影模式：db 只保留入库字段，raw 原样返回（用于调试）
+PROJECTIONS = {
+    'db': {'video': VIDEO_FIELDS, 'user_info': USER_INFO_FIELDS},
+    'raw': {'video': None, 'user_info': None},
+}
+
+def project(data, spec):
+    """按规格裁剪数据；spec 为 None 时原样返回。缺失的字段不会补出来，非字典的值原样保留。"""
+    if spec is None or not isinstance(data, dict):
+        return data
+    result = {}
+    for key, sub_spec in spec.items():
+        if key not in data:
+            continue
+        value = data[key]
+        if sub_spec is True:
+            result[key] = value
+        elif isinstance(value, list):
+            result[key] = [project(item, sub_spec) for item in value]
+        else:
+            result[key] = project(value, sub_spec)
+    return result
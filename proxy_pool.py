@@ -0,0 +1,279 @@
+# proxy_pool.py
+
+import asyncio
+import heapq
+import itertools
+import time
+
+from async_tiktok_data_manager import AsyncTikTokDataManager
+from circuit_breaker import CircuitBreaker, probe_proxy
+from config.config import Config
+from custom_globals import Globals
+
+def ewma(average, sample, alpha):
+    """指数加权移动平均；没有历史值时直接取样本。"""
+    return sample if average is None else average + alpha * (sample - average)
+
+def expected_latency_cost(proxy):
+    # 预期每次请求的耗时：平均延迟，加上失败概率乘以一次失败（重试、换代理）的代价
+    latency = proxy['latency'] if proxy['latency'] is not None else Config.PROXY_DEFAULT_DELAY_MS
+    return latency + (1 - proxy['success_rate']) * Config.PROXY_FAILURE_PENALTY_MS
+
+def latency_cost(proxy):
+    return proxy['latency'] if proxy['latency'] is not None else Config.PROXY_DEFAULT_DELAY_MS
+
+def fail_count_cost(proxy):
+    return proxy['fail_count']
+
+# 代价越低越优先借出，由 Config.PROXY_COST_FUNCTION 选择
+COST_FUNCTIONS = {
+    'expected_latency': expected_latency_cost,
+    'latency': latency_cost,
+    'fail_count': fail_count_cost,
+}
+
+class ProxyPool(object):
+    """进程内的代理池：启动时加载一次 proxy_url，空闲代理按分数放在小顶堆中，借出和归还均为 O(log n)。
+
+    分数变化时重新入堆，旧条目惰性删除：只有序号与代理当前 seq 一致的条目有效。
+    is_using 的变化先记在内存，由 run_sync 批量写回数据库；之后定期重新加载以发现新增的代理。
+
+    每个代理维护延迟和成功率的指数加权平均，样本来自测速和实际抓取结果，
+    分数由 COST_FUNCTIONS 中的代价函数计算；延迟平均值随 is_using 一起写回 avg_delay/delay_count，
+    成功/失败次数也只在内存中累计增量，由 flush 以 fail_count = fail_count + delta 的形式批量写回。
+
+    每个代理还有一个 CircuitBreaker：熔断的代理不在堆中，隔离到期后由 run_probes 探测，恢复后重新入堆。
+    """
+    def __init__(self, data_manager: AsyncTikTokDataManager):
+        self.data_manager = data_manager
+        self.user = 'ProxyPool'
+        self.proxies = {}  # proxy id -> 代理状态
+        self.heap = []  # (score, seq, proxy id)，只包含空闲且未熔断的代理
+        self.in_use = set()
+        self.quarantine = []  # (隔离到期时间, proxy id)，惰性删除
+        self.probe_semaphore = asyncio.Semaphore(Config.PROXY_PROBE_CONCURRENCY)
+        self.seq = itertools.count()
+        self.dirty = {}  # proxy id -> 待写回的 is_using
+        self.dirty_delays = set()  # 延迟统计待写回的 proxy id
+        self.pending_counts = {}  # proxy id -> [成功次数增量, 失败次数增量]，写回后清零
+        self.cost = COST_FUNCTIONS[Config.PROXY_COST_FUNCTION]
+        self.last_load = None
+        self.load_lock = asyncio.Lock()
+
+    def __len__(self):
+        return len(self.proxies)
+
+    def score(self, proxy):
+        """分数越低越优先。"""
+        return self.cost(proxy)
+
+    @staticmethod
+    def new_proxy(row):
+        """由数据库行初始化代理状态：延迟取 avg_delay，成功率取计数的拉普拉斯平滑值。"""
+        proxy = dict(row)
+        proxy['latency'] = row['avg_delay'] if row['delay_count'] else None
+        proxy['current_delay'] = None
+        proxy['success_rate'] = (row['success_count'] + 1) / (row['success_count'] + row['fail_count'] + 2)
+        proxy['breaker'] = CircuitBreaker()
+        return proxy
+
+    def is_idle(self, proxy):
+        """空闲且未熔断的代理才可以借出。"""
+        return proxy['id'] not in self.in_use and proxy['breaker'].is_closed
+
+    def push(self, proxy):
+        proxy['seq'] = next(self.seq)
+        heapq.heappush(self.heap, (self.score(proxy), proxy['seq'], proxy['id']))
+
+    def needs_load(self):
+        return self.last_load is None or time.monotonic() - self.last_load >= Config.PROXY_POOL_RELOAD_INTERVAL
+
+    async def load(self):
+        """从数据库合并代理列表：加入新代理，更新端口，移除已失效的空闲代理；内存中的计数不被覆盖。"""
+        async with self.load_lock:
+            if not self.needs_load():
+                return
+            rows = await self.data_manager.get_proxy_pool()
+            if rows is None:
+                return
+            ids = set()
+            for row in rows:
+                ids.add(row['id'])
+                proxy = self.proxies.get(row['id'])
+                if proxy is None:
+                    proxy = self.proxies[row['id']] = self.new_proxy(row)
+                    if self.is_idle(proxy):
+                        self.push(proxy)
+                else:
+                    proxy['current_port'] = row['current_port']
+            for proxy_id in list(self.proxies):
+                if proxy_id not in ids and proxy_id not in self.in_use:
+                    del self.proxies[proxy_id]
+            self.compact()
+            self.last_load = time.monotonic()
+            Globals.logger.debug(f"Loaded {len(self.proxies)} proxies, {len(self.in_use)} in use.", self.user)
+
+    def compact(self):
+        """过期条目过多时重建堆。"""
+        if len(self.heap) > 2 * len(self.proxies) + 64:
+            self.heap = []
+            for proxy in self.proxies.values():
+                if self.is_idle(proxy):
+                    self.push(proxy)
+
+    async def checkout(self):
+        """借出分数最低的空闲代理，没有时返回 None。"""
+        if self.needs_load():
+            await self.load()
+        while self.heap:
+            score, seq, proxy_id = heapq.heappop(self.heap)
+            proxy = self.proxies.get(proxy_id)
+            if proxy is None or proxy['seq'] != seq or not self.is_idle(proxy):
+                continue
+            self.in_use.add(proxy_id)
+            self.dirty[proxy_id] = True
+            Globals.logger.debug(f"Selected proxy: {proxy['current_port']}", self.user)
+            return {'id': proxy_id, 'current_port': proxy['current_port']}
+        return None
+
+    def release(self, proxy_id):
+        """归还代理，按最新分数重新入堆；已熔断的代理留在隔离区等待探测。"""
+        if proxy_id not in self.in_use:
+            return
+        self.in_use.discard(proxy_id)
+        self.dirty[proxy_id] = False
+        proxy = self.proxies.get(proxy_id)
+        if proxy and self.is_idle(proxy):
+            self.push(proxy)
+
+    def rescore(self, proxy):
+        # 借出中的代理在归还时才按新分数入堆
+        if self.is_idle(proxy):
+            self.push(proxy)
+            self.compact()
+
+    def observe(self, proxy_id, success=None, delay_ms=None):
+        """记录一次测速或请求的结果，更新成功率和（或）延迟的指数加权平均；只改内存，延迟随 flush 写回。"""
+        proxy = self.proxies.get(proxy_id)
+        if proxy is None:
+            return
+        alpha = Config.PROXY_EWMA_ALPHA
+        if success is not None:
+            proxy['success_rate'] = ewma(proxy['success_rate'], 1.0 if success else 0.0, alpha)
+        if delay_ms is not None:
+            proxy['latency'] = ewma(proxy['latency'], delay_ms, alpha)
+            proxy['current_delay'] = delay_ms
+            proxy['delay_count'] += 1
+            self.dirty_delays.add(proxy_id)
+        self.rescore(proxy)
+
+    def record_delay(self, proxy_id, delay_ms):
+        """记录一次请求的延迟，成功与否另行记录。"""
+        self.observe(proxy_id, delay_ms=delay_ms)
+
+    def add_count(self, proxy_id, success, fail):
+        counts = self.pending_counts.setdefault(proxy_id, [0, 0])
+        counts[0] += success
+        counts[1] += fail
+
+    def record_success(self, proxy_id):
+        proxy = self.proxies.get(proxy_id)
+        if proxy:
+            proxy['success_count'] += 1
+            proxy['breaker'].record_success()
+            self.observe(proxy_id, True)
+        self.add_count(proxy_id, 1, 0)
+
+    def record_fail(self, proxy_id):
+        proxy = self.proxies.get(proxy_id)
+        if proxy:
+            proxy['fail_count'] += 1
+            self.observe(proxy_id, False)
+            self.open_circuit(proxy, proxy['breaker'].record_failure(time.monotonic()))
+        self.add_count(proxy_id, 0, 1)
+
+    def trip(self, proxy_id):
+        """立即熔断代理，用于空响应这类明确表明代理已被限流的错误。"""
+        proxy = self.proxies.get(proxy_id)
+        if proxy and proxy['breaker'].is_closed:
+            self.open_circuit(proxy, proxy['breaker'].trip(time.monotonic()))
+
+    def open_circuit(self, proxy, quarantine):
+        if not quarantine:
+            return
+        heapq.heappush(self.quarantine, (proxy['breaker'].open_until, proxy['id']))
+        Globals.logger.warning(f"Proxy {proxy['id']} quarantined for {quarantine:.0f}s.", self.user)
+
+    async def probe(self, proxy):
+        """隔离到期后经 Xray 端口探测一次，决定恢复还是继续隔离。"""
+        async with self.probe_semaphore:
+            success = await probe_proxy(proxy['current_port'])
+        quarantine = proxy['breaker'].finish_probe(success, time.monotonic())
+        if success:
+            Globals.logger.info(f"Proxy {proxy['id']} recovered after probe.", self.user)
+            if self.is_idle(proxy):
+                self.push(proxy)
+        else:
+            self.open_circuit(proxy, quarantine)
+
+    async def run_probes(self):
+        """后台检查隔离到期的代理并发起探测。"""
+        probes = set()
+        while True:
+            await asyncio.sleep(Config.PROXY_PROBE_INTERVAL)
+            now = time.monotonic()
+            while self.quarantine and self.quarantine[0][0] <= now:
+                _, proxy_id = heapq.heappop(self.quarantine)
+                proxy = self.proxies.get(proxy_id)
+                if proxy is None or not proxy['breaker'].due_for_probe(now):
+                    continue
+                if proxy_id in self.in_use:
+                    # 仍被会话占用，归还后再探测
+                    heapq.heappush(self.quarantine, (now + Config.PROXY_PROBE_INTERVAL, proxy_id))
+                    continue
+                proxy['breaker'].start_probe()
+                task = asyncio.create_task(self.probe(proxy))
+                probes.add(task)
+                task.add_done_callback(probes.discard)
+
+    async def flush(self):
+        """把积累的 is_using 变化、次数增量和延迟统计批量写回数据库；写入失败的部分留到下次。"""
+        dirty, self.dirty = self.dirty, {}
+        for is_using in (True, False):
+            proxy_ids = [proxy_id for proxy_id, value in dirty.items() if value is is_using]
+            if proxy_ids and not await self.data_manager.set_proxies_in_use(proxy_ids, is_using):
+                for proxy_id in proxy_ids:
+                    # 写回期间又有新的变化时以新值为准
+                    self.dirty.setdefault(proxy_id, is_using)
+
+        dirty_delays, self.dirty_delays = self.dirty_delays, set()
+        delays = []
+        for proxy_id in dirty_delays:
+            proxy = self.proxies.get(proxy_id)
+            if proxy and proxy['latency'] is not None:
+                delays.append({
+                    'id': proxy_id,
+                    'current_delay': int(proxy['current_delay']),
+                    'avg_delay': proxy['latency'],
+                    'delay_count': proxy['delay_count']
+                })
+        if delays and not await self.data_manager.set_proxy_delays(delays):
+            self.dirty_delays.update(delay['id'] for delay in delays)
+
+        pending_counts, self.pending_counts = self.pending_counts, {}
+        deltas = [
+            {'id': proxy_id, 'success': success, 'fail': fail}
+            for proxy_id, (success, fail) in pending_counts.items()
+        ]
+        if deltas and not await self.data_manager.add_proxy_counts(deltas):
+            for delta in deltas:
+                self.add_count(delta['id'], delta['success'], delta['fail'])
+
+    async def run_sync(self):
+        """后台定期写回 is_using、次数增量和延迟统计。"""
+        while True:
+            await asyncio.sleep(Config.PROXY_POOL_SYNC_INTERVAL)
+            try:
+                await self.flush()
+            except Exception as e:
+                Globals.logger.error(f"Failed to sync proxy state: {e}", self.user)
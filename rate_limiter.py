@@ -0,0 +1,79 @@
+# rate_limiter.py
+
+import time
+
+from config.config import Config
+
+class AdaptiveTokenBucket(object):
+    """按 AIMD 调整速率的令牌桶：成功时线性加速，被限流或出错时按比例减速。"""
+    def __init__(self, rate, burst, min_rate, max_rate):
+        self.rate = rate  # 每秒令牌数
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, now=None):
+        """预留一个令牌，返回需要等待的秒数；令牌可以透支，透支部分按当前速率折算为等待时间。"""
+        now = time.monotonic() if now is None else now
+        self.refill(now)
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return 0
+        return -self.tokens / self.rate
+
+    def cancel(self):
+        """退回一次预留。"""
+        self.tokens = min(self.burst, self.tokens + 1)
+
+    def increase(self, step):
+        self.rate = min(self.max_rate, self.rate + step)
+
+    def decrease(self, factor):
+        self.refill(time.monotonic())
+        self.rate = max(self.min_rate, self.rate * factor)
+
+class ProxyRateLimiter(object):
+    """按代理维护自适应令牌桶，根据实际的空响应和错误率调整每个代理的请求预算。"""
+    def __init__(self):
+        self.buckets = {}
+
+    def bucket(self, proxy_id):
+        bucket = self.buckets.get(proxy_id)
+        if bucket is None:
+            bucket = AdaptiveTokenBucket(
+                rate=Config.PROXY_RATE_INITIAL,
+                burst=Config.PROXY_RATE_BURST,
+                min_rate=Config.PROXY_RATE_MIN,
+                max_rate=Config.PROXY_RATE_MAX
+            )
+            self.buckets[proxy_id] = bucket
+        return bucket
+
+    def reserve(self, proxy_id):
+        """为代理预留一次请求，返回发出请求前应等待的秒数。"""
+        return self.bucket(proxy_id).reserve()
+
+    def cancel(self, proxy_id):
+        self.bucket(proxy_id).cancel()
+
+    def record_success(self, proxy_id):
+        if proxy_id is not None:
+            self.bucket(proxy_id).increase(Config.PROXY_RATE_INCREASE)
+
+    def record_throttled(self, proxy_id):
+        """TikTok 返回空响应，通常意味着代理被限流，大幅降速。"""
+        if proxy_id is not None:
+            self.bucket(proxy_id).decrease(0.5)
+
+    def record_error(self, proxy_id):
+        if proxy_id is not None:
+            self.bucket(proxy_id).decrease(0.8)
+
+    def rate(self, proxy_id):
+        return self.bucket(proxy_id).rate
@@ -0,0 +1,131 @@
+# session_pool.py
+
+import asyncio
+import time
+from collections import deque
+
+class CheckoutMetrics(object):
+    """记录会话借出时的等待时间。"""
+    def __init__(self):
+        self.count = 0
+        self.waited = 0  # 需要排队等待的借出次数
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record(self, wait, queued):
+        self.count += 1
+        if queued:
+            self.waited += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+
+    def snapshot(self, reset=False):
+        data = {
+            'checkouts': self.count,
+            'waited': self.waited,
+            'avg_wait_ms': round(self.total_wait / self.count * 1000, 2) if self.count else 0,
+            'max_wait_ms': round(self.max_wait * 1000, 2),
+        }
+        if reset:
+            self.__init__()
+        return data
+
+class SessionPool(object):
+    """会话池：按并发槽位管理空闲会话，借出与归还均为 O(1)，等待者按先来先得唤醒。
+
+    每个会话在空闲队列中出现的次数等于其空闲槽位数。重建中的会话不会被借出，
+    它的槽位被暂存起来，重建成功后通过 resume 放回；移出池的会话其槽位直接丢弃。
+    暂存槽位时调用 on_park(session)，由调用方判断会话是否需要重建（例如子进程在空闲时退出）。
+    """
+    def __init__(self, on_park=None):
+        self.sessions = []
+        self.idle = deque()
+        self.waiters = deque()
+        self.parked = {}  # session -> 暂存的槽位数
+        self.on_park = on_park
+        self.metrics = CheckoutMetrics()
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def __iter__(self):
+        return iter(list(self.sessions))
+
+    def add(self, session):
+        """加入一个已就绪的会话，并放出它的全部槽位。"""
+        self.sessions.append(session)
+        for _ in range(session.max_inflight):
+            self._put(session)
+
+    def remove(self, session):
+        """将会话移出池；空闲队列中残留的槽位在借出时被跳过。"""
+        if session in self.sessions:
+            self.sessions.remove(session)
+        self.parked.pop(session, None)
+
+    def resume(self, session):
+        """会话重建完成后，放回重建期间暂存的槽位。"""
+        for _ in range(self.parked.pop(session, 0)):
+            self._put(session)
+
+    def _park(self, session):
+        self.parked[session] = self.parked.get(session, 0) + 1
+        if self.on_park:
+            self.on_park(session)
+
+    def _put(self, session):
+        if session not in self.sessions:
+            return
+        if not session.is_ready():
+            self._park(session)
+            return
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(session)
+                return
+        self.idle.append(session)
+
+    def _pop_idle(self):
+        while self.idle:
+            session = self.idle.popleft()
+            if session not in self.sessions:
+                continue
+            if not session.is_ready():
+                self._park(session)
+                continue
+            return session
+        return None
+
+    async def checkout(self):
+        """借出一个有空闲槽位的会话，没有时排队等待。"""
+        start = time.monotonic()
+        session = self._pop_idle()
+        queued = session is None
+        retry = False
+        while session is None:
+            waiter = asyncio.get_event_loop().create_future()
+            # 被唤醒却拿到失效会话的等待者重新排到队首，保持先来先得
+            if retry:
+                self.waiters.appendleft(waiter)
+            else:
+                self.waiters.append(waiter)
+            try:
+                session = await waiter
+            except asyncio.CancelledError:
+                # 已经分到槽位但任务被取消，把槽位还回去
+                if waiter.done() and not waiter.cancelled():
+                    self._put(waiter.result())
+                raise
+            if session not in self.sessions or not session.is_ready():
+                self._put(session)
+                session = self._pop_idle()
+                retry = True
+        self.metrics.record(time.monotonic() - start, queued)
+        session.active += 1
+        return session
+
+    def release(self, session):
+        """归还会话的一个槽位。"""
+        session.active = max(0, session.active - 1)
+        self._put(session)
@@ -6,11 +6,15 @@ from models import AsyncSessionLocal
 from models.proxy_url import ProxyUrl
 from models.test_speed_url import TestSpeedUrl
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, update, func
+from sqlalchemy import select, update, func, case
+
+from config.config import Config
 
 class SpeedTester:
-    def __init__(self):
+    def __init__(self, proxy_pool=None):
         self.user = 'SpeedTester'
+        # 传入 ProxyPool 时测速结果交给代理池评分并由其写回，否则直接更新数据库
+        self.proxy_pool = proxy_pool
 
     async def run(self):
         await asyncio.sleep(10)
@@ -55,21 +59,32 @@ class SpeedTester:
                 end_time = asyncio.get_event_loop().time()
                 delay_ms = (end_time - start_time) * 1000
 
-                await self.update_proxy_url_delay(proxy_url.id, delay_ms)
+                if self.proxy_pool:
+                    self.proxy_pool.observe(proxy_url.id, True, delay_ms)
+                else:
+                    await self.update_proxy_url_delay(proxy_url.id, delay_ms)
 
                 await self.increment_test_speed_url_success_count(test_speed_url.id)
 
             except Exception as e:
+                if self.proxy_pool:
+                    self.proxy_pool.observe(proxy_url.id, False)
                 await self.increment_test_speed_url_fail_count(test_speed_url.id)
 
     async def update_proxy_url_delay(self, proxy_url_id: int, delay_ms: float):
+        # avg_delay 为指数加权平均；MySQL 按顺序执行 SET，avg_delay 须在 delay_count 之前计算
         async with AsyncSessionLocal() as session:
             stmt = (
                 update(ProxyUrl)
                 .where(ProxyUrl.id == proxy_url_id)
-                .values(
-                    current_delay=delay_ms,
-                    updated_at=func.now()
+                .ordered_values(
+                    (ProxyUrl.current_delay, delay_ms),
+                    (ProxyUrl.avg_delay, case(
+                        (ProxyUrl.delay_count > 0, ProxyUrl.avg_delay + Config.PROXY_EWMA_ALPHA * (delay_ms - ProxyUrl.avg_delay)),
+                        else_=delay_ms
+                    )),
+                    (ProxyUrl.delay_count, ProxyUrl.delay_count + 1),
+                    (ProxyUrl.updated_at, func.now())
                 )
             )
             await session.execute(stmt)
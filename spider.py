@@ -1,27 +1,65 @@
 import asyncio
-import subprocess
-import json
 import socket
 import time
 from collections import deque
+from contextlib import aclosing
+from datetime import datetime
 
+from account_scheduler import AccountScheduler
 from async_tiktok_data_manager import AsyncTikTokDataManager
+from browser_host import BrowserHostPool
+from child_process import ChildProcess, preferred_framing
+from config.config import Config
 from custom_globals import Globals
 from name_space import NamespaceManager
+from proxy_pool import ProxyPool
+from rate_limiter import ProxyRateLimiter
+from session_pool import SessionPool
 
 class Session(object):
     """封装 TikTokApi 会话及其相关代理信息，并使用网络命名空间隔离流量。"""
-    def __init__(self, namespace_manager: NamespaceManager, data_manager: AsyncTikTokDataManager, session_id: int, timeout=60):
+    def __init__(self, namespace_manager: NamespaceManager, data_manager: AsyncTikTokDataManager, proxy_pool: ProxyPool, session_id: int, timeout=60):
         self.namespace_manager = namespace_manager
         self.data_manager = data_manager
+        self.proxy_pool = proxy_pool
         self.namespace = None
         self.proxy = None
         self.playwright_process = None
-        self.in_use = False
+        self.num_tiktok_sessions = Config.CHILD_TIKTOK_SESSIONS  # 子进程内的 TikTokApi 会话数
+        self.max_inflight = self.num_tiktok_sessions * Config.SESSION_MAX_INFLIGHT  # 子进程可同时处理的命令数
+        self.child_health = []  # 子进程上报的各 TikTokApi 会话健康状况
+        self.active = 0  # 当前借出该会话的任务数
+        self.generation = 0  # 每次（重新）创建子进程时递增
         self.user = f'Session-{session_id}'  # 为每个会话分配唯一的用户标识
         self.timeout = timeout  # 会话重建的超时时间（秒）
         self.last_active = time.time()  # 用于健康检查
         self.rebuilding = False
+        self.draining = False  # 等待进行中的命令完成后回收子进程，期间不再借出
+        self.local_ip = None
+        self.base_port = None  # 子进程环境变量中的代理端口，换代理后由命名空间内的 DNAT 转到新端口
+        self.commands = 0  # 当前子进程已执行的命令数
+
+    def is_ready(self):
+        """子进程在运行且未处于重建或排空中，可以接收新命令。"""
+        return not self.rebuilding and not self.draining and not self.is_lost()
+
+    def is_lost(self):
+        """子进程已退出，只有重建才能恢复。"""
+        return self.playwright_process is None or not self.playwright_process.is_running()
+
+    def on_draining_host(self):
+        """独占子进程的会话不属于任何共享子进程。"""
+        return False
+
+    def recycle_reason(self):
+        """子进程达到回收阈值时返回原因，否则返回 None。"""
+        if Config.SESSION_RECYCLE_COMMANDS and self.commands >= Config.SESSION_RECYCLE_COMMANDS:
+            return f"{self.commands} commands"
+        if Config.SESSION_RECYCLE_RSS_MB:
+            rss_mb = self.playwright_process.tree_rss() / (1024 * 1024)
+            if rss_mb >= Config.SESSION_RECYCLE_RSS_MB:
+                return f"RSS {rss_mb:.0f}MB"
+        return None
 
     async def create(self):
         """初始化会话，包括分配命名空间和代理，并启动Playwright会话在该命名空间内。"""
@@ -32,7 +70,7 @@ class Session(object):
             raise Exception("No available namespaces.")
 
         # Get an available proxy
-        self.proxy = await self.data_manager.get_available_proxy()
+        self.proxy = await self.proxy_pool.checkout()
         if not self.proxy:
             await self.namespace_manager.release_namespace(self.namespace)
             self.namespace = None
@@ -44,27 +82,26 @@ class Session(object):
             raise Exception("Failed to get local IP.")
 
         # Prepare environment variables
+        self.local_ip = local_ip
+        self.base_port = self.proxy['current_port']
         proxy_url = f"http://{local_ip}:{self.proxy['current_port']}"
 
         # Construct the command to execute with environment variables
         cmd = (
             f"export http_proxy={proxy_url} && "
             f"export https_proxy={proxy_url} && "
-            f"python3 playwright_session.py"
+            f"python3 playwright_session.py --max-inflight {self.max_inflight} "
+            f"--num-sessions {self.num_tiktok_sessions} --balance {Config.CHILD_SESSION_BALANCE} "
+            f"--framing {preferred_framing()} --block {Config.CHILD_BLOCK_RESOURCES} "
+            f"--launch-profile {Config.CHILD_LAUNCH_PROFILE} --context-recycle-after {Config.CHILD_CONTEXT_RECYCLE_AFTER} "
+            f"--stream-limit {Config.CHILD_STREAM_LIMIT}"
         )
 
         # Start the Playwright process in the namespace with the environment variables
-        self.playwright_process = subprocess.Popen(
-            ["ip", "netns", "exec", self.namespace, "bash", "-c", cmd],
-            stdin=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            bufsize=1  # Line buffering
-        )
-
-        # Asynchronously log child process stderr
-        asyncio.create_task(self.log_child_stderr())
+        self.playwright_process = ChildProcess(user=self.user, timeout=self.timeout)
+        await self.playwright_process.start("ip", "netns", "exec", self.namespace, "bash", "-c", cmd)
+        self.generation += 1
+        self.commands = 0
 
         # 更新最后活动时间
         self.last_active = time.time()
@@ -80,40 +117,17 @@ class Session(object):
             Globals.logger.error(f"获取本机 IP 地址时出错: {e}", self.user)
             return None
 
-    async def log_child_stderr(self):
-        """异步读取子进程的stderr并记录日志"""
-        while True:
-            if self.playwright_process and self.playwright_process.stderr:
-                line = await asyncio.get_event_loop().run_in_executor(None, self.playwright_process.stderr.readline)
-                if line:
-                    Globals.logger.error(f"Child process stderr: {line.strip()}", self.user)
-                else:
-                    break
-            else:
-                await asyncio.sleep(0.2)
-                break
-
     async def close(self):
         """关闭会话并释放资源。"""
         Globals.logger.debug("Closing session...", self.user)
         # Mark proxy as not in use
         if self.proxy:
-            await self.data_manager.set_proxy_in_use(self.proxy['id'], False)
+            self.proxy_pool.release(self.proxy['id'])
             self.proxy = None  # 确保代理被释放
 
         # Terminate Playwright process
         if self.playwright_process:
-            self.playwright_process.terminate()
-            try:
-                await asyncio.wait_for(
-                    asyncio.get_event_loop().run_in_executor(None, self.playwright_process.wait),
-                    timeout=10
-                )
-                Globals.logger.debug("Playwright process terminated gracefully.", self.user)
-            except asyncio.TimeoutError:
-                Globals.logger.warning("Playwright进程终止超时，强制杀死进程", self.user)
-                self.playwright_process.kill()
-                await asyncio.get_event_loop().run_in_executor(None, self.playwright_process.wait)
+            await self.playwright_process.terminate()
             self.playwright_process = None  # 确保进程被释放
 
         # Release the namespace back to NamespaceManager
@@ -121,259 +135,749 @@ class Session(object):
             await self.namespace_manager.release_namespace(self.namespace)
             self.namespace = None
 
-        self.in_use = False  # 更新会话状态
+    async def rebuild_session(self, generation=None):
+        """重建会话，包括清理现有资源并重新初始化。
 
-    async def rebuild_session(self):
-        async with Globals.session_lock:
-            if self.rebuilding:
-                return
-            self.rebuilding = True
+        generation 为调用方发出命令时会话所处的代数；同一子进程上并发的多条命令
+        可能同时失败，只有第一个调用会触发重建，其余发现代数已变化后直接返回。
+        """
+        # 检查与置位之间没有 await，无需全局锁；各会话的重建可以并行进行
+        if self.rebuilding:
+            return
+        if generation is not None and generation != self.generation:
+            return
+        self.rebuilding = True
 
-            """重建会话，包括清理现有资源并重新初始化。"""
-            Globals.logger.debug("Rebuilding session...", self.user)
-            try:
-                # 关闭当前会话资源
-                await self.close()
+        Globals.logger.debug("Rebuilding session...", self.user)
+        try:
+            # 关闭当前会话资源
+            await self.close()
 
-                # 检查资源是否已释放
-                if self.in_use:
-                    Globals.logger.error("Session still in use after close. Aborting rebuild.", self.user)
-                    return
+            # 尝试重建会话，并设置超时
+            await asyncio.wait_for(self.create(), timeout=self.timeout)
+            self.last_active = time.time()
+            Globals.logger.debug("Session rebuilt successfully.", self.user)
+        except asyncio.TimeoutError:
+            Globals.logger.error("Session rebuild timed out. Forcing cleanup.", self.user)
+            await self.force_cleanup()
+            raise
+        except Exception as e:
+            Globals.logger.error(f"Failed to rebuild session: {str(e)}", self.user)
+            raise
+        finally:
+            self.rebuilding = False
 
-                # 尝试重建会话，并设置超时
-                await asyncio.wait_for(self.create(), timeout=self.timeout)
-                self.last_active = time.time()
-                Globals.logger.debug("Session rebuilt successfully.", self.user)
-            except asyncio.TimeoutError:
-                Globals.logger.error("Session rebuild timed out. Forcing cleanup.", self.user)
-                await self.force_cleanup()
-                raise
-            except Exception as e:
-                Globals.logger.error(f"Failed to rebuild session: {str(e)}", self.user)
-                raise
-            finally:
-                self.rebuilding = False
+    async def switch_proxy(self):
+        """换用一个新代理而不重启子进程：命名空间内把原代理端口 DNAT 到新代理端口，旧代理随即释放。
+
+        子进程仍连接创建时的代理地址，新建的连接会被转到新端口。
+        """
+        new_proxy = await self.proxy_pool.checkout()
+        if not new_proxy:
+            raise Exception("No available proxies.")
+        try:
+            await self.namespace_manager.redirect_proxy(self.namespace, self.local_ip, self.base_port, new_proxy['current_port'])
+        except Exception:
+            self.proxy_pool.release(new_proxy['id'])
+            raise
+        old_proxy, self.proxy = self.proxy, new_proxy
+        self.generation += 1
+        if old_proxy:
+            self.proxy_pool.release(old_proxy['id'])
+        Globals.logger.debug(f"Switched proxy {old_proxy and old_proxy['id']} -> {new_proxy['id']}.", self.user)
 
     async def force_cleanup(self):
         """强制清理会话资源，包括从进程层面杀死子进程。"""
         Globals.logger.debug("Force cleaning up session...", self.user)
         if self.playwright_process:
-            self.playwright_process.kill()
-            await asyncio.get_event_loop().run_in_executor(None, self.playwright_process.wait)
+            await self.playwright_process.kill()
             self.playwright_process = None
         if self.namespace:
             await self.namespace_manager.release_namespace(self.namespace)
             self.namespace = None
         if self.proxy:
-            await self.data_manager.set_proxy_in_use(self.proxy['id'], False)
+            self.proxy_pool.release(self.proxy['id'])
             self.proxy = None
-        self.in_use = False
 
     async def send_command(self, command: dict):
         """向子进程发送命令并等待响应。"""
-        if not self.playwright_process or self.playwright_process.poll() is not None:
+        if not self.playwright_process:
             raise Exception("Playwright子进程未运行")
 
-        # 发送命令
-        command_str = json.dumps(command) + "\n"
-        self.playwright_process.stdin.write(command_str)
-        self.playwright_process.stdin.flush()
+        if command.get("action") != "health":
+            self.commands += 1
+        response = await self.playwright_process.send_command(command)
 
-        # 监听响应
-        try:
-            response = await asyncio.wait_for(
-                asyncio.get_event_loop().run_in_executor(None, self.playwright_process.stdout.readline),
-                timeout=self.timeout
-            )
-        except asyncio.TimeoutError:
-            raise Exception("Timed out waiting for response from child process")
+        # 更新最后活动时间
+        self.last_active = time.time()
+        return response
+
+    async def stream_command(self, command: dict):
+        """向子进程发送流式命令，逐条产出部分响应和最终响应。"""
+        if not self.playwright_process:
+            raise Exception("Playwright子进程未运行")
 
-        if not response:
-            raise Exception("No response from child process")
+        self.commands += 1
+        # 显式关闭内层生成器，调用方提前退出时立即通知子进程取消命令
+        async with aclosing(self.playwright_process.stream_command(command)) as responses:
+            async for response in responses:
+                # 更新最后活动时间
+                self.last_active = time.time()
+                yield response
+
+    async def check_health(self):
+        """向子进程查询各 TikTokApi 会话的健康状况，返回是否至少有一个会话健康。"""
+        response = await self.send_command({"action": "health"})
+        if not response or response.get('status') != 'success':
+            return False
+        self.child_health = response['data']
+        return any(stat['healthy'] for stat in self.child_health)
+
+class ContextSession(Session):
+    """共享浏览器后端的会话：在 BrowserHost 的 Chromium 中占用一个浏览器上下文，上下文直连本机 Xray 端口。
+
+    不需要网络命名空间和独立的子进程；重建只是关闭旧上下文、换一个代理再打开新上下文。
+    """
+    def __init__(self, host_pool: BrowserHostPool, data_manager: AsyncTikTokDataManager, proxy_pool: ProxyPool, session_id: int, timeout=60):
+        super().__init__(None, data_manager, proxy_pool, session_id, timeout)
+        self.host_pool = host_pool
+        self.host = None
+        self.host_generation = None
+        self.context_id = None
+        self.num_tiktok_sessions = 1
+        self.max_inflight = Config.SESSION_MAX_INFLIGHT
+
+    def is_lost(self):
+        """上下文未打开，或所在的共享子进程已不是打开它时的那一个（子进程重启后旧上下文随之失效）。"""
+        return (
+            super().is_lost()
+            or self.context_id is None
+            or self.host.generation != self.host_generation
+        )
 
-        # 更新最后活动时间
+    def on_draining_host(self):
+        return self.host is not None and self.host.draining
+
+    def recycle_reason(self):
+        # 进程树内存属于整个共享子进程，由 Spider.watch_session_memory 按 BrowserHost 回收，这里只按命令数回收
+        if Config.SESSION_RECYCLE_COMMANDS and self.commands >= Config.SESSION_RECYCLE_COMMANDS:
+            return f"{self.commands} commands"
+        return None
+
+    async def create(self):
+        """获取代理，并在负载最低的共享子进程中打开使用该代理的浏览器上下文。"""
+        Globals.logger.debug("Creating context session...", self.user)
+        self.proxy = await self.proxy_pool.checkout()
+        if not self.proxy:
+            raise Exception("No available proxies.")
+        try:
+            self.host = self.host_pool.pick()
+            self.context_id, self.host_generation = await self.host.open_context(f"http://127.0.0.1:{self.proxy['current_port']}")
+        except Exception:
+            self.proxy_pool.release(self.proxy['id'])
+            self.proxy = None
+            raise
+        self.playwright_process = self.host.process
+        self.namespace = self.host.user  # 仅用于日志
+        self.generation += 1
+        self.commands = 0
         self.last_active = time.time()
 
-        # 尝试解析 JSON
+    async def close(self):
+        """关闭浏览器上下文并释放代理，共享子进程继续运行。"""
+        Globals.logger.debug("Closing context session...", self.user)
+        if self.proxy:
+            self.proxy_pool.release(self.proxy['id'])
+            self.proxy = None
+        if self.context_id is not None:
+            try:
+                await self.host.close_context(self.context_id, self.host_generation)
+            except Exception as e:
+                Globals.logger.warning(f"Failed to close context {self.context_id}: {e}", self.user)
+            self.context_id = None
+        self.playwright_process = None
+
+    async def force_cleanup(self):
+        """不杀死共享子进程，只尽力关闭上下文并释放代理。"""
+        Globals.logger.debug("Force cleaning up context session...", self.user)
+        if self.context_id is not None:
+            try:
+                await asyncio.wait_for(self.host.close_context(self.context_id, self.host_generation), timeout=5)
+            except Exception as e:
+                Globals.logger.warning(f"Failed to close context {self.context_id}: {e}", self.user)
+        self.context_id = None
+        self.playwright_process = None
+        if self.proxy:
+            self.proxy_pool.release(self.proxy['id'])
+            self.proxy = None
+
+    async def switch_proxy(self):
+        """在同一个共享子进程中打开使用新代理的上下文，替换旧上下文后关闭它，并释放旧代理。"""
+        new_proxy = await self.proxy_pool.checkout()
+        if not new_proxy:
+            raise Exception("No available proxies.")
         try:
-            parsed_response = json.loads(response)
-            return parsed_response
-        except json.JSONDecodeError:
-            # 非 JSON 报文，直接打印
-            Globals.logger.info(f"Non-JSON message from child process: {response}", self.user)
-            return None
+            context_id, host_generation = await self.host.open_context(f"http://127.0.0.1:{new_proxy['current_port']}")
+        except Exception:
+            self.proxy_pool.release(new_proxy['id'])
+            raise
+        old_proxy, old_context_id, old_host_generation = self.proxy, self.context_id, self.host_generation
+        self.proxy, self.context_id, self.host_generation = new_proxy, context_id, host_generation
+        self.playwright_process = self.host.process
+        self.generation += 1
+        if old_proxy:
+            self.proxy_pool.release(old_proxy['id'])
+        if old_context_id is not None:
+            try:
+                await self.host.close_context(old_context_id, old_host_generation)
+            except Exception as e:
+                Globals.logger.warning(f"Failed to close context {old_context_id}: {e}", self.user)
+        Globals.logger.debug(f"Switched proxy {old_proxy and old_proxy['id']} -> {new_proxy['id']}.", self.user)
+
+    async def send_command(self, command: dict):
+        return await super().send_command({**command, "context": self.context_id})
+
+    async def stream_command(self, command: dict):
+        async with aclosing(super().stream_command({**command, "context": self.context_id})) as responses:
+            async for response in responses:
+                yield response
 
 class Spider(object):
     def __init__(self, max_concurrent_sessions=5):
         self.data_manager = AsyncTikTokDataManager()
-        self.namespace_manager = NamespaceManager(max_namespaces=max_concurrent_sessions)
+        self.proxy_pool = ProxyPool(self.data_manager)
+        self.num_spares = Config.SESSION_HOT_SPARES
+        self.backend = Config.SESSION_BACKEND
+        self.namespace_manager = None
+        self.browser_hosts = None
+        if self.backend == 'shared':
+            self.browser_hosts = BrowserHostPool(Config.BROWSER_HOSTS)
+            session_capacity = Config.SESSION_MAX_INFLIGHT
+        else:
+            # 热备会话同样需要独占一个命名空间
+            self.namespace_manager = NamespaceManager(max_namespaces=max_concurrent_sessions + self.num_spares)
+            session_capacity = Config.CHILD_TIKTOK_SESSIONS * Config.SESSION_MAX_INFLIGHT
         self.user = 'Spider'
-        self.account_queue = deque()
+        self.account_queue = asyncio.Queue(maxsize=Config.ACCOUNT_QUEUE_SIZE)
+        self.scheduler = AccountScheduler(self.data_manager)
         self.max_concurrent_sessions = max_concurrent_sessions
-        self.semaphore = asyncio.Semaphore(self.max_concurrent_sessions)
-        self.session_pool = []
+        self.num_workers = self.max_concurrent_sessions * session_capacity
+        self.session_pool = SessionPool(on_park=self.session_parked)
+        self.pending_rebuilds = set()  # 已安排重建、尚未完成的会话
+        self.rate_limiter = ProxyRateLimiter()
+        self.spares = deque()  # 已就绪、绑定好命名空间和代理的热备会话
+        self.spares_building = 0
+        self.spare_needed = asyncio.Event()
         self.session_id_counter = 0  # 用于给会话分配唯一的ID
+        self.bootstrap_semaphore = asyncio.Semaphore(Config.SESSION_BOOTSTRAP_CONCURRENCY)
+        self.next_session_start = 0  # 下一个会话最早的启动时间（事件循环时钟）
+        self.sessions_creating = 0
+        self.startup_started = None
+        self.first_session_ready = asyncio.Event()
         self.health_check_interval = 3600  # 健康检查的间隔时间（秒）
 
     async def initialize_namespace_and_sessions(self):
-        """初始化网络命名空间和会话池。"""
+        """初始化网络命名空间和会话池；第一个会话就绪后即返回，其余会话在后台继续创建。"""
         Globals.logger.debug("Initializing namespace and sessions...", self.user)
-        # 创建 sessions up to max_concurrent_sessions
-        for _ in range(self.max_concurrent_sessions):
-            session = self.create_new_session()
-            try:
-                await session.create()
-                self.session_pool.append(session)
+        self.startup_started = time.monotonic()
+        bootstrap = asyncio.create_task(self.create_sessions(self.max_concurrent_sessions))
+        first_ready = asyncio.create_task(self.first_session_ready.wait())
+        await asyncio.wait([bootstrap, first_ready], return_when=asyncio.FIRST_COMPLETED)
+        first_ready.cancel()
+
+    async def create_sessions(self, count):
+        """以有限并发创建 count 个会话并加入会话池，不持有全局锁。"""
+        self.sessions_creating += count
+        await asyncio.gather(*(self.create_pool_session() for _ in range(count)))
+
+    async def create_pool_session(self):
+        try:
+            async with self.bootstrap_semaphore:
+                await self.wait_ramp_up()
+                session = self.create_new_session()
+                try:
+                    await asyncio.wait_for(session.create(), timeout=session.timeout)
+                except Exception as e:
+                    Globals.logger.error(f"Failed to create session: {e}", self.user)
+                    await session.force_cleanup()
+                    return
+                self.session_pool.add(session)
                 Globals.logger.debug(f"Session {session.user} created and added to pool.", self.user)
-            except Exception as e:
-                Globals.logger.error(f"Failed to create session: {e}", self.user)
+                self.record_startup_progress()
+        finally:
+            self.sessions_creating -= 1
+
+    async def wait_ramp_up(self):
+        """按 SESSION_RAMP_UP_INTERVAL 错开各会话的启动时间，避免同时冲击代理。"""
+        loop = asyncio.get_event_loop()
+        now = loop.time()
+        start = max(now, self.next_session_start)
+        self.next_session_start = start + Config.SESSION_RAMP_UP_INTERVAL
+        if start > now:
+            await asyncio.sleep(start - now)
+
+    def record_startup_progress(self):
+        """记录启动耗时：首个会话就绪、会话池首次满员。"""
+        if self.startup_started is None:
+            return
+        elapsed = time.monotonic() - self.startup_started
+        if not self.first_session_ready.is_set():
+            self.first_session_ready.set()
+            Globals.logger.info(f"First session ready after {elapsed:.1f}s.", self.user)
+        if len(self.session_pool) >= self.max_concurrent_sessions:
+            Globals.logger.info(f"Session pool full ({len(self.session_pool)} sessions) after {elapsed:.1f}s.", self.user)
+            self.startup_started = None
 
     def create_new_session(self):
         """创建一个新的会话实例并分配唯一ID。"""
         self.session_id_counter += 1
-        return Session(namespace_manager=self.namespace_manager, data_manager=self.data_manager, session_id=self.session_id_counter)
+        if self.backend == 'shared':
+            return ContextSession(
+                host_pool=self.browser_hosts,
+                data_manager=self.data_manager,
+                proxy_pool=self.proxy_pool,
+                session_id=self.session_id_counter
+            )
+        return Session(
+            namespace_manager=self.namespace_manager,
+            data_manager=self.data_manager,
+            proxy_pool=self.proxy_pool,
+            session_id=self.session_id_counter
+        )
 
     async def main(self):
         await self.initialize_namespace_and_sessions()
+        await self.scheduler.refresh(force=True)
         # 启动后台任务以监控和维护会话池
         asyncio.create_task(self.monitor_sessions())
         asyncio.create_task(self.health_check_sessions())
+        asyncio.create_task(self.maintain_spares())
+        asyncio.create_task(self.watch_session_memory())
+        asyncio.create_task(self.proxy_pool.run_sync())
+        asyncio.create_task(self.proxy_pool.run_probes())
+        workers = [asyncio.create_task(self.account_worker()) for _ in range(self.num_workers)]
         try:
-            while True:
-                accounts = await self.data_manager.get_active_tiktok_accounts()
-                if not accounts:
-                    Globals.logger.debug("No active accounts found. Sleeping for 5 seconds.", self.user)
-                    await asyncio.sleep(5)
-                    continue
-                await self.process_accounts(accounts)
+            await self.produce_accounts()
         finally:
+            for worker in workers:
+                worker.cancel()
             await self.close_all_sessions()
 
+    async def produce_accounts(self):
+        """持续把到期账户送入有界队列；出堆的账户在处理完成前不会再次入队。"""
+        while True:
+            await self.scheduler.refresh()
+            account = self.scheduler.pop_due()
+            if account is None:
+                wait = self.scheduler.next_due_in()
+                if wait is None or wait > Config.ACCOUNT_POLL_INTERVAL:
+                    wait = Config.ACCOUNT_POLL_INTERVAL
+                await asyncio.sleep(wait)
+                continue
+            await self.account_queue.put(account)
+
+    async def account_worker(self):
+        """从队列中持续取出账户处理，单个慢账户只占用一个 worker。"""
+        while True:
+            account = await self.account_queue.get()
+            comments = None
+            try:
+                comments = await self.process_account(account)
+            except Exception as e:
+                Globals.logger.error(f"Unhandled error processing account {account['account_name']}: {e}", self.user)
+            finally:
+                await self.scheduler.complete(account, comments)
+                self.account_queue.task_done()
+
     async def monitor_sessions(self):
         """监控会话池，确保始终有max_concurrent_sessions个会话在运行。"""
         while True:
-            async with Globals.session_lock:
-                active_sessions = len(self.session_pool)
-                if active_sessions < self.max_concurrent_sessions:
-                    to_create = self.max_concurrent_sessions - active_sessions
-                    Globals.logger.debug(f"Session pool below max. Creating {to_create} new sessions.", self.user)
-                    for _ in range(to_create):
-                        session = self.create_new_session()
-                        try:
-                            await session.create()
-                            self.session_pool.append(session)
-                            Globals.logger.debug(f"Session {session.user} created and added to pool.", self.user)
-                        except Exception as e:
-                            Globals.logger.error(f"Failed to create session: {e}", self.user)
+            missing = self.max_concurrent_sessions - len(self.session_pool) - self.sessions_creating
+            if missing > 0:
+                Globals.logger.debug(f"Session pool below max. Creating {missing} new sessions.", self.user)
+                to_create = 0
+                for _ in range(missing):
+                    spare = self.take_spare()
+                    if spare:
+                        self.session_pool.add(spare)
+                        Globals.logger.debug(f"Spare {spare.user} promoted to pool.", self.user)
+                    else:
+                        to_create += 1
+                if to_create:
+                    asyncio.create_task(self.create_sessions(to_create))
+            Globals.logger.debug(f"Session checkout metrics: {self.session_pool.metrics.snapshot(reset=True)}", self.user)
             await asyncio.sleep(10)  # 每10秒检查一次
 
+    def session_parked(self, session):
+        """会话的槽位被暂存时调用：子进程已退出（而非正在重建或排空）时立即安排重建，不等健康检查。"""
+        if session.rebuilding or session.draining or session in self.pending_rebuilds or not session.is_lost():
+            return
+        Globals.logger.warning(f"Session {session.user} child exited. Rebuilding...", self.user)
+        self.pending_rebuilds.add(session)
+        task = asyncio.create_task(self.rebuild_session(session, session.generation))
+        task.add_done_callback(lambda _: self.pending_rebuilds.discard(session))
+
     async def health_check_sessions(self):
-        """定期检查会话的健康状态，如果发现会话长时间未活动，则重建会话。"""
+        """定期检查会话的健康状态：子进程无响应或其中已无健康的 TikTokApi 会话时重建。"""
         while True:
-            async with Globals.session_lock:
-                for session in self.session_pool:
-                    if time.time() - session.last_active > session.timeout:
-                        Globals.logger.warning(f"Session {session.user} is unresponsive. Rebuilding...", self.user)
-                        asyncio.create_task(session.rebuild_session())
+            for session in self.session_pool:
+                if session.rebuilding or session.draining:
+                    continue
+                if not session.is_ready():
+                    # 子进程已意外退出，其槽位被暂存在池中，需重建后才能放回
+                    Globals.logger.warning(f"Session {session.user} child exited. Rebuilding...", self.user)
+                    asyncio.create_task(self.rebuild_session(session, session.generation))
+                    continue
+                generation = session.generation
+                try:
+                    healthy = await session.check_health()
+                except Exception as e:
+                    Globals.logger.warning(f"Health check failed for {session.user}: {e}", self.user)
+                    healthy = False
+                if healthy:
+                    Globals.logger.debug(f"Session {session.user} health: {session.child_health}", self.user)
+                else:
+                    Globals.logger.warning(f"Session {session.user} is unhealthy. Rebuilding...", self.user)
+                    asyncio.create_task(self.rebuild_session(session, generation))
             await asyncio.sleep(self.health_check_interval)
 
     async def close_all_sessions(self):
         """关闭所有会话并清理资源。"""
         Globals.logger.debug("Closing all sessions...", self.user)
         for session in self.session_pool:
+            self.session_pool.remove(session)
             await session.close()
-        self.session_pool = []
-
-    async def process_accounts(self, accounts):
-        """处理账户队列中的所有账户。"""
-        for account in accounts:
-            if account not in self.account_queue:
-                self.account_queue.append(account)
-
-        tasks = []
-        while self.account_queue:
-            account = self.account_queue.popleft()
-            task = asyncio.create_task(self.process_account_semaphore(account))
-            tasks.append(task)
-
-        if tasks:
-            await asyncio.gather(*tasks)
-
-    async def process_account_semaphore(self, account):
-        """使用信号量限制并发会话数量。"""
-        async with self.semaphore:
-            await self.process_account(account)
+        while self.spares:
+            await self.spares.popleft().close()
+        if self.browser_hosts:
+            await self.browser_hosts.close()
+        await self.proxy_pool.flush()
 
     async def get_available_session(self):
-        """获取一个可用的会话。如果没有可用会话，则等待。"""
-        while True:
-            async with Globals.session_lock:
-                for session in self.session_pool:
-                    if not session.in_use:
-                        session.in_use = True
-                        return session
-            await asyncio.sleep(0.1)
+        """获取一个仍有空闲并发槽位的会话。如果没有可用会话，则排队等待。"""
+        return await self.session_pool.checkout()
 
     async def release_session(self, session):
         """释放一个会话，使其可供其他任务使用。"""
-        async with Globals.session_lock:
-            session.in_use = False
+        self.session_pool.release(session)
+
+    async def acquire_request_budget(self, session):
+        """命令发出前按会话当前代理的令牌桶等待，返回命令实际使用的代理 id。
+
+        等待期间会话换了代理时退回旧代理的预留，按新代理重新预留。
+        """
+        while session.proxy:
+            proxy_id = session.proxy['id']
+            delay = self.rate_limiter.reserve(proxy_id)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if session.proxy and session.proxy['id'] == proxy_id:
+                return proxy_id
+            self.rate_limiter.cancel(proxy_id)
+        return None
+
+    async def maintain_spares(self):
+        """在后台维持 SESSION_HOT_SPARES 个已预热的热备会话。"""
+        while True:
+            while len(self.spares) + self.spares_building < self.num_spares:
+                self.spares_building += 1
+                asyncio.create_task(self.build_spare())
+            self.spare_needed.clear()
+            try:
+                await asyncio.wait_for(self.spare_needed.wait(), timeout=10)
+            except asyncio.TimeoutError:
+                pass
+
+    async def build_spare(self):
+        session = self.create_new_session()
+        try:
+            async with self.bootstrap_semaphore:
+                await self.wait_ramp_up()
+                await asyncio.wait_for(session.create(), timeout=session.timeout)
+            self.spares.append(session)
+            Globals.logger.debug(f"Spare session {session.user} is ready.", self.user)
+        except Exception as e:
+            Globals.logger.error(f"Failed to create spare session: {e}", self.user)
+            await session.force_cleanup()
+            # 失败后稍等再重试，避免代理耗尽时空转
+            await asyncio.sleep(10)
+        finally:
+            self.spares_building -= 1
+            self.spare_needed.set()
+
+    def take_spare(self):
+        """取出一个仍然可用、且不在排空中的共享子进程上的热备会话，并通知后台补充。"""
+        while self.spares:
+            spare = self.spares.popleft()
+            self.spare_needed.set()
+            if not spare.is_ready():
+                asyncio.create_task(spare.force_cleanup())
+            elif spare.on_draining_host():
+                asyncio.create_task(self.retire_session(spare))
+            else:
+                return spare
+        return None
+
+    def retire_spares_on(self, host):
+        """关闭位于 host 上的热备会话，由后台在其他子进程上补充。"""
+        kept = deque()
+        for spare in self.spares:
+            if spare.host is host:
+                asyncio.create_task(self.retire_session(spare))
+            else:
+                kept.append(spare)
+        if len(kept) != len(self.spares):
+            self.spares = kept
+            self.spare_needed.set()
+
+    async def retire_session(self, session):
+        try:
+            await session.close()
+        except Exception as e:
+            Globals.logger.error(f"Failed to close retired session {session.user}: {e}", self.user)
+            await session.force_cleanup()
+
+    async def rebuild_session(self, session, generation=None):
+        """替换或重建失败的会话。
+
+        有热备会话时直接用它顶替，旧会话在后台关闭，不阻塞当前账户；
+        否则原地重建：成功后放回重建期间暂存的槽位，失败则将其移出会话池，由 monitor_sessions 补充。
+        """
+        if session not in self.session_pool.sessions or session.rebuilding:
+            return
+        if generation is not None and generation != session.generation:
+            # 会话已被别处重建或换过代理；若仍停在排空状态（回收期间代数变化），恢复借出，否则会话再也不会就绪
+            if session.draining:
+                session.draining = False
+                self.session_pool.resume(session)
+            return
+        # 排空中的会话也可能因命令失败先被重建，此后由重建结果决定是否放回槽位
+        session.draining = False
+        spare = self.take_spare()
+        if spare:
+            Globals.logger.debug(f"Swapping {session.user} for spare {spare.user}.", self.user)
+            self.session_pool.remove(session)
+            self.session_pool.add(spare)
+            asyncio.create_task(self.retire_session(session))
+            return
+        try:
+            await session.rebuild_session(generation)
+        except Exception as e:
+            Globals.logger.error(f"Removing {session.user} from pool after failed rebuild: {e}", self.user)
+            self.session_pool.remove(session)
+            await session.force_cleanup()
+            return
+        self.session_pool.resume(session)
+
+    async def switch_proxy(self, session, generation=None):
+        """代理出问题时只换代理，不重启子进程；换代理失败时退回完整重建。"""
+        if session not in self.session_pool.sessions or session.rebuilding:
+            return
+        if generation is not None and generation != session.generation:
+            return
+        session.draining = False
+        # 换代理期间暂停借出，归还的槽位暂存在池中
+        session.rebuilding = True
+        try:
+            await session.switch_proxy()
+        except Exception as e:
+            Globals.logger.warning(f"Failed to switch proxy for {session.user}: {e}. Rebuilding...", self.user)
+            session.rebuilding = False
+            await self.rebuild_session(session, session.generation)
+            return
+        session.rebuilding = False
+        self.session_pool.resume(session)
+
+    async def watch_session_memory(self):
+        """定期检查各子进程的命令数和进程树内存，超过阈值时排空后回收。"""
+        if not Config.SESSION_RECYCLE_COMMANDS and not Config.SESSION_RECYCLE_RSS_MB:
+            return
+        while True:
+            await asyncio.sleep(Config.SESSION_MEMORY_CHECK_INTERVAL)
+            if self.browser_hosts:
+                await self.check_browser_hosts()
+            for session in self.session_pool:
+                if session.rebuilding or session.draining or not session.is_ready():
+                    continue
+                reason = session.recycle_reason()
+                if reason:
+                    asyncio.create_task(self.recycle_session(session, reason))
+
+    async def check_browser_hosts(self):
+        """共享子进程内存超过阈值时停止向其分配上下文，把其上的会话和热备会话迁到其他子进程，迁空后关闭。
+
+        排空中的子进程每次检查都重新迁移：换代理时上下文仍开在原子进程上，迁移中途也可能有新的上下文落在上面。
+        """
+        for host in self.browser_hosts.hosts:
+            reason = host.recycle_reason()
+            if reason:
+                Globals.logger.info(f"Recycling {host.user}: {reason}. Migrating {len(host.contexts)} contexts.", self.user)
+                host.draining = True
+            if not host.draining:
+                continue
+            self.retire_spares_on(host)
+            for session in self.session_pool:
+                if session.host is host and not session.rebuilding and not session.draining:
+                    asyncio.create_task(self.recycle_session(session, f"{host.user} draining"))
+            await host.close_if_drained()
+
+    async def recycle_session(self, session, reason):
+        """停止借出会话，等待进行中的命令完成（最多 SESSION_DRAIN_TIMEOUT 秒），然后重建子进程。
+
+        会话正在重建或换代理时不再回收；排空期间代数发生变化时，由 rebuild_session 恢复借出。
+        """
+        if session.rebuilding or session.draining:
+            return
+        Globals.logger.info(f"Recycling {session.user}: {reason}. Draining {session.active} in-flight tasks.", self.user)
+        generation = session.generation
+        session.draining = True
+        deadline = time.monotonic() + Config.SESSION_DRAIN_TIMEOUT
+        while session.active > 0 and time.monotonic() < deadline:
+            await asyncio.sleep(0.5)
+        if session.active > 0:
+            Globals.logger.warning(f"{session.user} still has {session.active} tasks after draining. Recycling anyway.", self.user)
+        await self.rebuild_session(session, generation)
+
+    def video_crawl_since(self, account):
+        """增量抓取的起始发布时间；从未抓取过或到了完整遍历的时间时返回 None，抓取全部视频。"""
+        watermark = account.get('video_watermark')
+        last_full_sync_at = account.get('last_full_sync_at')
+        if not watermark or not last_full_sync_at:
+            return None
+        if (datetime.now() - last_full_sync_at).total_seconds() >= Config.VIDEO_FULL_RESYNC_INTERVAL:
+            return None
+        return watermark - Config.VIDEO_RECENT_WINDOW
+
+    def profile_is_fresh(self, account):
+        """资料在 ACCOUNT_PROFILE_INTERVAL 内抓取过且已知 sec_uid 时，本轮只抓视频。
+
+        抓取时间取自 tiktok_account.profile_fetched_at，重启后和 sql 模式下同样有效。
+        """
+        profile_fetched_at = account.get('profile_fetched_at')
+        if Config.ACCOUNT_PROFILE_INTERVAL <= 0 or not account.get('sec_uid') or not profile_fetched_at:
+            return False
+        return (datetime.now() - profile_fetched_at).total_seconds() < Config.ACCOUNT_PROFILE_INTERVAL
+
+    async def crawl_account(self, session, account, proxy_id=None):
+        """一次命令抓取账户资料和视频：资料先写库，视频逐页写库，完成后推进账户的视频水位线。
+
+        资料仍然新鲜时改发 get_user_videos，子进程用缓存的 sec_uid 直接翻页，省去一次用户查询。
+        子进程为资料查询和第一页视频附带单次请求的耗时，记作 proxy_id 的延迟样本。
+        子进程在返回任何数据之前失败时返回其错误响应，成功时返回 None；之后的失败以异常抛出。
+        """
+        since = self.video_crawl_since(account)
+        videos_only = self.profile_is_fresh(account)
+        command = {
+            "action": "get_user_videos" if videos_only else "crawl_account",
+            "username": account['unique_id'],
+            "stream": True,
+            "page_size": Config.VIDEO_PAGE_SIZE,
+            "projection": Config.CHILD_PROJECTION
+        }
+        if videos_only:
+            command["tiktok_id"] = account['tiktok_id']
+            command["sec_uid"] = account['sec_uid']
+        if since is not None:
+            command["since"] = since
+        received = False
+        stored = 0
+        failed_pages = 0
+        watermark = account.get('video_watermark') or 0
+        async with aclosing(session.stream_command(command)) as responses:
+            async for response in responses:
+                if response.get('status') != 'success':
+                    if not received:
+                        return response
+                    raise Exception(f"Error getting user videos: {response.get('message', 'Unknown error')}")
+                if response.get('elapsed_ms') is not None and proxy_id is not None:
+                    self.proxy_pool.record_delay(proxy_id, response['elapsed_ms'])
+                if not response.get('partial'):
+                    break
+                received = True
+                if response.get('kind') == 'user_info':
+                    user_info = response['data']
+                    await self.data_manager.insert_or_update_tiktok_account(account['account_name'], user_info)
+                    # 缓存最新的用户 ID，供之后的命令直接构造用户对象
+                    user = (user_info.get('userInfo') or {}).get('user') or {}
+                    account['tiktok_id'] = user.get('id') or account.get('tiktok_id')
+                    account['sec_uid'] = user.get('secUid') or account.get('sec_uid')
+                    account['profile_fetched_at'] = datetime.now()
+                else:
+                    # 每收到一页就写库，中途失败时已写入的页保留；只有写入成功的页才推进水位线
+                    if not await self.data_manager.insert_or_update_tiktok_video_details(response['data']):
+                        failed_pages += 1
+                        continue
+                    stored += len(response['data'])
+                    watermark = max([watermark] + [int(video.get('createTime') or 0) for video in response['data']])
+
+        full_sync = since is None
+        if videos_only:
+            # 没有写入资料，仍需更新 updated_at 以推迟账户的下次到期时间
+            await self.data_manager.set_comments(account['account_name'], '获取成功')
+        if failed_pages:
+            # 有页未写入时不推进水位线，下次增量抓取仍从原水位线开始，补回这些视频
+            Globals.logger.warning(f"{failed_pages} video pages of {account['unique_id']} failed to store, keeping watermark.", self.user)
+            return None
+        await self.data_manager.set_video_watermark(account['account_name'], watermark, full_sync)
+        account['video_watermark'] = watermark
+        if full_sync:
+            account['last_full_sync_at'] = datetime.now()
+        Globals.logger.debug(f"Stored {stored} videos for {account['unique_id']} ({'full' if full_sync else 'incremental'}).", self.user)
+        return None
 
     async def process_account(self, account):
-        """处理单个账户，包括获取用户信息和视频。"""
+        """处理单个账户，包括获取用户信息和视频。返回写入的抓取结果备注，失败时返回 None。"""
         unique_id = account['unique_id']
-        tiktok_id = account['tiktok_id']
         account_name = account['account_name']
 
         session = await self.get_available_session()
+        generation = session.generation
+        proxy_id = None
        
         try:
-            # 发送获取用户信息的命令到子进程
-            Globals.logger.info(f"{session.namespace} with {session.proxy['id']} {session.proxy['current_port']} is processing account {unique_id}", self.user)
-            command = {"action": "get_user_info", "username": unique_id, "tiktok_id": tiktok_id}
-            user_info = await session.send_command(command)
-            if user_info:
-                if user_info.get('status') != 'success':
-                    message = user_info.get('message', 'Unknown error')
-                    if message == "'user'":
-                        await self.data_manager.set_comments(account_name, '账号不存在')
-                        return
-                    elif message == "'id'":
-                        await self.data_manager.set_comments(account_name, '账号不存在')
-                        return
-                    elif 'No response from child process' in message:
-                        await session.rebuild_session()
-                        return
-                    elif 'TikTok returned an empty response' in message:
-                        if session.proxy:
-                            await self.data_manager.increase_proxy_fail(session.proxy['id'])
-                            await self.data_manager.increase_proxy_fail(session.proxy['id'])
-                        await session.rebuild_session()
-                        return
-                    else:
-                        Globals.logger.error(f"Unknown error getting user info: {message}", self.user)
-                        if session.proxy:
-                            await self.data_manager.increase_proxy_fail(session.proxy['id'])
-                        await session.rebuild_session()
-                        return
-
-                await self.data_manager.insert_or_update_tiktok_account(account_name, user_info['data'])
-
-                # 发送获取用户视频的命令到子进程
-                command = {"action": "get_user_videos", "username": unique_id}
-                user_videos = await session.send_command(command)
-                if user_videos and len(user_videos) > 0:
-                    await self.data_manager.insert_or_update_tiktok_video_details(user_videos['data'])
+            # 每条命令消耗其实际使用的代理的一个令牌，成败也记在该代理上
+            proxy_id = await self.acquire_request_budget(session)
+            # 资料和视频在同一条命令中获取
+            Globals.logger.info(f"{session.namespace} with {proxy_id} {session.proxy['current_port'] if session.proxy else None} is processing account {unique_id}", self.user)
+            error = await self.crawl_account(session, account, proxy_id)
+            if error:
+                message = error.get('message', 'Unknown error')
+                if message == "'user'":
+                    await self.data_manager.set_comments(account_name, '账号不存在')
+                    return '账号不存在'
+                elif message == "'id'":
+                    await self.data_manager.set_comments(account_name, '账号不存在')
+                    return '账号不存在'
+                elif 'No response from child process' in message:
+                    await self.rebuild_session(session, generation)
+                    return
+                elif 'TikTok returned an empty response' in message:
+                    # 空响应通常是代理被限流，熔断该代理并只换代理
+                    self.rate_limiter.record_throttled(proxy_id)
+                    if proxy_id is not None:
+                        self.proxy_pool.record_fail(proxy_id)
+                        self.proxy_pool.trip(proxy_id)
+                    await self.switch_proxy(session, generation)
+                    return
+                else:
+                    Globals.logger.error(f"Unknown error getting user info: {message}", self.user)
+                    self.rate_limiter.record_error(proxy_id)
+                    if proxy_id is not None:
+                        self.proxy_pool.record_fail(proxy_id)
+                    await self.switch_proxy(session, generation)
+                    return
 
             # 成功，增加代理的 success_count
-            if session.proxy:
-                await self.data_manager.increase_proxy_success(session.proxy['id'])
+            self.rate_limiter.record_success(proxy_id)
+            if proxy_id is not None:
+                self.proxy_pool.record_success(proxy_id)
+            return '获取成功'
         except Exception as e:
             Globals.logger.error(f"Error processing account {unique_id}: {e}", self.user)
             # 失败，增加代理的 fail_count，并重建会话
-            if session.proxy:
-                await self.data_manager.increase_proxy_fail(session.proxy['id'])
-            await session.rebuild_session()
+            self.rate_limiter.record_error(proxy_id)
+            if proxy_id is not None:
+                self.proxy_pool.record_fail(proxy_id)
+            await self.rebuild_session(session, generation)
         finally:
-            await asyncio.sleep(3)
-            await self.release_session(session)
+            self.session_pool.release(session)
@@ -41,7 +41,19 @@ CREATE TABLE tiktok_account (
 
     created_at DATETIME DEFAULT CURRENT_TIMESTAMP, -- 记录创建时间
     updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP, -- 记录更新时间
-    comments VARCHAR(64) -- 备注
+    comments VARCHAR(64), -- 备注
+    video_watermark BIGINT, -- 已抓取到的最新视频发布时间（Unix 时间戳），增量抓取的起点
+    last_full_sync_at DATETIME, -- 上次完整遍历视频列表的时间
+    profile_fetched_at DATETIME, -- 上次抓取账户资料的时间；只抓视频的轮次不更新
+    -- 下次到期时间，随每次写入 updated_at / comments 自动更新
+    next_due_at DATETIME AS (
+        updated_at + INTERVAL CASE comments
+            WHEN '获取失败' THEN 1800
+            WHEN '账号不存在' THEN 21600
+            ELSE 600
+        END SECOND
+    ) STORED,
+    INDEX idx_tiktok_account_next_due_at (next_due_at)
 );
 
 DROP TABLE IF EXISTS `tiktok_video_details`;
@@ -92,7 +104,9 @@ CREATE TABLE tiktok_relationship (
     end_date DATE,
     status BOOLEAN NOT NULL DEFAULT FALSE,
     creater_id BIGINT NOT NULL,
-    updated_at DATETIME
+    updated_at DATETIME,
+    INDEX idx_relationship_status_account_end (status, tiktok_account, end_date),
+    INDEX idx_relationship_updated_at (updated_at)
 );
 
 DROP TABLE IF EXISTS subscribe_url;
@@ -127,22 +141,8 @@ CREATE TABLE proxy_url (
     comments TEXT
 );
 
+-- avg_delay/delay_count 由程序按指数加权平均维护，不再使用按算术平均改写的触发器
 DROP TRIGGER IF EXISTS trg_proxy_url_before_update;
-DELIMITER $$
-CREATE TRIGGER trg_proxy_url_before_update
-BEFORE UPDATE ON proxy_url
-FOR EACH ROW
-BEGIN
-    IF NEW.current_delay IS NOT NULL THEN
-        SET @old_delay_count = IFNULL(OLD.delay_count, 0);
-        SET @old_avg_delay = IFNULL(OLD.avg_delay, 0);
-
-        SET NEW.delay_count = @old_delay_count + 1;
-
-        SET NEW.avg_delay = (@old_avg_delay * @old_delay_count + NEW.current_delay) / NEW.delay_count;
-    END IF;
-END$$
-DELIMITER ;
 
 DROP TABLE IF EXISTS test_speed_url;
 CREATE TABLE test_speed_url (
@@ -0,0 +1,11 @@
+# tests/conftest.py
+
+import os
+import sys
+import tempfile
+
+# 模块位于仓库根目录
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# custom_globals 导入时在当前目录下创建 environment/logs，测试在临时目录中运行，不污染仓库
+os.chdir(tempfile.mkdtemp(prefix='spider-tests-'))
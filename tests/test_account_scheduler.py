@@ -0,0 +1,157 @@
+# tests/test_account_scheduler.py
+
+import asyncio
+from datetime import datetime, timedelta
+
+from account_scheduler import AccountScheduler
+from config.config import Config
+
+def make_account(name, priority_time=0):
+    return {'account_name': name, 'unique_id': name, 'priority_time': priority_time}
+
+class FakeDataManager(object):
+    """只实现调度器用到的查询，按 next_due_at 返回账户，不连接数据库。"""
+    def __init__(self, accounts=None, next_due_at=None):
+        self.accounts = accounts or []
+        self.next_due_at = next_due_at
+        self.excluded = []
+        self.seeded = []
+        self.changes = set()
+        self.max_record_id = 0
+
+    async def get_active_tiktok_accounts(self, limit=None, exclude=None):
+        exclude = set(exclude or [])
+        self.excluded.append(exclude)
+        accounts = [dict(account) for account in self.accounts if account['account_name'] not in exclude]
+        return accounts[:limit] if limit is not None else accounts
+
+    async def get_account_schedule(self, account_names=None):
+        return [dict(account) for account in self.accounts]
+
+    async def get_max_relationship_id(self):
+        return self.max_record_id
+
+    async def get_relationship_changes(self, since_record_id, since_updated_at, expired_since=None):
+        changes, self.changes = self.changes, set()
+        return self.max_record_id, changes
+
+    async def seed_new_accounts(self, account_names=None):
+        self.seeded.append(None if account_names is None else set(account_names))
+        return True
+
+    async def get_next_due_at(self, tiktok_account):
+        return self.next_due_at
+
+def test_pop_due_in_due_time_order():
+    scheduler = AccountScheduler(FakeDataManager(), mode='heap')
+    scheduler.upsert(make_account('b', 20))
+    scheduler.upsert(make_account('a', 10))
+    scheduler.upsert(make_account('c', 30))
+
+    assert scheduler.pop_due(now=25)['account_name'] == 'a'
+    assert scheduler.pop_due(now=25)['account_name'] == 'b'
+    assert scheduler.pop_due(now=25) is None
+    assert scheduler.next_due_in(now=25) == 5
+    assert scheduler.inflight == {'a', 'b'}
+
+def test_upsert_keeps_in_memory_due_time():
+    scheduler = AccountScheduler(FakeDataManager(), mode='heap')
+    scheduler.upsert(make_account('a', 10))
+    scheduler.upsert(make_account('a', 0))
+
+    assert scheduler.pop_due(now=5) is None
+    assert scheduler.pop_due(now=10)['account_name'] == 'a'
+
+def test_full_reload_drops_inactive_accounts():
+    data_manager = FakeDataManager([make_account('a'), make_account('b')])
+    scheduler = AccountScheduler(data_manager, mode='heap')
+    asyncio.run(scheduler.refresh(force=True))
+    account = scheduler.pop_due(now=1)
+
+    data_manager.accounts = [make_account('c')]
+    scheduler.last_full_reload = 0
+    asyncio.run(scheduler.full_reload())
+    asyncio.run(scheduler.complete(account, '获取成功'))
+
+    assert set(scheduler.accounts) == {'c'}
+    assert not scheduler.inflight and not scheduler.removed
+
+def test_sql_mode_excludes_held_accounts_from_limit(monkeypatch):
+    monkeypatch.setattr(Config, 'ACCOUNT_QUEUE_SIZE', 2)
+    data_manager = FakeDataManager([make_account(name) for name in 'abcd'])
+    scheduler = AccountScheduler(data_manager, mode='sql')
+
+    asyncio.run(scheduler.load_due())
+    first = scheduler.pop_due(now=1)
+    asyncio.run(scheduler.complete(first, None))  # 失败，留在堆中等待重试
+    second = scheduler.pop_due(now=1)  # 处理中
+    asyncio.run(scheduler.load_due())
+
+    # 等待重试和处理中的账户仍是到期状态，不能再占用这一批的名额
+    assert data_manager.excluded[-1] == {first['account_name'], second['account_name']}
+    assert set(scheduler.accounts) == {first['account_name'], 'c', 'd'}
+
+def test_failed_account_is_retried_after_delay(monkeypatch):
+    monkeypatch.setattr(Config, 'ACCOUNT_RETRY_DELAY', 60)
+    scheduler = AccountScheduler(FakeDataManager(), mode='heap')
+    scheduler.upsert(make_account('a'))
+    account = scheduler.pop_due(now=1)
+
+    asyncio.run(scheduler.complete(account, None))
+
+    assert scheduler.next_due_in() > 59
+
+def test_success_takes_due_time_from_next_due_at(monkeypatch):
+    monkeypatch.setattr(Config, 'ACCOUNT_RETRY_DELAY', 60)
+    next_due_at = datetime.now() + timedelta(hours=1)
+    scheduler = AccountScheduler(FakeDataManager(next_due_at=next_due_at), mode='heap')
+    scheduler.upsert(make_account('a'))
+    account = scheduler.pop_due(now=1)
+
+    asyncio.run(scheduler.complete(account, '获取成功'))
+
+    assert scheduler.accounts['a']['priority_time'] == next_due_at.timestamp()
+
+def test_success_with_stale_next_due_at_is_not_refetched_immediately(monkeypatch):
+    monkeypatch.setattr(Config, 'ACCOUNT_RETRY_DELAY', 60)
+    scheduler = AccountScheduler(FakeDataManager(next_due_at=datetime.now() - timedelta(hours=1)), mode='heap')
+    scheduler.upsert(make_account('a'))
+    account = scheduler.pop_due(now=1)
+
+    asyncio.run(scheduler.complete(account, '获取成功'))
+
+    assert scheduler.next_due_in() > 59
+
+def test_sql_mode_success_leaves_due_time_to_database():
+    scheduler = AccountScheduler(FakeDataManager(), mode='sql')
+    scheduler.upsert(make_account('a'))
+    account = scheduler.pop_due(now=1)
+
+    asyncio.run(scheduler.complete(account, '获取成功'))
+
+    assert not scheduler.accounts and not scheduler.inflight
+
+def test_account_removed_while_inflight_is_not_rescheduled():
+    scheduler = AccountScheduler(FakeDataManager(), mode='heap')
+    scheduler.upsert(make_account('a'))
+    account = scheduler.pop_due(now=1)
+
+    scheduler.remove('a')
+    asyncio.run(scheduler.complete(account, None))
+
+    assert not scheduler.accounts and not scheduler.removed
+
+def test_sql_mode_seeds_new_accounts_from_relationship_deltas_only():
+    data_manager = FakeDataManager()
+    data_manager.max_record_id = 10
+    scheduler = AccountScheduler(data_manager, mode='sql')
+
+    asyncio.run(scheduler.load_due())
+    data_manager.changes = {'new'}
+    data_manager.max_record_id = 11
+    asyncio.run(scheduler.load_due())
+    asyncio.run(scheduler.load_due())
+
+    # 只在启动时检查全部关系，之后只检查增量中的账户
+    assert data_manager.seeded == [None, {'new'}, set()]
+    assert scheduler.last_record_id == 11
@@ -0,0 +1,151 @@
+# tests/test_child_process.py
+
+import asyncio
+import json
+from contextlib import aclosing
+
+import pytest
+
+from child_process import ChildProcess, ResponseStream
+from config.config import Config
+
+class FakeStdin(object):
+    """记录父进程写给子进程的每一行命令。"""
+    def __init__(self):
+        self.messages = []
+
+    def write(self, data):
+        for line in data.decode().splitlines():
+            self.messages.append(json.loads(line))
+
+    async def drain(self):
+        pass
+
+    def is_closing(self):
+        return False
+
+class FakeProcess(object):
+    def __init__(self):
+        self.returncode = None
+        self.stdin = FakeStdin()
+
+def make_child():
+    child = ChildProcess(user='test', timeout=1)
+    child.process = FakeProcess()
+    return child
+
+def commands(child, action=None):
+    return [message for message in child.process.stdin.messages if action is None or message.get('action') == action]
+
+async def wait_for_command(child, count=1):
+    while len(commands(child)) < count:
+        await asyncio.sleep(0)
+    return commands(child)[count - 1]
+
+def test_send_command_matches_responses_by_id():
+    async def run():
+        child = make_child()
+        first = asyncio.create_task(child.send_command({"action": "health"}))
+        second = asyncio.create_task(child.send_command({"action": "health"}))
+        first_id = (await wait_for_command(child, 1))['id']
+        second_id = (await wait_for_command(child, 2))['id']
+        # 乱序返回
+        child.dispatch({"id": second_id, "status": "success", "data": 2})
+        child.dispatch({"id": first_id, "status": "success", "data": 1})
+        return await first, await second, child
+
+    first, second, child = asyncio.run(run())
+    assert (first['data'], second['data']) == (1, 2)
+    assert child.inflight == 0
+
+def test_stream_returns_credit_per_delivered_partial():
+    async def run():
+        child = make_child()
+        received = []
+        async def consume():
+            async with aclosing(child.stream_command({"action": "crawl_account"})) as responses:
+                async for response in responses:
+                    received.append(response)
+        task = asyncio.create_task(consume())
+        command = await wait_for_command(child)
+        for page in range(3):
+            child.dispatch({"id": command['id'], "partial": True, "status": "success", "data": [page]})
+        child.dispatch({"id": command['id'], "status": "success", "data": {"count": 3}})
+        await asyncio.wait_for(task, 1)
+        return child, command, received
+
+    child, command, received = asyncio.run(run())
+    assert command['window'] == Config.CHILD_STREAM_QUEUE_SIZE
+    assert [response.get('data') for response in received] == [[0], [1], [2], {"count": 3}]
+    assert commands(child, 'stream_credit') == [{"action": "stream_credit", "stream": command['id']}] * 3
+    assert child.inflight == 0
+
+def test_slow_stream_consumer_does_not_block_other_commands():
+    async def run():
+        child = make_child()
+        stream = child.stream_command({"action": "crawl_account"})
+        first = asyncio.create_task(stream.__anext__())
+        stream_id = (await wait_for_command(child, 1))['id']
+        # 流的消费者取走第一条后不再读取，子进程继续发送
+        for page in range(Config.CHILD_STREAM_QUEUE_SIZE):
+            child.dispatch({"id": stream_id, "partial": True, "status": "success", "data": [page]})
+        await first
+        health = asyncio.create_task(child.send_command({"action": "health"}))
+        health_id = (await wait_for_command(child, 3))['id']
+        child.dispatch({"id": health_id, "status": "success", "data": []})
+        response = await asyncio.wait_for(health, 1)
+        await stream.aclose()
+        return response
+
+    assert asyncio.run(run())['status'] == 'success'
+
+def test_abandoned_stream_is_cancelled_and_late_frames_dropped():
+    async def run():
+        child = make_child()
+        async with aclosing(child.stream_command({"action": "crawl_account"})) as responses:
+            task = asyncio.create_task(responses.__anext__())
+            stream_id = (await wait_for_command(child))['id']
+            child.dispatch({"id": stream_id, "partial": True, "status": "success", "data": [0]})
+            await task
+        inflight = child.inflight
+        abandoned = set(child.abandoned)
+        child.dispatch({"id": stream_id, "partial": True, "status": "success", "data": [1]})
+        child.dispatch({"id": stream_id, "status": "error", "message": "Cancelled"})
+        return child, stream_id, inflight, abandoned
+
+    child, stream_id, inflight, abandoned = asyncio.run(run())
+    assert inflight == 0
+    assert abandoned == {stream_id}
+    assert commands(child, 'cancel_stream') == [{"action": "cancel_stream", "stream": stream_id}]
+    assert not child.abandoned
+
+def test_fail_pending_fails_waiting_streams():
+    async def run():
+        child = make_child()
+        async def consume():
+            async with aclosing(child.stream_command({"action": "crawl_account"})) as responses:
+                async for response in responses:
+                    pass
+        task = asyncio.create_task(consume())
+        await wait_for_command(child)
+        child.fail_pending(Exception("Child process exited"))
+        await asyncio.wait_for(task, 1)
+
+    with pytest.raises(Exception, match="Child process exited"):
+        asyncio.run(run())
+
+def test_response_stream_delivers_queued_messages_before_error():
+    async def run():
+        stream = ResponseStream()
+        stream.put({"partial": True, "data": [0]})
+        stream.fail(Exception("boom"))
+        message = await stream.get(1)
+        with pytest.raises(Exception, match="boom"):
+            await stream.get(1)
+        return message
+
+    assert asyncio.run(run())['data'] == [0]
+
+def test_response_stream_times_out():
+    with pytest.raises(Exception, match="Timed out"):
+        asyncio.run(ResponseStream().get(0.01))
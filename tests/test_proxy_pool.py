@@ -0,0 +1,198 @@
+# tests/test_proxy_pool.py
+
+import asyncio
+
+from circuit_breaker import CircuitBreaker
+from config.config import Config
+from proxy_pool import ProxyPool
+
+def make_row(proxy_id, avg_delay=0, delay_count=0, success_count=0, fail_count=0):
+    return {
+        'id': proxy_id,
+        'current_port': 10000 + proxy_id,
+        'success_count': success_count,
+        'fail_count': fail_count,
+        'avg_delay': avg_delay,
+        'delay_count': delay_count,
+    }
+
+class FakeDataManager(object):
+    """记录代理池的写回调用；ok 为 False 时模拟写入失败。"""
+    def __init__(self, rows):
+        self.rows = rows
+        self.ok = True
+        self.in_use = []
+        self.delays = []
+        self.counts = []
+
+    async def get_proxy_pool(self):
+        return [dict(row) for row in self.rows]
+
+    async def set_proxies_in_use(self, ids, flag):
+        self.in_use.append((sorted(ids), flag))
+        return self.ok
+
+    async def set_proxy_delays(self, delays):
+        self.delays.append(delays)
+        return self.ok
+
+    async def add_proxy_counts(self, deltas):
+        self.counts.append(deltas)
+        return self.ok
+
+async def checkout_all(pool):
+    proxies = []
+    while True:
+        proxy = await pool.checkout()
+        if proxy is None:
+            return proxies
+        proxies.append(proxy['id'])
+
+def test_checkout_prefers_lowest_expected_latency():
+    pool = ProxyPool(FakeDataManager([
+        make_row(1, avg_delay=3000, delay_count=10),
+        make_row(2, avg_delay=500, delay_count=10),
+        make_row(3, avg_delay=1000, delay_count=10),
+    ]))
+
+    assert asyncio.run(checkout_all(pool)) == [2, 3, 1]
+
+def test_release_reinserts_with_new_score():
+    async def run():
+        pool = ProxyPool(FakeDataManager([make_row(1, 500, 10), make_row(2, 1000, 10)]))
+        proxy = await pool.checkout()
+        pool.record_delay(proxy['id'], 20000)
+        pool.release(proxy['id'])
+        return await checkout_all(pool)
+
+    assert asyncio.run(run()) == [2, 1]
+
+def test_breaker_trips_after_consecutive_failures(monkeypatch):
+    monkeypatch.setattr(Config, 'PROXY_BREAKER_FAILURES', 3)
+    async def run():
+        pool = ProxyPool(FakeDataManager([make_row(1)]))
+        proxy = await pool.checkout()
+        for _ in range(3):
+            pool.record_fail(proxy['id'])
+        pool.release(proxy['id'])
+        return pool, await pool.checkout()
+
+    pool, proxy = asyncio.run(run())
+    assert proxy is None
+    assert pool.proxies[1]['breaker'].state == CircuitBreaker.OPEN
+    assert pool.pending_counts[1] == [0, 3]
+
+def test_empty_response_counts_one_failure_and_trips(monkeypatch):
+    monkeypatch.setattr(Config, 'PROXY_BREAKER_FAILURES', 3)
+    async def run():
+        pool = ProxyPool(FakeDataManager([make_row(1)]))
+        proxy = await pool.checkout()
+        # Spider.process_account 处理空响应的方式
+        pool.record_fail(proxy['id'])
+        pool.trip(proxy['id'])
+        return pool
+
+    pool = asyncio.run(run())
+    breaker = pool.proxies[1]['breaker']
+    assert breaker.state == CircuitBreaker.OPEN and breaker.trips == 1
+    assert pool.proxies[1]['fail_count'] == 1
+    assert pool.pending_counts[1] == [0, 1]
+
+def test_successful_probe_returns_proxy_to_heap(monkeypatch):
+    async def probe_ok(port):
+        return True
+    monkeypatch.setattr('proxy_pool.probe_proxy', probe_ok)
+    async def run():
+        pool = ProxyPool(FakeDataManager([make_row(1)]))
+        proxy = await pool.checkout()
+        pool.trip(proxy['id'])
+        pool.release(proxy['id'])
+        assert await pool.checkout() is None
+        breaker = pool.proxies[1]['breaker']
+        breaker.open_until = 0
+        breaker.start_probe()
+        await pool.probe(pool.proxies[1])
+        return await pool.checkout()
+
+    assert asyncio.run(run())['id'] == 1
+
+def test_flush_writes_state_in_batches():
+    async def run():
+        data_manager = FakeDataManager([make_row(1), make_row(2)])
+        pool = ProxyPool(data_manager)
+        first = await pool.checkout()
+        second = await pool.checkout()
+        pool.record_success(first['id'])
+        pool.record_delay(first['id'], 800)
+        pool.release(second['id'])
+        await pool.flush()
+        return data_manager, pool, first['id'], second['id']
+
+    data_manager, pool, first, second = asyncio.run(run())
+    assert data_manager.in_use == [([first], True), ([second], False)]
+    assert data_manager.counts == [[{'id': first, 'success': 1, 'fail': 0}]]
+    assert data_manager.delays[0][0]['id'] == first
+    assert not pool.dirty and not pool.dirty_delays and not pool.pending_counts
+
+def test_flush_requeues_failed_writes():
+    async def run():
+        data_manager = FakeDataManager([make_row(1)])
+        pool = ProxyPool(data_manager)
+        proxy = await pool.checkout()
+        pool.record_fail(proxy['id'])
+        pool.record_delay(proxy['id'], 800)
+        data_manager.ok = False
+        await pool.flush()
+        return pool
+
+    pool = asyncio.run(run())
+    assert pool.dirty == {1: True}
+    assert pool.dirty_delays == {1}
+    assert pool.pending_counts == {1: [0, 1]}
+
+def test_flush_keeps_newer_is_using_written_during_failed_flush():
+    async def run():
+        data_manager = FakeDataManager([make_row(1)])
+        pool = ProxyPool(data_manager)
+        proxy = await pool.checkout()
+        data_manager.ok = False
+        original = data_manager.set_proxies_in_use
+        async def release_during_write(ids, flag):
+            pool.release(proxy['id'])
+            return await original(ids, flag)
+        data_manager.set_proxies_in_use = release_during_write
+        await pool.flush()
+        return pool
+
+    assert asyncio.run(run()).dirty == {1: False}
+
+def test_breaker_quarantine_doubles_up_to_max(monkeypatch):
+    monkeypatch.setattr(Config, 'PROXY_BREAKER_BASE_QUARANTINE', 60)
+    monkeypatch.setattr(Config, 'PROXY_BREAKER_MAX_QUARANTINE', 200)
+    breaker = CircuitBreaker()
+
+    assert breaker.trip(0) == 60
+    assert breaker.due_for_probe(60)
+    breaker.start_probe()
+    assert breaker.finish_probe(False, 60) == 120
+    breaker.start_probe()
+    assert breaker.finish_probe(False, 180) == 200
+
+def test_breaker_ignores_failures_while_open(monkeypatch):
+    monkeypatch.setattr(Config, 'PROXY_BREAKER_FAILURES', 2)
+    breaker = CircuitBreaker()
+
+    assert breaker.record_failure(0) == 0
+    assert breaker.record_failure(0) > 0
+    assert breaker.record_failure(0) == 0
+    assert breaker.trips == 1
+
+def test_breaker_success_after_recovery_resets_backoff():
+    breaker = CircuitBreaker()
+    breaker.trip(0)
+    breaker.start_probe()
+    breaker.finish_probe(True, 100)
+
+    assert breaker.is_closed and breaker.trips == 1
+    breaker.record_success()
+    assert breaker.trips == 0
@@ -0,0 +1,81 @@
+# tests/test_resource_blocker.py
+
+import asyncio
+
+import pytest
+
+# playwright_session 在导入时需要 TikTokApi
+pytest.importorskip("TikTokApi")
+
+from playwright_session import ResourceBlocker
+
+class FakeRequest(object):
+    def __init__(self, resource_type, url="https://www.tiktok.com/"):
+        self.resource_type = resource_type
+        self.url = url
+
+class FakeRoute(object):
+    def __init__(self):
+        self.action = None
+
+    async def abort(self):
+        self.action = "abort"
+
+    async def fallback(self):
+        self.action = "fallback"
+
+class FakeRouter(object):
+    """记录 route / unroute 调用；request 模拟 Playwright 先查页面路由、再查上下文路由。"""
+    def __init__(self):
+        self.routes = {}
+
+    async def route(self, pattern, handler):
+        self.routes[pattern] = handler
+
+    async def unroute(self, pattern):
+        self.routes.pop(pattern, None)
+
+class FakeSession(object):
+    def __init__(self):
+        self.page = FakeRouter()
+        self.context = FakeRouter()
+        # TikTokApi 按 suppress_resource_load_types 在页面上安装的路由
+        async def suppress(route, request):
+            await route.abort()
+        self.page.routes["**/*"] = suppress
+
+    async def request(self, request):
+        route = FakeRoute()
+        handler = self.page.routes.get("**/*") or self.context.routes.get("**/*")
+        await handler(route, request)
+        return route.action
+
+def test_blocker_counts_requests_after_creation():
+    async def run():
+        blocker = ResourceBlocker("all")
+        session = FakeSession()
+        await blocker.install_session(0, session)
+        actions = [
+            await session.request(FakeRequest("image")),
+            await session.request(FakeRequest("script", "https://www.google-analytics.com/analytics.js")),
+            await session.request(FakeRequest("xhr", "https://www.tiktok.com/api/post/item_list/")),
+        ]
+        return blocker, actions
+
+    blocker, actions = asyncio.run(run())
+    stats = blocker.snapshot(0)
+    assert actions == ["abort", "abort", "fallback"]
+    assert stats["seen"] == 3 and stats["blocked"] == 2
+    assert stats["estimated_bytes_saved"] == ResourceBlocker.ESTIMATED_BYTES["image"] + ResourceBlocker.ESTIMATED_BYTES["analytics"]
+    assert stats["by_type"] == {"image": 1, "analytics": 1}
+
+def test_media_mode_lets_analytics_through():
+    async def run():
+        blocker = ResourceBlocker("media")
+        session = FakeSession()
+        await blocker.install_session(0, session)
+        return blocker, await session.request(FakeRequest("script", "https://www.google-analytics.com/analytics.js"))
+
+    blocker, action = asyncio.run(run())
+    assert action == "fallback"
+    assert blocker.snapshot(0)["blocked"] == 0
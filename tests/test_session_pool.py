@@ -0,0 +1,142 @@
+# tests/test_session_pool.py
+
+import asyncio
+
+from session_pool import SessionPool
+
+class FakeSession(object):
+    def __init__(self, name, max_inflight=1):
+        self.name = name
+        self.max_inflight = max_inflight
+        self.active = 0
+        self.ready = True
+
+    def is_ready(self):
+        return self.ready
+
+    def __repr__(self):
+        return self.name
+
+def test_checkout_uses_every_slot_then_waits():
+    async def run():
+        pool = SessionPool()
+        session = FakeSession('a', max_inflight=2)
+        pool.add(session)
+        first = await pool.checkout()
+        second = await pool.checkout()
+        waiter = asyncio.create_task(pool.checkout())
+        await asyncio.sleep(0)
+        assert not waiter.done()
+        pool.release(first)
+        third = await asyncio.wait_for(waiter, 1)
+        return session, [first, second, third]
+
+    session, checked_out = asyncio.run(run())
+    assert checked_out == [session] * 3
+    assert session.active == 2
+
+def test_waiters_are_served_first_come_first_served():
+    async def run():
+        pool = SessionPool()
+        session = FakeSession('a')
+        pool.add(session)
+        await pool.checkout()
+        order = []
+        async def worker(name):
+            order.append((name, await pool.checkout()))
+            pool.release(session)
+        tasks = [asyncio.create_task(worker(name)) for name in range(3)]
+        await asyncio.sleep(0)
+        pool.release(session)
+        await asyncio.wait_for(asyncio.gather(*tasks), 1)
+        return [name for name, _ in order]
+
+    assert asyncio.run(run()) == [0, 1, 2]
+
+def test_rebuilding_session_is_parked_and_resumed():
+    async def run():
+        pool = SessionPool()
+        rebuilding = FakeSession('rebuilding')
+        healthy = FakeSession('healthy')
+        pool.add(rebuilding)
+        pool.add(healthy)
+        rebuilding.ready = False
+        first = await pool.checkout()
+        waiter = asyncio.create_task(pool.checkout())
+        await asyncio.sleep(0)
+        assert not waiter.done()
+        rebuilding.ready = True
+        pool.resume(rebuilding)
+        return first, await asyncio.wait_for(waiter, 1)
+
+    first, second = asyncio.run(run())
+    assert (first.name, second.name) == ('healthy', 'rebuilding')
+
+def test_removed_session_slots_are_skipped():
+    async def run():
+        pool = SessionPool()
+        removed = FakeSession('removed')
+        kept = FakeSession('kept')
+        pool.add(removed)
+        pool.add(kept)
+        pool.remove(removed)
+        session = await pool.checkout()
+        pool.release(removed)
+        return pool, session
+
+    pool, session = asyncio.run(run())
+    assert session.name == 'kept'
+    assert list(pool) == [session] and not pool.idle
+
+def test_cancelled_waiter_returns_its_slot():
+    async def run():
+        pool = SessionPool()
+        session = FakeSession('a')
+        pool.add(session)
+        await pool.checkout()
+        waiter = asyncio.create_task(pool.checkout())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.sleep(0)
+        pool.release(session)
+        return session, await asyncio.wait_for(pool.checkout(), 1)
+
+    session, checked_out = asyncio.run(run())
+    assert checked_out is session
+
+def test_metrics_count_queued_checkouts():
+    async def run():
+        pool = SessionPool()
+        session = FakeSession('a')
+        pool.add(session)
+        await pool.checkout()
+        waiter = asyncio.create_task(pool.checkout())
+        await asyncio.sleep(0)
+        pool.release(session)
+        await waiter
+        return pool.metrics.snapshot()
+
+    metrics = asyncio.run(run())
+    assert metrics['checkouts'] == 2 and metrics['waited'] == 1
+
+def test_child_exiting_while_idle_triggers_rebuild():
+    async def run():
+        parked = []
+        async def rebuild(session):
+            await asyncio.sleep(0)
+            session.ready = True
+            pool.resume(session)
+        def on_park(session):
+            parked.append(session)
+            asyncio.create_task(rebuild(session))
+        pool = SessionPool(on_park=on_park)
+        session = FakeSession('a', max_inflight=2)
+        pool.add(session)
+        # 子进程在会话空闲时退出，槽位仍在空闲队列中
+        session.ready = False
+        checked_out = await asyncio.wait_for(pool.checkout(), 1)
+        return parked, session, checked_out
+
+    parked, session, checked_out = asyncio.run(run())
+    assert parked == [session, session]
+    assert checked_out is session